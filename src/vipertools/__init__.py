@@ -1,8 +1,13 @@
 import os
 from importlib.metadata import version
 
+from vipertools import _lazy
+
 __version__ = version("vipertools")
 
-from . import graph
-from . import mstools
-from . import security
+# Subpackages are imported on first access, importing vipertools alone doesn't load the azure and graph SDKs.
+__getattr__, __dir__ = _lazy.exports(__name__, {
+    "graph": "graph",
+    "mstools": "mstools",
+    "security": "security"
+})
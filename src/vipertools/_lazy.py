@@ -0,0 +1,82 @@
+# Deferred imports, so that importing vipertools only pays for the modules that are actually used.
+
+import sys
+import importlib
+
+from typing import Callable
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported the first time one of its attributes is used, ie.
+
+        np = LazyModule("numpy")
+        np.zeros(3)  # numpy is imported here
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"LazyModule({self._name}, {state})"
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+
+        return self._module
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._load(), name, value)
+
+
+def module(name: str) -> LazyModule:
+    """
+    Module imported on first use.
+    """
+    return LazyModule(name)
+
+
+def exports(package: str, names: dict[str, str]) -> tuple[Callable, Callable]:
+    """
+    Module __getattr__ and __dir__ functions for a package whose public names are only imported when accessed.
+
+    Parameters
+    ----------
+    package: str
+        Name of the package, ie. __name__.
+    names: dict[str, str]
+        Public name mapped to the module, relative to the package, that defines it. A name mapped to itself is a
+        subpackage or submodule.
+
+    Returns tuple[Callable, Callable]
+    -------
+        __getattr__ and __dir__ for the package module.
+    """
+
+    def __getattr__(name: str):
+        if name not in names:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+        target = importlib.import_module(f".{names[name]}", package)
+        value = target if names[name] == name else getattr(target, name)
+
+        # Later lookups find the name in the package itself
+        setattr(sys.modules[package], name, value)
+
+        return value
+
+    def __dir__() -> list[str]:
+        return sorted(set(vars(sys.modules[package])) | set(names))
+
+    return __getattr__, __dir__
+
+
+# graphviper pulls in dask.distributed, by far the heaviest import, it is only loaded once something is logged.
+logger = module("graphviper.utils.logger")
+parameter = module("graphviper.utils.parameter")
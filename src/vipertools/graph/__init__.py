@@ -1,2 +1,7 @@
-from .graph import GraphQuery
-from .handler import error
\ No newline at end of file
+from vipertools import _lazy
+
+__getattr__, __dir__ = _lazy.exports(__name__, {
+    "GraphQuery": "graph",
+    "Metrics": "metrics",
+    "error": "handler"
+})
@@ -0,0 +1,267 @@
+# Helpers for packing graph requests into JSON $batch calls.
+
+import random
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Iterator, Union
+
+from vipertools.graph import codes as status_code
+
+# Maximum number of sub-requests graph accepts in a single $batch call
+BATCH_LIMIT = 20
+
+# Responses that tell the client to slow down, the request was not processed and can be sent again.
+THROTTLE_CODES = (
+    status_code.TOO_MANY_REQUESTS,
+    status_code.SERVICE_UNAVAILABLE
+)
+
+# Transient failures after which the server may already have applied the request
+TRANSIENT_CODES = (
+    status_code.INTERNAL_SERVER_ERROR,
+    status_code.GATEWAY_TIMEOUT
+)
+
+# Methods whose requests can be sent twice with the same outcome. A DELETE sent again after it was applied fails with
+# NOT_FOUND, so it is not retried either.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT")
+
+
+def relative_url(url: str, hostname: str, version: str) -> str:
+    """
+    Sub-request urls are relative to the graph version root, ie. /me/drive/items/{id}/createLink.
+
+    Parameters
+    ----------
+    url: str
+        Absolute or already relative request url.
+    hostname: str
+        Graph hostname.
+    version: str
+        Graph api version.
+
+    Returns str
+    -------
+        Url relative to the version root
+    """
+    for prefix in (f"https://{hostname}/{version}", f"http://{hostname}/{version}"):
+        if url.startswith(prefix):
+            return url[len(prefix):]
+
+    return url
+
+
+def prepare(sub_requests: list[dict], hostname: str, version: str) -> dict[str, dict]:
+    """
+    Copy sub-requests into the form a $batch call takes: every one gets an id, its position in the list if it has
+    none, a url relative to the version root and a json content type if it has a body.
+
+    Parameters
+    ----------
+    sub_requests: list[dict]
+        Sub-requests with keys "method", "url" and optionally "id", "body" and "headers".
+    hostname: str
+        Graph hostname.
+    version: str
+        Graph api version.
+
+    Returns dict[str, dict]
+    -------
+        Sub-requests indexed by id
+    """
+    pending = {}
+    for i, request in enumerate(sub_requests):
+        request = dict(request)
+        request["id"] = str(request.get("id", i))
+        request["url"] = relative_url(request["url"], hostname=hostname, version=version)
+
+        if "body" in request:
+            request.setdefault("headers", {"Content-Type": "application/json"})
+
+        pending[request["id"]] = request
+
+    return pending
+
+
+def results(response, sub_requests: list[dict]) -> dict[str, dict]:
+    """
+    Demultiplex the response of a $batch call by sub-request id. If the call itself failed every sub-request gets its
+    status and error, along with its headers so that a Retry-After is honored.
+
+    Parameters
+    ----------
+    response: requests.Response | httpx.Response
+        Response of the $batch call.
+    sub_requests: list[dict]
+        Sub-requests sent in the call.
+
+    Returns dict[str, dict]
+    -------
+        Sub-responses, each with keys "status", "headers" and "body", indexed by sub-request id
+    """
+    if response.status_code != status_code.OK:
+        try:
+            body = response.json()
+
+        except ValueError:
+            body = None
+
+        result = failed(response.status_code, body)
+        result["headers"] = dict(response.headers)
+
+        return {request["id"]: result for request in sub_requests}
+
+    responses = {
+        result["id"]: {
+            "status": result["status"],
+            "headers": result.get("headers", {}),
+            "body": result.get("body")
+        } for result in response.json()["responses"]
+    }
+
+    # A sub-request without a sub-response shouldn't happen, but make it retryable rather than lose it.
+    for request in sub_requests:
+        responses.setdefault(request["id"], failed(status_code.SERVICE_UNAVAILABLE, None))
+
+    return responses
+
+
+def settle(
+        pending: dict[str, dict],
+        sub_responses: dict[str, dict],
+        responses: dict[str, dict],
+        attempt: int,
+        max_retries: int,
+        metrics=None
+) -> tuple[dict[str, dict], float]:
+    """
+    Keep the sub-responses of a round of $batch calls and pick the sub-requests to send again.
+
+    Parameters
+    ----------
+    pending: dict[str, dict]
+        Sub-requests of the round indexed by id, see prepare().
+    sub_responses: dict[str, dict]
+        Sub-responses the round got, see results().
+    responses: dict[str, dict]
+        Sub-responses kept so far, updated in place.
+    attempt: int
+        Number of rounds before this one.
+    max_retries: int
+        Number of times a failed sub-request is retried.
+    metrics: Metrics (default None)
+        Metrics the sub-requests are recorded in, each under its own endpoint.
+
+    Returns tuple[dict[str, dict], float]
+    -------
+        Sub-requests to retry indexed by id, and the delay before retrying them
+    """
+    retry = {}
+    delay = 0.0
+
+    for request_id, result in sub_responses.items():
+        responses[request_id] = result
+
+        # Only the $batch call itself is timed, its sub-requests are counted by their own endpoint
+        if metrics is not None:
+            metrics.request(
+                pending[request_id]["method"], pending[request_id]["url"], "",
+                status=result["status"],
+                seconds=None,
+                attempt=attempt
+            )
+
+        if retryable(result["status"], pending[request_id]["method"]) and attempt < max_retries:
+            retry[request_id] = pending[request_id]
+            delay = max(delay, retry_after(result.get("headers"), attempt=attempt))
+
+    return retry, delay
+
+
+def retryable(status: int, method: str) -> bool:
+    """
+    Tell whether a request that failed with status can be sent again. A throttled request was not processed and is
+    retried whatever its method; after a transient failure only an idempotent request is, since a POST answered with a
+    504, ie. createLink or createUploadSession, may have been applied already.
+
+    Parameters
+    ----------
+    status: int
+        Status code of the response.
+    method: str
+        HTTP method of the request.
+
+    Returns bool
+    -------
+
+    """
+    if status in THROTTLE_CODES:
+        return True
+
+    return status in TRANSIENT_CODES and method.upper() in IDEMPOTENT_METHODS
+
+
+def chunk(requests: list[dict], size: int = BATCH_LIMIT) -> Iterator[list[dict]]:
+    """
+    Split sub-requests into groups of at most size.
+    """
+    for i in range(0, len(requests), size):
+        yield requests[i:i + size]
+
+
+def retry_after(headers: dict, attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Delay before retrying a request. The Retry-After header is honored if present, either as seconds or as an HTTP
+    date; otherwise an exponential backoff with full jitter is used.
+
+    Parameters
+    ----------
+    headers: dict
+        Response headers.
+    attempt: int
+        Number of attempts made so far.
+    base: float
+        Base backoff delay in seconds.
+    cap: float
+        Maximum backoff delay in seconds.
+
+    Returns float
+    -------
+        Delay in seconds
+    """
+    value = header(headers, "Retry-After")
+
+    if value is not None:
+        try:
+            return max(float(value), 0.0)
+
+        except ValueError:
+            try:
+                return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+            except (TypeError, ValueError):
+                pass
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def failed(status: int, body: Union[dict, None]) -> dict:
+    """
+    Build a sub-response for a sub-request that never got one, ie. when the whole $batch call failed.
+    """
+    if not isinstance(body, dict) or "error" not in body:
+        body = {"error": {"code": "batchRequestFailed", "message": f"$batch call failed with status {status}"}}
+
+    return {"status": status, "headers": {}, "body": body}
+
+
+def header(headers: dict, name: str) -> Union[str, None]:
+    """
+    Case-insensitive header lookup. Sub-response headers are a plain dictionary, unlike the headers of a response.
+    """
+    for key, value in (headers or {}).items():
+        if key.lower() == name.lower():
+            return value
+
+    return None
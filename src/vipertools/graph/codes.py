@@ -2,6 +2,9 @@
 
 OK = 200
 CREATED = 201
+ACCEPTED = 202
+NO_CONTENT = 204
+PARTIAL_CONTENT = 206
 FILE_FOUND = 302
 BAD_REQUEST = 400
 UNAUTHORIZED = 401
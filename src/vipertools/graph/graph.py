@@ -1,21 +1,31 @@
 import os
-import rich
-import asyncio
+import time
+import base64
+import itertools
+import threading
 import requests
 import pathlib
 import configparser
+import urllib.parse
 
-from graphviper.utils import logger
-from graphviper.utils import parameter
+from vipertools._lazy import logger
+from vipertools._lazy import parameter
 
 from vipertools.graph import codes as status_code
 from vipertools.graph import handler
+from vipertools.graph import batch as graph_batch
+from vipertools.graph import metrics as graph_metrics
+from vipertools.graph.metrics import Metrics
+from vipertools.graph.session import SessionPool
+from vipertools.graph.scheduler import Scheduler
+from vipertools.graph.token import TokenCache, expiry
 
-from azure.identity import DeviceCodeCredential
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Awaitable, Callable, Union
 
-from msgraph import GraphServiceClient
-
-from typing import Union
+# The azure and msgraph clients are only needed to sign in, they are imported when a token has to be requested.
+if TYPE_CHECKING:
+    from azure.identity import AuthenticationRecord, DeviceCodeCredential
 
 
 class GraphQuery:
@@ -28,12 +38,33 @@ class GraphQuery:
         "config_file",
         "config",
         "hostname",
+        "scheme",
         "version",
         "app_token",
-        "header"
+        "header",
+        "pool",
+        "scheduler",
+        "metrics",
+        "token_cache",
+        "refresh_timer",
+        "connected"
     ]
 
-    def __init__(self, verbose: bool = False):
+    def __init__(
+            self,
+            verbose: bool = False,
+            pool_connections: int = None,
+            pool_maxsize: int = None,
+            pool_block: bool = None,
+            keep_alive: bool = None,
+            timeout: float = None,
+            max_concurrency: int = None,
+            hostname: str = None,
+            scheme: str = None,
+            app_token: str = None,
+            metrics: Union[Metrics, bool, None] = None,
+            connect: bool = True
+    ):
 
         self.response = None
         self.device_code_credential = None
@@ -43,9 +74,16 @@ class GraphQuery:
         self.config = None
         self.config_file = None
         self.hostname = None
+        self.scheme = None
         self.version = None
         self.app_token = None
         self.header = None
+        self.pool = None
+        self.scheduler = None
+        self.metrics = None
+        self.token_cache = None
+        self.refresh_timer = None
+        self.connected = False
 
         if verbose:
             logger.get_logger().setLevel("DEBUG")
@@ -63,37 +101,67 @@ class GraphQuery:
         self.config = configparser.ConfigParser()
         self.config.read(self.config_file)
 
-        self.hostname = self.config["graph"]["hostname"]
+        # The server can be pointed elsewhere, ie. a local mock graph server served over plain http.
+        self.hostname = _setting(self.config, "hostname", hostname, "graph.microsoft.com", section="graph")
+        self.scheme = _setting(self.config, "scheme", scheme, "https", section="graph")
         self.version = self.config["graph"]["version"]
         self.app_token = self.config["graph"]["app_token"]
 
-        # If client-id doesn't exist yet, retrieve it from NRAO
-        if self.config["azure"]["client_id"] == "None":
-            from vipertools.security import encryption
-            logger.info("Azure client-id not found, retrieving ...")
-            self.client_id = encryption.get_credentials(persistent=True)
+        # Connection pool settings: explicit arguments take precedence over the configuration file.
+        self.pool = SessionPool(
+            pool_connections=_setting(self.config, "pool_connections", pool_connections, 10),
+            pool_maxsize=_setting(self.config, "pool_maxsize", pool_maxsize, 32),
+            pool_block=_setting(self.config, "pool_block", pool_block, False),
+            max_retries=_setting(self.config, "max_retries", None, 0),
+            keep_alive=_setting(self.config, "keep_alive", keep_alive, True),
+            timeout=_setting(self.config, "timeout", timeout, 60.0)
+        )
+
+        # Every request is admitted by the scheduler, which backs off and narrows concurrency when throttled.
+        self.scheduler = Scheduler(
+            initial=_setting(self.config, "initial_concurrency", None, 16, section="scheduler"),
+            minimum=_setting(self.config, "min_concurrency", None, 1, section="scheduler"),
+            maximum=_setting(self.config, "max_concurrency", max_concurrency, 64, section="scheduler"),
+            max_retries=_setting(self.config, "max_retries", None, 5, section="scheduler"),
+            base=_setting(self.config, "backoff_base", None, 1.0, section="scheduler"),
+            cap=_setting(self.config, "backoff_cap", None, 60.0, section="scheduler")
+        )
+
+        # Every request is recorded by operation and endpoint, pass a Metrics to share it between clients.
+        if not isinstance(metrics, Metrics):
+            metrics = Metrics(enabled=_setting(self.config, "enabled", metrics, True, section="metrics"))
+
+        self.metrics = metrics
+
+        self.token_cache = TokenCache(str(pathlib.Path(self.config_file).parent.joinpath("token.json"))).load()
+
+        # An explicitly given app-token, ie. for a mock graph server, takes precedence
+        if app_token is not None:
+            self.app_token = app_token
+            logger.info("Using the given app-token ...")
 
         # Does the app-token exist in the environment
-        if os.getenv("APP_TOKEN"):
+        elif os.getenv("APP_TOKEN"):
             # Could add some verification that the token is correct here
             self.app_token = os.getenv("APP_TOKEN")
             logger.info(f"Using app-token from environment...")
 
-        # If app-token is not defined in configuration file, get it from msgraph
-        if self.app_token == "None":
-            logger.info("Configuration file has no app-token, attempting to get credentials from server...")
-            self.app_token = asyncio.run(self.get_app_token(write=True))
+        elif self.token_cache.valid():
+            self.app_token = self.token_cache.token
+            logger.info(f"Using cached app-token, valid for {int(self.token_cache.expires_in // 60)} more minutes ...")
 
-        # Authenticate app-token that you have
-        else:
-            logger.info("Authenticating app-token with server ...")
-            self.authenticate()
+        self.header = self._token_header()
 
-        self.header = {
-            "Host": f"{self.hostname}",
-            "Authorization": f"Bearer {self.app_token}",
-            "Content-Type": "application/json"
-        }
+        # Inside an event loop the token is checked with connect_async() instead, without blocking the loop.
+        if connect:
+            self.connect()
+
+    @property
+    def base_url(self) -> str:
+        """
+        Root of the graph api requests are made against, ie. https://graph.microsoft.com/v1.0
+        """
+        return f"{self.scheme}://{self.hostname}/{self.version}"
 
     def __repr__(self):
         name = self.__class__.__name__
@@ -109,9 +177,188 @@ class GraphQuery:
         -------
 
         """
+        import rich
 
         rich.inspect(self.__class__, methods=True, all=False, private=False, dunder=False)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Release the pooled connections held by this instance.
+        Returns
+        -------
+
+        """
+        if self.pool is not None:
+            self.pool.close()
+
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request to the graph server over the shared, pooled session. All remote calls should be made through
+        here so that they reuse the open connections instead of paying for a new TLS handshake each time, and so that
+        the scheduler can hold them back and retry them when the tenant is throttled.
+        Parameters
+        ----------
+        method: str
+            HTTP method, ie. GET, POST, PUT.
+        url: str
+            Request url.
+        kwargs:
+            Any keyword accepted by requests.Session.request.
+
+        Returns requests.Response
+        -------
+
+        """
+        attempts = itertools.count()
+
+        def send() -> requests.Response:
+            attempt = next(attempts)
+            start = time.perf_counter()
+
+            try:
+                response = self.pool.request(method, url, **kwargs)
+
+            except requests.RequestException:
+                self.metrics.request(
+                    method, url, self.base_url,
+                    status=None,
+                    seconds=time.perf_counter() - start,
+                    attempt=attempt
+                )
+                raise
+
+            # A streamed body is only read later, the size the server announced is counted instead.
+            received = graph_metrics.content_length(response.headers)
+            if not received and not kwargs.get("stream", False):
+                received = len(response.content)
+
+            self.metrics.request(
+                method, url, self.base_url,
+                status=response.status_code,
+                seconds=time.perf_counter() - start,
+                sent=graph_metrics.content_length(response.request.headers),
+                received=received,
+                attempt=attempt
+            )
+
+            return response
+
+        if self.scheduler is None:
+            return send()
+
+        return self.scheduler.call(send, method)
+
+    def batch(self, sub_requests: list[dict], max_workers: int = 4, max_retries: int = 3) -> dict[str, dict]:
+        """
+        Execute many graph requests through JSON $batch calls. Sub-requests are packed up to 20 per call and the calls
+        are sent concurrently. Sub-requests that fail with a throttling or transient server error are retried on their
+        own, honoring Retry-After, while the successful ones are kept.
+        Parameters
+        ----------
+        sub_requests: list[dict]
+            Sub-requests with keys "id", "method", "url" and optionally "body" and "headers". The url can be absolute or
+            relative to the graph version root. A missing id is replaced by the position of the request in the list.
+        max_workers: int (default 4)
+            Number of $batch calls in flight.
+        max_retries: int (default 3)
+            Number of times a failed sub-request is retried.
+
+        Returns dict[str, dict]
+        -------
+            Sub-responses, each with keys "status", "headers" and "body", indexed by sub-request id.
+        """
+        pending = graph_batch.prepare(sub_requests, hostname=self.hostname, version=self.version)
+        responses = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # The worker threads record their calls under the operation of the caller
+            send = self.metrics.bind(self._send_batch)
+
+            for attempt in range(max_retries + 1):
+                sub_responses = {}
+                for results in executor.map(send, graph_batch.chunk(list(pending.values()))):
+                    sub_responses.update(results)
+
+                retry, delay = graph_batch.settle(
+                    pending, sub_responses, responses,
+                    attempt=attempt,
+                    max_retries=max_retries,
+                    metrics=self.metrics
+                )
+
+                if not retry:
+                    break
+
+                logger.debug(f"Retrying {len(retry)} failed sub-requests in {delay:.2f}s ...")
+                time.sleep(delay)
+                pending = retry
+
+        return responses
+
+    def _send_batch(self, sub_requests: list[dict]) -> dict[str, dict]:
+        """
+        Send a single $batch call and demultiplex its sub-responses by id.
+        """
+        response = self.request(
+            "POST",
+            url=f"{self.base_url}/$batch",
+            json={"requests": sub_requests},
+            headers=self.header
+        )
+
+        return graph_batch.results(response, sub_requests)
+
+    def connect(self) -> None:
+        """
+        Make sure the app-token can be used: sign in if there is none, check it with the server unless it is known to
+        be valid for a while. The token is then refreshed in the background shortly before it expires.
+        Returns
+        -------
+
+        """
+        step = self._connection_step()
+
+        if step == "sign_in":
+            self.app_token = self._sign_in(write=True)
+
+        elif step == "authenticate":
+            self.authenticate()
+
+        self._connected()
+
+    async def connect_async(self, request: Callable[..., Awaitable]) -> None:
+        """
+        Asynchronous connect(), for a GraphQuery created with connect=False to be used from an event loop. Signing in
+        runs in a thread and the token is checked with the given coroutine function, so the loop is never blocked.
+        Parameters
+        ----------
+        request: Callable[..., Awaitable]
+            Coroutine function sending a request, called as request(method, url=url, headers=headers), ie.
+            AsyncDriveTool.request.
+
+        Returns
+        -------
+
+        """
+        step = self._connection_step()
+
+        if step == "sign_in":
+            self.app_token = await self.get_app_token(write=True)
+
+        elif step == "authenticate":
+            await self.authenticate_async(request)
+
+        self._connected()
+
     def authenticate(self) -> requests.Response:
         """
         Authenticate with app-token and refresh is expired.
@@ -119,23 +366,37 @@ class GraphQuery:
         -------
 
         """
-        url = f"https://graph.microsoft.com/v1.0/me"
+        url = f"{self.base_url}/me"
 
         # Send a simple request and check response to validate the current app token
-        self.response = requests.get(
-            url=url,
-            headers={
-                "Host": f"{self.hostname}",
-                "Authorization": f"Bearer {self.app_token}",
-                "Content-Type": "application/json"
-            }
-        )
+        with self.metrics.operation("authenticate"):
+            self.response = self.request("GET", url=url, headers=self._token_header())
 
         # Find a more robust way to do this
         if self.response.status_code != status_code.OK:
             if self.response.json()["error"]["code"] == "InvalidAuthenticationToken":
                 logger.warning("App token is invalid or expired, refreshing...")
-                self.app_token = asyncio.run(self.get_app_token(write=True))
+                self.app_token = self._sign_in(write=True)
+
+            else:
+                handler.error(self.response, table=self.verbose)
+
+        return self.response
+
+    async def authenticate_async(self, request: Callable[..., Awaitable]):
+        """
+        Asynchronous authenticate(), sending the check with the given coroutine function, see connect_async().
+        Returns httpx.Response
+        -------
+
+        """
+        with self.metrics.operation("authenticate"):
+            self.response = await request("GET", url=f"{self.base_url}/me", headers=self._token_header())
+
+        if self.response.status_code != status_code.OK:
+            if self.response.json()["error"]["code"] == "InvalidAuthenticationToken":
+                logger.warning("App token is invalid or expired, refreshing...")
+                self.app_token = await self.get_app_token(write=True)
 
             else:
                 handler.error(self.response, table=self.verbose)
@@ -146,7 +407,8 @@ class GraphQuery:
     async def get_app_token(self, write: bool = False) -> str:
         """
         Retrieve app-token from Azure client and return it. Token can be written to configuration file if requested.
-        In addition, the Azure client-id is checked as well.
+        In addition, the Azure client-id is checked as well. Signing in waits for the device code to be entered, it
+        runs in a thread so that the event loop is free in the meantime.
         Parameters
         ----------
         write: bool (default False) to write to configuration file
@@ -155,9 +417,17 @@ class GraphQuery:
         -------
 
         """
+        import asyncio
+
+        return await asyncio.to_thread(self._sign_in, write)
+
+    def _sign_in(self, write: bool = False) -> str:
+        # Sign in with the device code flow, see get_app_token().
+        from azure.core.exceptions import ClientAuthenticationError
+        from msgraph import GraphServiceClient
+
         from vipertools.security.encryption import write_to_config
 
-        tenant_id = self.config["azure"]["tenant_id"]
         scopes = self.config["azure"]["scopes"]
 
         self.client_id = self.config["azure"]["client_id"]
@@ -167,10 +437,19 @@ class GraphQuery:
             logger.info("Azure client-id not found, retrieving ...")
             self.client_id = encryption.get_credentials(persistent=True)
 
-        self.device_code_credential = DeviceCodeCredential(client_id=self.client_id, tenant_id=tenant_id)
+        self.device_code_credential = self._credential()
         self.user_client = GraphServiceClient(self.device_code_credential, scopes.split(" "))
 
-        access_token = self.device_code_credential.get_token(scopes)
+        # Signing in once yields a record of the account, which later lets the token be refreshed silently.
+        with self.metrics.operation("sign_in"):
+            record = None
+            try:
+                record = self.device_code_credential.authenticate(scopes=scopes.split(" ")).serialize()
+
+            except (ValueError, ClientAuthenticationError) as error:
+                logger.debug(f"Unable to keep an authentication record, the token won't refresh silently: {error}")
+
+            access_token = self.device_code_credential.get_token(scopes)
 
         if write:
             write_to_config(
@@ -179,8 +458,139 @@ class GraphQuery:
                 value=access_token.token
             )
 
+        self.token_cache.save(token=access_token.token, expires_on=access_token.expires_on, record=record)
+
         return access_token.token
 
+    def refresh(self) -> Union[str, None]:
+        """
+        Silently refresh the app-token from the persistent azure token cache, using the cached authentication record.
+        Nothing is prompted; if the token can't be refreshed the current one is kept, a warning is logged and the
+        refresh is tried again shortly for as long as the current token is valid.
+        Returns str | None
+        -------
+            The new app-token, None if it could not be refreshed.
+        """
+        if self.token_cache.record is None:
+            logger.debug("No authentication record cached, the app-token can't be refreshed silently.")
+            return None
+
+        from azure.core.exceptions import AzureError
+        from azure.identity import AuthenticationRecord
+
+        # This runs on the refresh timer thread, where an exception would end the refreshes without anyone noticing.
+        # Network failures (ServiceRequestError) are AzureErrors as much as a sign-in being required is.
+        try:
+            credential = self._credential(
+                record=AuthenticationRecord.deserialize(self.token_cache.record),
+                interactive=False
+            )
+
+            with self.metrics.operation("refresh_token"):
+                access_token = credential.get_token(self.config["azure"]["scopes"])
+
+        except (ValueError, OSError, AzureError) as error:
+            self._retry_refresh(error)
+            return None
+
+        self.app_token = access_token.token
+
+        try:
+            self.token_cache.save(token=access_token.token, expires_on=access_token.expires_on)
+
+        except OSError as error:
+            # The token is still kept in memory, only a new process would have to get it again
+            logger.warning(f"Unable to cache the refreshed app-token: {error}")
+
+        # Tools hold on to the header dictionary, it is updated in place.
+        if self.header is not None:
+            self.header["Authorization"] = f"Bearer {self.app_token}"
+
+        logger.debug(f"App-token refreshed, valid for {int(self.token_cache.expires_in // 60)} minutes.")
+
+        self._schedule_refresh()
+
+        return self.app_token
+
+    def _connection_step(self) -> Union[str, None]:
+        # What connecting takes: signing in without an app-token, checking one that may have expired with the server.
+        if self.app_token == "None":
+            logger.info("Configuration file has no app-token, attempting to get credentials from server...")
+            return "sign_in"
+
+        # A token known to be valid for a while is trusted without a round trip to the server
+        if self._expires_in(self.app_token) > self.token_cache.margin:
+            logger.debug("App-token has not expired, skipping the server check ...")
+            return None
+
+        logger.info("Authenticating app-token with server ...")
+        return "authenticate"
+
+    def _connected(self) -> None:
+        # Tools hold on to the header dictionary, it is updated in place.
+        self.header["Authorization"] = f"Bearer {self.app_token}"
+        self.connected = True
+
+        self._schedule_refresh()
+
+    def _token_header(self) -> dict[str, str]:
+        return {
+            "Host": f"{self.hostname}",
+            "Authorization": f"Bearer {self.app_token}",
+            "Content-Type": "application/json"
+        }
+
+    def _retry_refresh(self, error: Exception) -> None:
+        # A failed refresh is tried again shortly, the failure may be transient, until the current token expires.
+        expires_in = self._expires_in(self.app_token)
+
+        if expires_in <= 0:
+            logger.warning(f"Unable to refresh the app-token, it has to be renewed by signing in again: {error}")
+            return
+
+        delay = min(self.token_cache.retry, expires_in)
+
+        logger.warning(f"Unable to refresh the app-token, trying again in {delay:.0f}s: {error}")
+        self._schedule_refresh(delay=delay)
+
+    def _credential(
+            self,
+            record: "AuthenticationRecord" = None,
+            interactive: bool = True
+    ) -> "DeviceCodeCredential":
+        from azure.identity import DeviceCodeCredential, TokenCachePersistenceOptions
+
+        # Refresh tokens are kept in the persistent azure token cache, where a silent refresh can find them.
+        return DeviceCodeCredential(
+            client_id=self.client_id or self.config["azure"]["client_id"],
+            tenant_id=self.config["azure"]["tenant_id"],
+            authentication_record=record,
+            cache_persistence_options=TokenCachePersistenceOptions(name="vipertools"),
+            disable_automatic_authentication=not interactive
+        )
+
+    def _expires_in(self, token: str) -> float:
+        # Seconds left on a token, from the cache if it holds this token and from its claims otherwise; 0 if unknown.
+        expires_on = self.token_cache.expires_on if token == self.token_cache.token else expiry(token)
+
+        return 0.0 if expires_on is None else expires_on - time.time()
+
+    def _schedule_refresh(self, delay: float = None) -> None:
+        # Refresh the token in the background shortly before it expires, or in delay seconds, only when it can be done
+        # silently.
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+
+        if self.token_cache.record is None or self.app_token != self.token_cache.token:
+            return
+
+        if delay is None:
+            delay = max(self._expires_in(self.app_token) - self.token_cache.margin, 0.0)
+
+        self.refresh_timer = threading.Timer(delay, self.refresh)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
     #@parameter.validate()
     def build_download_request(self, item_id: Union[int, str]) -> tuple[str, dict[str, str]]:
         """
@@ -196,7 +606,7 @@ class GraphQuery:
 
         """
         # Build the download request url
-        url = f"https://{self.hostname}/{self.version}/me/drive/items/{item_id}/content"
+        url = f"{self.base_url}/me/drive/items/{item_id}/content"
 
         headers = {
             "Authorization": f"Bearer {self.app_token}"
@@ -204,6 +614,27 @@ class GraphQuery:
 
         return url, headers
 
+    #@parameter.validate()
+    def build_share_request(self, link: str) -> tuple[str, dict[str, str]]:
+        """
+
+        Parameters
+        ----------
+        link: str
+            Full sharing url of an item, as created by build_link_request.
+
+        Returns tuple[str, dict[str, str]]
+        -------
+            url and minimal header required to resolve the drive item behind a sharing link.
+
+        """
+        # Sharing urls are addressed as "u!" followed by their unpadded, url-safe base64 encoding.
+        share_id = "u!" + base64.urlsafe_b64encode(link.encode("utf-8")).decode("utf-8").rstrip("=")
+
+        url = f"{self.base_url}/shares/{share_id}/driveItem"
+
+        return url, self.header
+
     #@parameter.validate()
     def build_link_request(
             self,
@@ -226,7 +657,7 @@ class GraphQuery:
             url, body and minimal header required for download request.
 
         """
-        url = f"https://{self.hostname}/{self.version}/me/drive/items/{item_id}/createLink"
+        url = f"{self.base_url}/me/drive/items/{item_id}/createLink"
 
         body = {
             "type": f"{permissions}",
@@ -273,10 +704,10 @@ class GraphQuery:
             0] else "application/octet-stream"
 
         if mode == "create":
-            url = f"https://{self.hostname}/{self.version}/me/drive/root:/{path}/{filename}:/content"
+            url = item_url(self.base_url, f"{path}/{filename}", action="content")
 
         else:
-            url = f"https://{self.hostname}/{self.version}/me/drive/items/{item_id}/content"
+            url = f"{self.base_url}/me/drive/items/{item_id}/content"
 
         header = {
             "Authorization": f"Bearer {self.app_token}",
@@ -284,3 +715,107 @@ class GraphQuery:
         }
 
         return url, header
+
+    #@parameter.validate()
+    def build_upload_session_request(
+            self, item_id: Union[int, str, None] = None,
+            path: str = None,
+            filename: str = "",
+            mode: str = "update",
+            conflict: str = "replace"
+    ) -> tuple[str, dict[str, str], dict[str, str]]:
+        """
+        Build the request that opens a resumable upload session. The returned uploadUrl then accepts the file in
+        fragments, which is required for files larger than a simple upload allows.
+        Parameters
+        ----------
+        item_id: int | str | None
+            Onedrive specific id associated with file.
+        path: str
+            The remote path of the file to be uploaded.
+        filename: str
+            The name of the file to be uploaded.
+        mode: str
+            Mode with which to upload file, "update" an existing item or "create" a new one.
+        conflict: str
+            Behavior if the name already exists remotely. "replace", "rename" or "fail"
+
+        Returns tuple[str, dict[str, str], dict[str, str]]
+        -------
+            url, body and minimal header required for the upload session request.
+        """
+        if (item_id is None) and (mode == "update"):
+            logger.error("Must specify item_id when running in update mode")
+
+        if (path is None) and (mode == "create"):
+            logger.error("Must specify path when running in create mode")
+
+        if mode == "create":
+            url = item_url(self.base_url, f"{path}/{filename}", action="createUploadSession")
+
+        else:
+            url = f"{self.base_url}/me/drive/items/{item_id}/createUploadSession"
+
+        body = {
+            "item": {
+                "@microsoft.graph.conflictBehavior": f"{conflict}"
+            }
+        }
+
+        return url, body, self.header
+
+
+def item_url(base_url: str, path: str, action: str = None) -> str:
+    """
+    Url of a drive item addressed by its remote path, or of an action on it, ie. children or content. Every url built
+    from a remote path goes through here so that the path is quoted, names can hold characters that have a meaning in
+    urls, ie. # or %.
+
+    Parameters
+    ----------
+    base_url: str
+        Root of the graph api, see GraphQuery.base_url.
+    path: str
+        Remote path of the item, leading and trailing slashes are ignored. "/" is the root of the drive.
+    action: str
+        Segment appended to the item url, None for the item itself.
+
+    Returns str
+    -------
+        Item or action url
+    """
+    path = path.strip("/")
+
+    if not path:
+        # The root is not addressed by path, its actions are plain segments.
+        url = f"{base_url}/me/drive/root"
+
+        return url if action is None else f"{url}/{action}"
+
+    url = f"{base_url}/me/drive/root:/{urllib.parse.quote(path)}"
+
+    return url if action is None else f"{url}:/{action}"
+
+
+def _setting(config: configparser.ConfigParser, option: str, value, default, section: str = "session"):
+    """
+    Resolve a [graph], [session], [scheduler] or [metrics] setting: an explicit value wins, then the configuration
+    file, then the default.
+    The configuration value is cast to the type of the default.
+    """
+    if value is not None:
+        return value
+
+    if not config.has_option(section, option):
+        return default
+
+    if isinstance(default, bool):
+        return config.getboolean(section, option)
+
+    if isinstance(default, int):
+        return config.getint(section, option)
+
+    if isinstance(default, float):
+        return config.getfloat(section, option)
+
+    return config.get(section, option)
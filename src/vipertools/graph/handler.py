@@ -1,19 +1,27 @@
-import rich
 import json
 import requests
 
-from graphviper.utils import logger
-from graphviper.utils.console import Colorize
+from vipertools._lazy import logger
 from requests import Response
+from typing import Union
 
-from rich.console import Console
-from rich.table import Table
 
-color = Colorize()
+def _describe(response: Union[requests.Response, dict]) -> tuple[int, str, str]:
+    # Batch sub-responses are plain dictionaries with the same error body as a full response.
+    if isinstance(response, dict):
+        status, body = response["status"], response["body"]
+
+    else:
+        status, body = response.status_code, response.json()
+
+    return status, body["error"]["code"], body["error"]["message"]
 
 
-def _error_table(response: requests.Response):
+def _error_table(response: Union[requests.Response, dict]):
     from rich import box
+    from rich.console import Console
+    from rich.table import Table
+
     console = Console()
     table = Table(title="", box=box.HORIZONTALS)
 
@@ -21,13 +29,14 @@ def _error_table(response: requests.Response):
     table.add_column("Error", justify="center", style="red", no_wrap=True)
     table.add_column("Description", justify="center", style="red", no_wrap=True)
 
-    table.add_row(f"{response.status_code}", f"{response.json()['error']['code']}",
-                  f"{response.json()['error']['message']}")
+    status, code, message = _describe(response)
+
+    table.add_row(f"{status}", f"{code}", f"{message}")
 
     console.print(table)
 
 
-def error(response: requests.Response, table=False):
+def error(response: Union[requests.Response, dict], table=False):
     """
     Formatted, fancy requests error messages handling
 
@@ -40,4 +49,8 @@ def error(response: requests.Response, table=False):
         _error_table(response)
 
     else:
-        logger.error(f"({color.red(str(response.status_code))}) {color.red(response.json()['error']['code'])}: {response.json()['error']['message']}")
+        from graphviper.utils.console import Colorize
+
+        color = Colorize()
+        status, code, message = _describe(response)
+        logger.error(f"({color.red(str(status))}) {color.red(code)}: {message}")
@@ -0,0 +1,489 @@
+# Per-request instrumentation of the graph client, with json and prometheus text exports.
+
+import re
+import json
+import time
+import bisect
+import threading
+import contextvars
+
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from typing import Callable, Iterator, Union
+
+from vipertools._lazy import logger
+
+from vipertools.graph.scheduler import THROTTLE_CODES
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+# Path segments that identify a single item are replaced so requests to different items share an endpoint.
+TEMPLATES = (
+    (re.compile(r"/root:/.*?(:|$)"), r"/root:{path}\1"),
+    (re.compile(r"/(items|shares|drives)/[^/]+"), r"/\1/{id}"),
+)
+
+# Operation the calling code is in, ie. generate_manifest/create_links. Worker threads don't inherit it, run their
+# work through Metrics.bind() to carry it over.
+_operation = contextvars.ContextVar("operation", default="")
+
+
+class Histogram:
+    """
+    Cumulative histogram of durations, laid out like a prometheus histogram.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate of a quantile, interpolated within the bucket it falls in as prometheus' histogram_quantile() does.
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                # The last bucket is open ended, the largest value seen is the best estimate there is.
+                upper = self.max if bound == float("inf") else min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+
+            seen += count
+            lower = bound
+
+        return self.max
+
+    def snapshot(self) -> dict:
+        cumulative = 0
+        buckets = {}
+
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+            "buckets": buckets
+        }
+
+
+class Metrics:
+    """
+    Records every request a GraphQuery sends, labelled by the operation it was made for and the endpoint it went to,
+    along with the duration of the operations themselves and the hits of the listing and download caches.
+
+    Operations are labelled with a context manager, and nest:
+
+        with graph.metrics.operation("generate_manifest"):
+            ...
+            with graph.metrics.operation("create_links"):
+                graph.batch(...)  # recorded under generate_manifest/create_links
+
+    Hooks are called with every event as it is recorded, a dictionary with a "kind" of "request", "operation" or
+    "cache". A snapshot of the totals can be exported as json or in the prometheus text exposition format.
+    """
+
+    def __init__(self, enabled: bool = True, buckets: tuple = LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._requests = {}
+        self._operations = {}
+        self._caches = {}
+        self._started = time.time()
+
+    def __repr__(self):
+        with self._lock:
+            requests = sum(series["requests"] for series in self._requests.values())
+
+        return f"Metrics(enabled={self.enabled}, requests={requests}, operations={len(self._operations)})"
+
+    @property
+    def current(self) -> str:
+        """
+        Operation the caller is in, empty outside of any.
+        """
+        return _operation.get()
+
+    @contextmanager
+    def operation(self, name: str) -> Iterator[str]:
+        """
+        Label the requests made within the block with an operation and time the block.
+        Parameters
+        ----------
+        name: str
+            Operation name, nested in the operation the caller is already in.
+
+        Returns Iterator[str]
+        -------
+            Full name of the operation.
+        """
+        parent = _operation.get()
+        label = f"{parent}/{name}" if parent else name
+
+        token = _operation.set(label)
+        start = time.perf_counter()
+        failed = False
+
+        try:
+            yield label
+
+        except BaseException:
+            failed = True
+            raise
+
+        finally:
+            _operation.reset(token)
+
+            if self.enabled:
+                self._record_operation(label, time.perf_counter() - start, failed)
+
+    def bind(self, function: Callable) -> Callable:
+        """
+        Wrap a function so that it runs in the operation of the caller, for work handed to a thread pool.
+
+            executor.map(graph.metrics.bind(fetch), segments)
+        """
+        context = contextvars.copy_context()
+
+        # A context can only be entered by one thread at a time, every call gets its own copy.
+        def bound(*args, **kwargs):
+            return context.copy().run(function, *args, **kwargs)
+
+        return bound
+
+    def request(
+            self,
+            method: str,
+            url: str,
+            base_url: str,
+            status: Union[int, None],
+            seconds: Union[float, None],
+            sent: int = 0,
+            received: int = 0,
+            attempt: int = 0
+    ) -> None:
+        """
+        Record a request that was sent, once per attempt.
+        Parameters
+        ----------
+        method: str
+            HTTP method.
+        url: str
+            Request url.
+        base_url: str
+            Root of the graph api, urls under it are reported by endpoint and others by host.
+        status: int | None
+            Response status, None if the request failed without one.
+        seconds: float | None
+            Time until the response arrived, None for the sub-requests of a $batch call which only the call is timed
+            for.
+        sent: int
+            Bytes of request body.
+        received: int
+            Bytes of response body.
+        attempt: int
+            Number of attempts made before this one, anything above 0 is a retry.
+
+        Returns
+        -------
+
+        """
+        if not self.enabled:
+            return
+
+        event = {
+            "kind": "request",
+            "operation": _operation.get(),
+            "endpoint": endpoint(url, base_url),
+            "method": method.upper(),
+            "status": status,
+            "seconds": seconds,
+            "sent": sent,
+            "received": received,
+            "retry": attempt > 0,
+            "throttled": status in THROTTLE_CODES
+        }
+
+        with self._lock:
+            key = (event["operation"], event["endpoint"], event["method"])
+            series = self._requests.get(key)
+
+            if series is None:
+                series = self._requests[key] = {
+                    "requests": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "throttled": 0,
+                    "sent": 0,
+                    "received": 0,
+                    "status": {},
+                    "latency": Histogram(self.buckets)
+                }
+
+            series["requests"] += 1
+            series["errors"] += int(status is None or status >= 400)
+            series["retries"] += int(event["retry"])
+            series["throttled"] += int(event["throttled"])
+            series["sent"] += sent
+            series["received"] += received
+            series["status"][str(status)] = series["status"].get(str(status), 0) + 1
+
+            if seconds is not None:
+                series["latency"].observe(seconds)
+
+        self._emit(event)
+
+    def cache(self, name: str, hit: bool) -> None:
+        """
+        Record a lookup in one of the caches, ie. "listing" or "download".
+        """
+        if not self.enabled:
+            return
+
+        event = {"kind": "cache", "operation": _operation.get(), "cache": name, "hit": hit}
+
+        with self._lock:
+            series = self._caches.setdefault((event["operation"], name), {"hits": 0, "misses": 0})
+            series["hits" if hit else "misses"] += 1
+
+        self._emit(event)
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        """
+        Call hook with every event recorded from now on. Hooks run on the thread that made the request and should
+        return quickly; an exception raised by a hook is logged and otherwise ignored.
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict], None]) -> None:
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    @contextmanager
+    def hook(self, hook: Callable[[dict], None]) -> Iterator[Callable[[dict], None]]:
+        """
+        Call hook with every event recorded within the block.
+        """
+        self.add_hook(hook)
+
+        try:
+            yield hook
+
+        finally:
+            self.remove_hook(hook)
+
+    def reset(self) -> None:
+        """
+        Drop everything recorded so far, the hooks are kept.
+        """
+        with self._lock:
+            self._requests = {}
+            self._operations = {}
+            self._caches = {}
+            self._started = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        Totals recorded since the metrics were created or last reset.
+        Returns dict
+        -------
+            "requests" per operation, endpoint and method with their latency histogram, bytes transferred, retries,
+            throttles and count by status; "operations" with their duration histogram; "caches" with their hits and
+            misses per operation; along with the "started" and "elapsed" time.
+        """
+        with self._lock:
+            requests = [
+                dict(
+                    {"operation": operation, "endpoint": endpoint_, "method": method},
+                    **{name: value for name, value in series.items() if name not in ("latency", "status")},
+                    status=dict(series["status"]),
+                    latency=series["latency"].snapshot()
+                ) for (operation, endpoint_, method), series in sorted(self._requests.items())
+            ]
+
+            operations = [
+                {"operation": operation, "errors": series["errors"], "duration": series["duration"].snapshot()}
+                for operation, series in sorted(self._operations.items())
+            ]
+
+            caches = [
+                dict({"operation": operation, "cache": name}, **series)
+                for (operation, name), series in sorted(self._caches.items())
+            ]
+
+            started = self._started
+
+        return {
+            "started": started,
+            "elapsed": time.time() - started,
+            "requests": requests,
+            "operations": operations,
+            "caches": caches
+        }
+
+    def to_json(self, indent: int = 4) -> str:
+        """
+        Snapshot as a json document.
+        """
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "vipertools") -> str:
+        """
+        Snapshot in the prometheus text exposition format, ie. to serve from a /metrics endpoint or write to a node
+        exporter textfile.
+        Parameters
+        ----------
+        prefix: str (default vipertools)
+            Prefix of every metric name.
+
+        Returns str
+        -------
+
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name: str, kind: str, description: str) -> str:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+            return f"{prefix}_{name}"
+
+        def histogram(name: str, labels: dict, data: dict) -> None:
+            for bound, count in data["buckets"].items():
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {count}")
+
+            lines.append(f"{name}_sum{_labels(labels)} {data['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {data['count']}")
+
+        requests = snapshot["requests"]
+
+        name = family("requests_total", "counter", "Requests sent to the graph server, retries included.")
+        for series in requests:
+            for status, count in series["status"].items():
+                lines.append(f"{name}{_labels(_request_labels(series), status=status)} {count}")
+
+        for metric, description in (
+                ("retries", "Requests that were retries of a throttled or failed request."),
+                ("throttled", "Requests the server throttled."),
+                ("sent", "Bytes sent in request bodies."),
+                ("received", "Bytes received in response bodies.")
+        ):
+            suffix = "bytes_total" if metric in ("sent", "received") else "total"
+            name = family(f"request_{metric}_{suffix}", "counter", description)
+
+            for series in requests:
+                lines.append(f"{name}{_labels(_request_labels(series))} {series[metric]}")
+
+        name = family("request_duration_seconds", "histogram", "Time until the response of a request arrived.")
+        for series in requests:
+            histogram(name, _request_labels(series), series["latency"])
+
+        name = family("operation_duration_seconds", "histogram", "Duration of the drive operations.")
+        for series in snapshot["operations"]:
+            histogram(name, {"operation": series["operation"]}, series["duration"])
+
+        name = family("operation_errors_total", "counter", "Operations that ended with an exception.")
+        for series in snapshot["operations"]:
+            lines.append(f"{name}{_labels({'operation': series['operation']})} {series['errors']}")
+
+        name = family("cache_lookups_total", "counter", "Lookups in the listing and download caches.")
+        for series in snapshot["caches"]:
+            labels = {"operation": series["operation"], "cache": series["cache"]}
+
+            lines.append(f"{name}{_labels(labels, result='hit')} {series['hits']}")
+            lines.append(f"{name}{_labels(labels, result='miss')} {series['misses']}")
+
+        return "\n".join(lines) + "\n"
+
+    def _record_operation(self, name: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            series = self._operations.get(name)
+
+            if series is None:
+                series = self._operations[name] = {"errors": 0, "duration": Histogram(self.buckets)}
+
+            series["duration"].observe(seconds)
+            series["errors"] += int(failed)
+
+        self._emit({"kind": "operation", "operation": name, "seconds": seconds, "failed": failed})
+
+    def _emit(self, event: dict) -> None:
+        with self._lock:
+            hooks = list(self._hooks)
+
+        for hook in hooks:
+            try:
+                hook(event)
+
+            except Exception as error:
+                logger.warning(f"Metrics hook {hook!r} failed: {error}")
+
+
+def endpoint(url: str, base_url: str) -> str:
+    """
+    Endpoint of a request url, relative to the graph api root with item ids and paths replaced by placeholders, ie.
+    /me/drive/items/{id}/createLink. Requests to other hosts, like pre-authenticated download or upload session urls,
+    are reported by host.
+    """
+    if not url.startswith(base_url):
+        return urlsplit(url).hostname or url
+
+    path = urlsplit(url[len(base_url):]).path or "/"
+
+    for pattern, replacement in TEMPLATES:
+        path = pattern.sub(replacement, path)
+
+    return path
+
+
+def content_length(headers) -> int:
+    """
+    Body size announced by request or response headers, 0 if there is none, ie. for a chunked body.
+    """
+    try:
+        return int(headers.get("Content-Length", 0))
+
+    except (TypeError, ValueError):
+        return 0
+
+
+def _request_labels(series: dict) -> dict:
+    return {"operation": series["operation"], "endpoint": series["endpoint"], "method": series["method"]}
+
+
+def _labels(labels: dict, **extra) -> str:
+    labels = dict(labels, **extra)
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value) -> str:
+    # Label values escape backslashes, double quotes and line feeds
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
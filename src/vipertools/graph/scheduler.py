@@ -0,0 +1,261 @@
+# Throttling-aware admission of graph requests.
+
+import time
+import threading
+
+from typing import Awaitable, Callable, TypeVar
+
+from vipertools._lazy import logger
+
+from vipertools.graph import batch as graph_batch
+
+# Responses that tell the client to slow down, see batch.retryable() for the failures that are retried
+THROTTLE_CODES = graph_batch.THROTTLE_CODES
+
+Response = TypeVar("Response")
+
+
+class Scheduler:
+    """
+    Central gate every graph request goes through. The number of requests in flight is bounded by a limit that adapts
+    to throttling with AIMD: each successful request adds 1/limit, so the limit grows by about one per round of
+    requests, and a throttled one halves it. Only requests sent after the last decrease can halve the limit again, so a
+    burst of 429s coming back from the same round counts once.
+
+    A throttled request is retried after its Retry-After delay, or an exponential backoff with full jitter when the
+    server gives none. Throttling applies to the whole tenant, so a Retry-After also holds back every other request
+    until it has passed. Transient server errors are retried with a backoff too, but only for idempotent methods.
+    """
+
+    def __init__(
+            self,
+            initial: int = 16,
+            minimum: int = 1,
+            maximum: int = 64,
+            max_retries: int = 5,
+            base: float = 1.0,
+            cap: float = 60.0
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_retries = max_retries
+        self.base = base
+        self.cap = cap
+
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+
+        self.throttled = 0
+        self.retries = 0
+
+        self._resume_at = 0.0
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return f"Scheduler(limit={int(self.limit)}, in_flight={self.in_flight}, maximum={self.maximum})"
+
+    @property
+    def stats(self) -> dict:
+        """
+        Current "limit" and "in_flight" requests, along with the number of "throttled" responses and "retries" made.
+        Returns dict
+        -------
+
+        """
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "retries": self.retries
+            }
+
+    def call(self, send: Callable[[], Response], method: str) -> Response:
+        """
+        Send a request once there is room for it, retrying it while it is throttled.
+        Parameters
+        ----------
+        send: Callable[[], Response]
+            Sends the request and returns its response, it is called again for every retry.
+        method: str
+            HTTP method of the request, transient server errors are only retried for idempotent methods.
+
+        Returns Response
+        -------
+            The first response that is not throttled, or the last one once the retries are exhausted.
+        """
+        attempt = 0
+
+        while True:
+            started = self.acquire()
+
+            try:
+                response = send()
+
+            except BaseException:
+                self.release(started, throttled=False)
+                raise
+
+            delay = self._settle(started, response, attempt, method)
+
+            if delay is None:
+                return response
+
+            # The body of a streamed response is not needed, give its connection back to the pool.
+            _close(response)
+
+            attempt += 1
+            time.sleep(delay)
+
+    async def call_async(self, send: Callable[[], Awaitable[Response]], method: str) -> Response:
+        """
+        Coroutine version of call() for asyncio clients.
+        Parameters
+        ----------
+        send: Callable[[], Awaitable[Response]]
+            Sends the request and returns its response, it is called again for every retry.
+        method: str
+            HTTP method of the request.
+
+        Returns Response
+        -------
+
+        """
+        import asyncio
+
+        attempt = 0
+
+        while True:
+            started = await self.acquire_async()
+
+            try:
+                response = await send()
+
+            except BaseException:
+                self.release(started, throttled=False)
+                raise
+
+            delay = self._settle(started, response, attempt, method)
+
+            if delay is None:
+                return response
+
+            aclose = getattr(response, "aclose", None)
+            if callable(aclose):
+                await aclose()
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def acquire(self) -> float:
+        """
+        Wait for a free slot, returning the time the slot was taken.
+        Returns float
+        -------
+
+        """
+        with self._condition:
+            while (wait := self._wait()) > 0:
+                self._condition.wait(timeout=min(wait, 1.0))
+
+            self.in_flight += 1
+
+            return time.monotonic()
+
+    async def acquire_async(self) -> float:
+        """
+        Wait for a free slot without blocking the event loop, returning the time the slot was taken.
+        Returns float
+        -------
+
+        """
+        import asyncio
+
+        while True:
+            with self._condition:
+                wait = self._wait()
+
+                if wait <= 0:
+                    self.in_flight += 1
+                    return time.monotonic()
+
+            await asyncio.sleep(min(wait, 0.05))
+
+    def release(self, started: float, throttled: bool) -> None:
+        """
+        Give a slot back and adapt the limit to the outcome of the request that held it.
+        Parameters
+        ----------
+        started: float
+            Time the slot was taken, as returned by acquire().
+        throttled: bool
+            Whether the server throttled the request.
+
+        Returns
+        -------
+
+        """
+        with self._condition:
+            self.in_flight -= 1
+
+            if not throttled:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+            elif started >= self._decreased_at:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._decreased_at = time.monotonic()
+
+            self._condition.notify_all()
+
+    def pause(self, delay: float) -> None:
+        """
+        Hold every new request back for delay seconds.
+        """
+        with self._condition:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def _wait(self) -> float:
+        # Time to wait before a slot can be taken, a slot is free when it is not positive. Called with the lock held.
+        paused = self._resume_at - time.monotonic()
+
+        if paused > 0:
+            return paused
+
+        return 0.0 if self.in_flight < int(self.limit) else 0.05
+
+    def _settle(self, started: float, response, attempt: int, method: str):
+        # Release the slot and decide whether the request goes again, returning the delay before it does.
+        status = response.status_code
+        throttled = status in THROTTLE_CODES
+
+        self.release(started, throttled=throttled)
+
+        if not graph_batch.retryable(status, method) or attempt >= self.max_retries:
+            return None
+
+        delay = graph_batch.retry_after(response.headers, attempt=attempt, base=self.base, cap=self.cap)
+
+        with self._condition:
+            self.retries += 1
+            self.throttled += int(throttled)
+
+        if throttled:
+            if graph_batch.header(response.headers, "Retry-After") is not None:
+                self.pause(delay)
+
+            logger.warning(
+                f"Throttled ({status}), retrying in {delay:.1f}s with at most {int(self.limit)} requests in flight ..."
+            )
+
+        else:
+            logger.debug(f"Request failed with {status}, retrying in {delay:.1f}s ...")
+
+        return delay
+
+
+def _close(response) -> None:
+    close = getattr(response, "close", None)
+
+    if callable(close):
+        close()
@@ -0,0 +1,110 @@
+import socket
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from vipertools._lazy import logger
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTP adapter that optionally enables TCP keep-alive probes on the pooled sockets so that idle connections to the
+    graph server are not silently dropped between requests.
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ["keep_alive"]
+
+    def __init__(self, keep_alive: bool = True, **kwargs):
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+
+        super().init_poolmanager(*args, **kwargs)
+
+
+class SessionPool:
+    """
+    Long-lived connection pool shared by every request a GraphQuery makes. A requests.Session is not safe to share
+    between threads, so each thread gets its own lightweight session while all of them mount the same adapter, and
+    therefore the same urllib3 connection pool.
+    """
+
+    def __init__(
+            self,
+            pool_connections: int = 10,
+            pool_maxsize: int = 32,
+            pool_block: bool = False,
+            max_retries: int = 0,
+            keep_alive: bool = True,
+            timeout: float = 60.0
+    ):
+        self.timeout = timeout
+        self.adapter = KeepAliveAdapter(
+            keep_alive=keep_alive,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=max_retries
+        )
+
+        self._local = threading.local()
+
+        logger.debug(f"Connection pool: connections={pool_connections}, maxsize={pool_maxsize}, block={pool_block}")
+
+    def __repr__(self):
+        return f"SessionPool(timeout={self.timeout})"
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Session bound to the calling thread.
+        Returns requests.Session
+        -------
+
+        """
+        session = getattr(self._local, "session", None)
+
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+
+            self._local.session = session
+
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the pooled connection adapter.
+        Parameters
+        ----------
+        method: str
+            HTTP method.
+        url: str
+            Request url.
+        kwargs:
+            Any keyword accepted by requests.Session.request.
+
+        Returns requests.Response
+        -------
+
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        return self.session.request(method=method, url=url, **kwargs)
+
+    def close(self) -> None:
+        """
+        Close the pooled connections.
+        Returns
+        -------
+
+        """
+        self._local = threading.local()
+        self.adapter.close()
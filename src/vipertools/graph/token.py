@@ -0,0 +1,154 @@
+# Local cache of the graph access token along with what is needed to trust and refresh it without a round trip.
+
+import os
+import json
+import time
+import base64
+import pathlib
+
+from typing import Union
+
+from vipertools._lazy import logger
+
+# A cached token is only trusted, and proactively refreshed, until this many seconds before it expires
+EXPIRY_MARGIN = 300
+
+# Seconds before a silent refresh that failed, ie. on a network error, is tried again while the token is still valid
+REFRESH_RETRY = 30.0
+
+
+class TokenCache:
+    """
+    Access token cached next to the configuration file together with its expiry and the serialized azure
+    AuthenticationRecord of the account it was issued to. The record lets a credential refresh the token silently from
+    the persistent azure token cache instead of running the device code flow again.
+    """
+
+    def __init__(self, filename: str, margin: float = EXPIRY_MARGIN, retry: float = REFRESH_RETRY):
+        self.path = pathlib.Path(filename)
+        self.margin = margin
+        self.retry = retry
+
+        self.token = None
+        self.expires_on = None
+        self.record = None
+
+    def __repr__(self):
+        return f"TokenCache({str(self.path)}, expires_in={self.expires_in})"
+
+    @property
+    def expires_in(self) -> Union[float, None]:
+        """
+        Seconds until the cached token expires, None if the expiry is unknown.
+        """
+        if self.expires_on is None:
+            return None
+
+        return self.expires_on - time.time()
+
+    def valid(self) -> bool:
+        """
+        Whether the cached token can be used without checking it with the server.
+        Returns bool
+        -------
+
+        """
+        return self.token is not None and self.expires_in is not None and self.expires_in > self.margin
+
+    def load(self) -> "TokenCache":
+        """
+        Read the cached token, if any.
+        Returns TokenCache
+        -------
+
+        """
+        if not self.path.exists():
+            return self
+
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable token cache {str(self.path)}, ignoring ...")
+            return self
+
+        self.token = state.get("token")
+        self.expires_on = state.get("expires_on")
+        self.record = state.get("record")
+
+        return self
+
+    def save(self, token: str, expires_on: Union[float, None] = None, record: Union[str, None] = None) -> None:
+        """
+        Cache a token, the file is only readable by its owner.
+        Parameters
+        ----------
+        token: str
+            Access token.
+        expires_on: float | None
+            Expiry as a unix timestamp, read from the token claims if None.
+        record: str | None
+            Serialized AuthenticationRecord, the cached one is kept if None.
+
+        Returns
+        -------
+
+        """
+        self.token = token
+        self.expires_on = expiry(token) if expires_on is None else expires_on
+        self.record = self.record if record is None else record
+
+        state = {
+            "token": self.token,
+            "expires_on": self.expires_on,
+            "record": self.record
+        }
+
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as file:
+            json.dump(state, file)
+
+        os.replace(temporary, self.path)
+
+    def clear(self) -> None:
+        self.token = None
+        self.expires_on = None
+        self.path.unlink(missing_ok=True)
+
+
+def claims(token: str) -> Union[dict, None]:
+    """
+    Decode the claims of a JWT access token without verifying it, only the server does that.
+
+    Parameters
+    ----------
+    token: str
+        Access token.
+
+    Returns dict | None
+    -------
+        Token claims, None if the token is not a JWT (ie. tokens issued to personal accounts are opaque).
+    """
+    parts = token.split(".")
+
+    if len(parts) != 3:
+        return None
+
+    try:
+        payload = parts[1] + "=" * (-len(parts[1]) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+
+    except ValueError:
+        return None
+
+
+def expiry(token: str) -> Union[float, None]:
+    """
+    Expiry of a JWT access token as a unix timestamp, None if it can't be read from the token.
+    """
+    value = (claims(token) or {}).get("exp")
+
+    return None if value is None else float(value)
@@ -1 +1,10 @@
-from .drive import DriveTool
+from vipertools import _lazy
+
+__getattr__, __dir__ = _lazy.exports(__name__, {
+    "DriveTool": "drive",
+    "AsyncDriveTool": "async_drive",
+    "ManifestStore": "manifest",
+    "RemoteFile": "remote",
+    "RemoteArray": "remote",
+    "ZipStream": "archive"
+})
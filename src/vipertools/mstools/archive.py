@@ -0,0 +1,392 @@
+# Zip archive of a local directory generated on the fly, so that it can be uploaded without writing it to disk first.
+
+import io
+import os
+import time
+import bisect
+import struct
+import pathlib
+import zlib
+
+from typing import Union
+
+# Members and offsets from this size on are described by zip64 extra fields, the limit zipfile uses as well.
+ZIP64_LIMIT = (1 << 31) - 1
+
+# Largest entry count of a plain end of central directory record
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# Bytes read from a member file at a time when its checksum is computed ahead of the stream
+CRC_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Record signatures and layouts, little endian as in the zip specification
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+DATA_DESCRIPTOR = struct.Struct("<4s3L")
+DATA_DESCRIPTOR64 = struct.Struct("<4sL2Q")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+END_RECORD64 = struct.Struct("<4sQ2H2L4Q")
+END_LOCATOR64 = struct.Struct("<4sLQL")
+
+LOCAL_SIGNATURE = b"PK\x03\x04"
+DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+END_SIGNATURE = b"PK\x05\x06"
+END64_SIGNATURE = b"PK\x06\x06"
+LOCATOR64_SIGNATURE = b"PK\x06\x07"
+
+# General purpose flags: checksum and sizes follow the data, names are utf-8
+FLAG_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+# Version needed to extract: stored members, and members with zip64 fields
+VERSION = 20
+VERSION64 = 45
+
+# Made by a unix system, so the permissions in the external attributes are honored when extracting
+CREATE_SYSTEM = 3
+
+# MS-DOS directory attribute
+DOS_DIRECTORY = 0x10
+
+# Compression method of every member, they are stored as is
+STORED = 0
+
+
+class Member:
+    """
+    File or directory of the archive, with its place in it.
+    """
+    __slots__ = ["path", "name", "size", "mtime", "mode", "offset", "zip64"]
+
+    def __init__(self, path: Union[pathlib.Path, None], name: str, size: int, mtime: float, mode: int):
+        # Directories have no path, they have no content to read
+        self.path = path
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.offset = 0
+        self.zip64 = size >= ZIP64_LIMIT
+
+    def __repr__(self):
+        return f"Member({self.name}, size={self.size}, offset={self.offset})"
+
+    @property
+    def is_dir(self) -> bool:
+        return self.path is None
+
+    @property
+    def flags(self) -> int:
+        flags = 0 if self.is_dir else FLAG_DESCRIPTOR
+
+        if not self.name.isascii():
+            flags |= FLAG_UTF8
+
+        return flags
+
+    @property
+    def local_header(self) -> bytes:
+        # The checksum isn't known yet, it follows the data in a descriptor. Zip64 sizes go into the extra field.
+        if self.zip64:
+            extra = struct.pack("<2H2Q", 1, 16, 0, 0)
+            size = 0xFFFFFFFF
+
+        else:
+            extra = b""
+            size = 0
+
+        name = self.name.encode("utf-8")
+        dos_time, dos_date = _dos_time(self.mtime)
+
+        return LOCAL_HEADER.pack(
+            LOCAL_SIGNATURE, VERSION64 if self.zip64 else VERSION, self.flags, STORED, dos_time, dos_date,
+            0, size, size, len(name), len(extra)
+        ) + name + extra
+
+    @property
+    def descriptor_size(self) -> int:
+        if self.is_dir:
+            return 0
+
+        return DATA_DESCRIPTOR64.size if self.zip64 else DATA_DESCRIPTOR.size
+
+    def descriptor(self, crc: int) -> bytes:
+        if self.zip64:
+            return DATA_DESCRIPTOR64.pack(DESCRIPTOR_SIGNATURE, crc, self.size, self.size)
+
+        return DATA_DESCRIPTOR.pack(DESCRIPTOR_SIGNATURE, crc, self.size, self.size)
+
+    def central_header(self, crc: int) -> bytes:
+        fields, size, offset = [], self.size, self.offset
+
+        if self.size >= ZIP64_LIMIT:
+            fields.extend((self.size, self.size))
+            size = 0xFFFFFFFF
+
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+            offset = 0xFFFFFFFF
+
+        extra = struct.pack(f"<2H{len(fields)}Q", 1, 8 * len(fields), *fields) if fields else b""
+        version = VERSION64 if fields or self.zip64 else VERSION
+
+        name = self.name.encode("utf-8")
+        dos_time, dos_date = _dos_time(self.mtime)
+
+        attributes = (self.mode & 0xFFFF) << 16
+        if self.is_dir:
+            attributes |= DOS_DIRECTORY
+
+        return CENTRAL_HEADER.pack(
+            CENTRAL_SIGNATURE, CREATE_SYSTEM << 8 | version, version, self.flags, STORED, dos_time,
+            dos_date, crc, size, size, len(name), len(extra), 0, 0, 0, attributes, offset
+        ) + name + extra
+
+
+class ZipStream(io.RawIOBase):
+    """
+    Read-only, seekable file object over the zip archive of a local directory, generated as it is read. Members are
+    stored without compression in a layout that only depends on the names, sizes, modification times and permissions
+    of the files, so the size of the archive is known before any content is read and the same directory always gives
+    the same bytes. Only the member being read is open, memory use doesn't depend on the size of the directory.
+
+    The archive has the layout `zip -r` gives: every member is under the name of the directory, ie. dataset.ms/table.f1,
+    and directories have entries of their own. Checksums are computed as the content streams through; a read that
+    skips ahead computes the checksums it needs from the member files.
+
+    A member whose size changed since the stream was created raises OSError when it is read.
+    """
+
+    def __init__(self, directory: str, arcname: str = None):
+        super().__init__()
+
+        self.directory = pathlib.Path(directory)
+        self.name = f"{self.directory.name if arcname is None else arcname}.zip"
+        self.members = _members(self.directory, root=self.directory.name if arcname is None else arcname)
+
+        # Sections of the archive: local header, content and data descriptor of every member, then the central
+        # directory and end records. Each is (start, kind, member index).
+        self._starts = []
+        self._sections = []
+
+        position = 0
+        for index, member in enumerate(self.members):
+            member.offset = position
+
+            for kind, size in (("header", len(member.local_header)), ("data", member.size),
+                               ("descriptor", member.descriptor_size)):
+                if size > 0:
+                    self._starts.append(position)
+                    self._sections.append((position, kind, index))
+                    position += size
+
+        self.directory_offset = position
+        self.directory_size = sum(len(member.central_header(0)) for member in self.members)
+
+        self._starts.append(position)
+        self._sections.append((position, "directory", None))
+
+        self.size = position + self.directory_size + len(self._end_records())
+
+        self._position = 0
+        self._crcs = {}
+
+        # Running checksum of the member read in order: index, bytes seen, value
+        self._running = (None, 0, 0)
+
+        # Member file currently open
+        self._file = None
+        self._file_index = None
+
+        # Central directory and end records, built once every checksum is known
+        self._tail = None
+
+    def __repr__(self):
+        return f"ZipStream({str(self.directory)}, members={len(self.members)}, size={self.size})"
+
+    @property
+    def mtime(self) -> float:
+        """
+        Latest modification time of a member, which along with the size tells whether the archive changed.
+        """
+        return max((member.mtime for member in self.members), default=0.0)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self._position = position
+
+        return position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        filled = 0
+
+        # Fill the whole buffer across sections, a short read only happens at the end of the archive
+        while filled < len(view) and self._position < self.size:
+            size = self._read_section(view[filled:])
+            self._position += size
+            filled += size
+
+        return filled
+
+    def close(self) -> None:
+        self._close_member()
+        super().close()
+
+    def _read_section(self, view: memoryview) -> int:
+        section = bisect.bisect_right(self._starts, self._position) - 1
+        start, kind, index = self._sections[section]
+        offset = self._position - start
+
+        if kind == "data":
+            return self._read_data(index, offset, view[:self.members[index].size - offset])
+
+        if kind == "header":
+            data = self.members[index].local_header
+
+        elif kind == "descriptor":
+            data = self.members[index].descriptor(self._crc(index))
+
+        else:
+            if self._tail is None:
+                self._tail = b"".join(
+                    member.central_header(self._crc(i)) for i, member in enumerate(self.members)
+                ) + self._end_records()
+
+            data = self._tail
+
+        size = min(len(view), len(data) - offset)
+        view[:size] = data[offset:offset + size]
+
+        return size
+
+    def _read_data(self, index: int, offset: int, view: memoryview) -> int:
+        member = self.members[index]
+
+        if self._file_index != index:
+            self._close_member()
+            self._file = open(member.path, "rb")
+            self._file_index = index
+
+        self._file.seek(offset)
+        size = self._file.readinto(view)
+
+        if not size:
+            raise OSError(f"{str(member.path)} is shorter than when the archive was created")
+
+        running, seen, crc = self._running
+
+        if running == index and seen == offset:
+            self._running = (index, seen + size, zlib.crc32(view[:size], crc))
+
+        elif offset == 0:
+            self._running = (index, size, zlib.crc32(view[:size]))
+
+        if self._running[0] == index and self._running[1] == member.size:
+            self._crcs[index] = self._running[2]
+
+        return size
+
+    def _close_member(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+        self._file, self._file_index = None, None
+
+    def _crc(self, index: int) -> int:
+        member = self.members[index]
+
+        if member.is_dir:
+            return 0
+
+        if index not in self._crcs:
+            # The content was skipped, ie. by a resumed upload, read it once to get the checksum
+            crc, size = 0, 0
+
+            with open(member.path, "rb") as file:
+                while chunk := file.read(CRC_CHUNK_SIZE):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+
+            if size != member.size:
+                raise OSError(f"{str(member.path)} changed size since the archive was created")
+
+            self._crcs[index] = crc
+
+        return self._crcs[index]
+
+    def _end_records(self) -> bytes:
+        count = len(self.members)
+        records = b""
+
+        if count >= ZIP_MAX_ENTRIES or self.directory_offset >= ZIP64_LIMIT or self.directory_size >= ZIP64_LIMIT:
+            records = END_RECORD64.pack(
+                END64_SIGNATURE, END_RECORD64.size - 12, CREATE_SYSTEM << 8 | VERSION64, VERSION64, 0, 0,
+                count, count, self.directory_size, self.directory_offset
+            ) + END_LOCATOR64.pack(LOCATOR64_SIGNATURE, 0, self.directory_offset + self.directory_size, 1)
+
+        return records + END_RECORD.pack(
+            END_SIGNATURE, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(self.directory_size, 0xFFFFFFFF), min(self.directory_offset, 0xFFFFFFFF), 0
+        )
+
+
+def _members(directory: pathlib.Path, root: str) -> list[Member]:
+    """
+    Directories and files below directory in a stable order, depth first with names sorted, named under root.
+    """
+    members = []
+
+    for folder, folders, files in os.walk(directory):
+        folders.sort()
+
+        relative = pathlib.Path(folder).relative_to(directory)
+        prefix = pathlib.PurePosixPath(root, *relative.parts).as_posix()
+
+        stat = os.stat(folder)
+        members.append(Member(None, name=f"{prefix}/", size=0, mtime=stat.st_mtime, mode=stat.st_mode))
+
+        for name in sorted(files):
+            path = pathlib.Path(folder, name)
+            stat = path.stat()
+
+            members.append(Member(path, name=f"{prefix}/{name}", size=stat.st_size, mtime=stat.st_mtime,
+                                  mode=stat.st_mode))
+
+    return members
+
+
+def _dos_time(mtime: float) -> tuple[int, int]:
+    """
+    MS-DOS time and date of a timestamp in local time, as zip stores them; dates before 1980 can't be represented.
+    """
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+
+    return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
@@ -0,0 +1,699 @@
+# asyncio counterpart of DriveTool for services that run many drive operations concurrently on a single event loop.
+
+import time
+import asyncio
+import pathlib
+import itertools
+
+import httpx
+
+from typing import AsyncIterator, BinaryIO, Union
+
+from vipertools.graph import codes as status_code
+from vipertools.graph import GraphQuery
+from vipertools.graph.graph import item_url
+from vipertools.graph import handler
+from vipertools.graph import batch as graph_batch
+from vipertools.graph import metrics as graph_metrics
+from vipertools.mstools import common
+from vipertools.mstools import hashing
+from vipertools.mstools import transfer
+
+from vipertools._lazy import logger
+
+
+# Size of the chunks a download is received and written in
+CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncDriveTool:
+    """
+    Drive operations as coroutines sharing one connection-limited httpx client. Hundreds of operations can be awaited
+    together, ie. with asyncio.gather, and only ever hold max_connections connections open; the rest wait for a free
+    connection instead of a thread. Authentication and request building are delegated to a GraphQuery.
+
+    The app-token is checked, or signed in for, from the event loop when the tool is first used, see connect(). The
+    client is bound to the event loop it is first used on, close it with aclose() or use the tool as an async context
+    manager.
+    """
+    __slots__ = ["graph", "response", "verbose", "client", "limits", "timeout", "_connecting"]
+
+    def __init__(
+            self,
+            verbose: bool = False,
+            graph: GraphQuery = None,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20,
+            timeout: float = 60.0
+    ):
+        # Connecting the GraphQuery here would block the event loop, it is done by connect() instead.
+        self.graph = GraphQuery(verbose=verbose, connect=False) if graph is None else graph
+        self.response = None
+        self.verbose = verbose
+        self.client = None
+        self._connecting = None
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+
+        # Waiting for a free connection is expected when many operations are queued, so it never times out.
+        self.timeout = httpx.Timeout(timeout, pool=None)
+
+    def __repr__(self):
+        return f"AsyncDriveTool(verbose={self.verbose}, max_connections={self.limits.max_connections})"
+
+    def __str__(self, *args, **kwargs):
+        return self.__repr__()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def info(self):
+        """
+        Simple convenience wrapper to display object info
+        Returns
+        -------
+
+        """
+        import rich
+
+        rich.inspect(self.__class__, methods=True, all=False, private=False, dunder=False)
+
+    async def aclose(self) -> None:
+        """
+        Close the connections held by the client.
+        Returns
+        -------
+
+        """
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def connect(self) -> None:
+        """
+        Sign in, or check the app-token with the server, without blocking the event loop; see
+        GraphQuery.connect_async. The first request connects, entering the tool as an async context manager or awaiting
+        connect() does it up front.
+        Returns
+        -------
+
+        """
+        if self.graph.connected:
+            return
+
+        # Created here rather than in __init__, a lock is bound to the event loop it is made on in python 3.9.
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+
+        # Operations started together wait for a single connection
+        async with self._connecting:
+            if not self.graph.connected:
+                await self.graph.connect_async(self._send)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            # Downloads are redirected to a pre-authenticated url, httpx drops the token when following it.
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, follow_redirects=True)
+
+        return self.client
+
+    async def request(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request to the graph server through the shared client. Requests are admitted by the scheduler of the
+        GraphQuery, so throttling seen by the synchronous and asynchronous tools is handled in one place.
+        Parameters
+        ----------
+        method: str
+            HTTP method, ie. GET, POST, PUT.
+        url: str
+            Request url.
+        stream: bool (default False)
+            Return before the body is read, the response must then be closed with aclose().
+        kwargs:
+            Any keyword accepted by httpx.AsyncClient.build_request.
+
+        Returns httpx.Response
+        -------
+
+        """
+        await self.connect()
+
+        return await self._send(method, url=url, stream=stream, **kwargs)
+
+    async def _send(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        # request() without connecting first, connect() checks the token through it.
+        client = self._client()
+        attempts = itertools.count()
+
+        async def send() -> httpx.Response:
+            attempt = next(attempts)
+            request = client.build_request(method, url, **kwargs)
+            start = time.perf_counter()
+
+            try:
+                response = await client.send(request, stream=stream)
+
+            except httpx.HTTPError:
+                self.graph.metrics.request(
+                    method, url, self.graph.base_url,
+                    status=None,
+                    seconds=time.perf_counter() - start,
+                    attempt=attempt
+                )
+                raise
+
+            # A streamed body is only read later, the size the server announced is counted instead.
+            received = graph_metrics.content_length(response.headers)
+            if not received and not stream:
+                received = len(response.content)
+
+            self.graph.metrics.request(
+                method, url, self.graph.base_url,
+                status=response.status_code,
+                seconds=time.perf_counter() - start,
+                sent=graph_metrics.content_length(request.headers),
+                received=received,
+                attempt=attempt
+            )
+
+            return response
+
+        if self.graph.scheduler is None:
+            return await send()
+
+        return await self.graph.scheduler.call_async(send, method)
+
+    #@parameter.validate()
+    async def get_path(self, path: str = "/", page_size: int = None) -> httpx.Response:
+        """
+        Retrieve the first page of the children of a remote folder. Use iter_path() to see every entry.
+        Parameters
+        ----------
+        path: str (defaults /)
+            Remote path to retrieve.
+        page_size: int (defaults None)
+            Number of entries per page, the server default if None.
+
+        Returns httpx.Response
+        -------
+
+        """
+        path = common.format_path(path=path)
+
+        self.response = await self.request(
+            "GET",
+            url=common.children_url(self.graph.base_url, path, page_size),
+            headers=self.graph.header
+        )
+
+        if self.response.status_code != status_code.OK:
+            handler.error(self.response, table=self.verbose)
+
+        return self.response
+
+    async def iter_path(self, path: str = "/", page_size: int = None) -> AsyncIterator[dict]:
+        """
+        Iterate over every entry of a remote folder, following the paged listing as it is consumed. self.response
+        holds the last page response, check it once the iteration is over.
+        Parameters
+        ----------
+        path: str (defaults /)
+            Remote path to list.
+        page_size: int (defaults None)
+            Number of entries per page, the server default if None.
+
+        Returns AsyncIterator[dict]
+        -------
+
+        """
+        url = common.children_url(self.graph.base_url, common.format_path(path=path), page_size)
+
+        while url is not None:
+            logger.debug(url)
+            self.response = await self.request("GET", url=url, headers=self.graph.header)
+
+            if self.response.status_code != status_code.OK:
+                return
+
+            page = self.response.json()
+
+            for entry in page["value"]:
+                yield entry
+
+            url = page.get("@odata.nextLink")
+
+    async def _list_folder(self, path: str, page_size: int = None) -> tuple[httpx.Response, list[dict]]:
+        # Concurrent listings can't share self.response, each one keeps its own.
+        url = common.children_url(self.graph.base_url, path, page_size)
+        entries = []
+
+        while url is not None:
+            response = await self.request("GET", url=url, headers=self.graph.header)
+
+            if response.status_code != status_code.OK:
+                return response, entries
+
+            page = response.json()
+            entries.extend(page["value"])
+            url = page.get("@odata.nextLink")
+
+        return response, entries
+
+    async def _find(self, path: str, name: str) -> tuple[httpx.Response, Union[dict, None]]:
+        # Look an entry up by its path, a single request whatever the size of the folder. Like _list_folder, the
+        # response is returned rather than kept in self.response which concurrent operations would overwrite. The
+        # entry is None with a NOT_FOUND response if the file doesn't exist.
+        url = item_url(self.graph.base_url, common.join_path(common.format_path(path=path), name))
+        response = await self.request("GET", url=url, headers=self.graph.header)
+
+        if response.status_code != status_code.OK:
+            return response, None
+
+        return response, response.json()
+
+    async def batch(self, sub_requests: list[dict], max_workers: int = 4, max_retries: int = 3) -> dict[str, dict]:
+        """
+        Execute many graph requests through JSON $batch calls sent concurrently, see GraphQuery.batch.
+        Parameters
+        ----------
+        sub_requests: list[dict]
+            Sub-requests with keys "id", "method", "url" and optionally "body" and "headers".
+        max_workers: int (default 4)
+            Number of $batch calls in flight.
+        max_retries: int (default 3)
+            Number of times a throttled or failed sub-request is retried.
+
+        Returns dict[str, dict]
+        -------
+            Sub-responses, each with keys "status", "headers" and "body", indexed by sub-request id.
+        """
+        pending = graph_batch.prepare(sub_requests, hostname=self.graph.hostname, version=self.graph.version)
+        responses = {}
+
+        # Thousands of sub-requests are hundreds of calls, only max_workers of them are sent at a time.
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def send(requests: list[dict]) -> dict[str, dict]:
+            async with semaphore:
+                return await self._send_batch(requests)
+
+        for attempt in range(max_retries + 1):
+            calls = [send(requests) for requests in graph_batch.chunk(list(pending.values()))]
+
+            sub_responses = {}
+            for results in await asyncio.gather(*calls):
+                sub_responses.update(results)
+
+            retry, delay = graph_batch.settle(
+                pending, sub_responses, responses,
+                attempt=attempt,
+                max_retries=max_retries,
+                metrics=self.graph.metrics
+            )
+
+            if not retry:
+                break
+
+            logger.debug(f"Retrying {len(retry)} failed sub-requests in {delay:.2f}s ...")
+            await asyncio.sleep(delay)
+            pending = retry
+
+        return responses
+
+    async def _send_batch(self, sub_requests: list[dict]) -> dict[str, dict]:
+        response = await self.request(
+            "POST",
+            url=f"{self.graph.base_url}/$batch",
+            json={"requests": sub_requests},
+            headers=self.graph.header
+        )
+
+        return graph_batch.results(response, sub_requests)
+
+    #@parameter.validate()
+    @common.measured("generate_manifest")
+    async def generate_manifest(
+            self,
+            path: str = "/",
+            version: str = None,
+            destination: str = None,
+            incremental: bool = False
+    ) -> dict[str, list]:
+        """
+        Generate a manifest file from the files of a remote folder, see DriveTool.generate_manifest.
+        Parameters
+        ----------
+        path: str, (default /)
+            The remote path to generate the manifest file from.
+        version: str (defaults None)
+            Version of newly generated manifest for.
+        destination: str (defaults None)
+            Destination path to generate manifest, the current working directory if None.
+        incremental: bool (defaults False)
+            Only create sharing links for entries that are new or changed since the manifest was last generated.
+
+        Returns dict[str, list]
+        -------
+            Manifest keys that were "added", "changed", "removed" or left "unchanged", and the ones whose link could not
+            be created, "failed".
+        """
+        manifest_path, manifest = await asyncio.to_thread(common.load_manifest, destination)
+
+        if version is not None:
+            manifest["version"] = version
+
+        _manifest = {
+            "version": manifest["version"],
+            "metadata": {}
+        }
+
+        response, entries = await self._list_folder(common.format_path(path=path))
+
+        if response.status_code != status_code.OK:
+            handler.error(response, table=self.verbose)
+            return {}
+
+        selected = common.select_entries(entries)
+
+        summary, linked = common.plan_manifest(manifest, _manifest, selected=selected, incremental=incremental)
+        sub_requests = common.link_requests(self.graph, linked)
+
+        responses = await self.batch(sub_requests) if sub_requests else {}
+
+        written = common.apply_links(
+            manifest, _manifest, summary,
+            linked=linked,
+            responses=responses,
+            verbose=self.verbose
+        )
+
+        await asyncio.to_thread(common.write_manifest, manifest_path, _manifest)
+
+        logger.info(
+            f"Manifest: {len(summary['added'])} added, {len(summary['changed'])} changed, "
+            f"{len(summary['removed'])} removed, {len(summary['unchanged'])} unchanged, "
+            f"{len(summary['failed'])} failed, {len(written)} links created"
+        )
+
+        return summary
+
+    #@parameter.validate()
+    @common.measured("download")
+    async def download(self, path: str, filename: str, destination: str = None) -> Union[httpx.Response, int]:
+        """
+        Download a file from onedrive given a path. The content is checked against the QuickXorHash onedrive reports
+        for the file; a mismatching download is fetched once more, a second mismatch removes the file and raises
+        IntegrityError.
+        Parameters
+        ----------
+        path: str
+            Onedrive path where file exists.
+        filename: str
+            File to download.
+        destination: str (default None)
+            Local directory to download into, the current working directory if None.
+
+        Returns httpx.Response | int
+        -------
+            Status code on success, the failed response otherwise, as DriveTool.download; a missing file is a
+            NOT_FOUND response.
+        """
+        logger.info(f"Downloading {filename} from {path}...")
+
+        response, item = await self._find(path, filename)
+
+        if response.status_code != status_code.OK:
+            if response.status_code == status_code.NOT_FOUND:
+                logger.error(f"{filename} not found in {path}")
+
+            handler.error(response, table=self.verbose)
+            return response
+
+        target = str((pathlib.Path.cwd() if destination is None else pathlib.Path(destination)).joinpath(filename))
+
+        url, header = item.get("@microsoft.graph.downloadUrl"), {}
+        if url is None:
+            url, header = self.graph.build_download_request(item_id=item["id"])
+
+        expected = hashing.expected_hash(item)
+
+        for attempt in range(2):
+            digest = hashing.QuickXorHash()
+
+            response = await self.request("GET", url=url, headers=header, stream=True)
+
+            try:
+                if response.status_code != status_code.OK:
+                    await response.aread()
+                    handler.error(response, table=self.verbose)
+                    return response
+
+                await _receive(response, target=target, digest=digest)
+
+            finally:
+                await response.aclose()
+
+            if common.verified(target, expected=expected, digest=digest):
+                return status_code.OK
+
+            if attempt == 0:
+                logger.warning(f"{filename} does not match the remote content hash, downloading again ...")
+
+        pathlib.Path(target).unlink(missing_ok=True)
+
+        raise hashing.IntegrityError(target, expected=expected, actual=digest.b64digest())
+
+    #@parameter.validate()
+    @common.measured("upload")
+    async def upload(self, filename: str, path: str, fragment_size: int = None) -> httpx.Response:
+        """
+        Upload a file on onedrive, replacing the remote file of the same name or creating it. Files larger than a simple
+        upload allows go through an upload session, resumed if upload is called again after an interruption.
+        IntegrityError is raised if the content hash onedrive reports for the uploaded file does not match the local one.
+        Parameters
+        ----------
+        filename: str
+            Local filename of file to be uploaded.
+        path: str
+            Onedrive path to upload to.
+        fragment_size: int (default None)
+            Force an upload session with fragments of this size, rounded down to a multiple of 320 KiB.
+
+        Returns httpx.Response
+        -------
+
+        """
+        logger.info(f"Uploading {filename} to {path}...")
+
+        path = common.format_path(path=path)
+        name = pathlib.Path(filename).name
+
+        response, item = await self._find(path, name)
+
+        # A file that doesn't exist yet is created
+        if response.status_code not in (status_code.OK, status_code.NOT_FOUND):
+            handler.error(response, table=self.verbose)
+            return response
+
+        mode = "create" if item is None else "update"
+        item_id = None if item is None else item["id"]
+
+        digest = hashing.QuickXorHash()
+
+        if common.use_session(filename=filename, fragment_size=fragment_size):
+            url, body, header = self.graph.build_upload_session_request(
+                item_id=item_id,
+                path=path,
+                filename=name,
+                mode=mode
+            )
+
+            response = await self._upload_session(
+                filename=filename,
+                url=url,
+                body=body,
+                header=header,
+                fragment_size=fragment_size,
+                digest=digest
+            )
+
+        else:
+            data = await asyncio.to_thread(_read, filename, digest)
+
+            url, header = self.graph.build_upload_request(item_id=item_id, path=path, filename=name, mode=mode)
+            response = await self.request("PUT", url=url, headers=header, content=data)
+
+        if response.status_code in (status_code.OK, status_code.CREATED):
+            common.check_upload(filename, response=response, digest=digest)
+            logger.info(f"Uploaded {filename} to {path}")
+
+        else:
+            handler.error(response, table=self.verbose)
+
+        return response
+
+    async def _upload_session(
+            self,
+            filename: str,
+            url: str,
+            body: dict,
+            header: dict,
+            fragment_size: int = None,
+            retries: int = 3,
+            digest: hashing.QuickXorHash = None
+    ) -> httpx.Response:
+        """
+        Send a local file through an upload session one fragment at a time, see DriveTool._upload_session. Reading
+        and hashing the fragments and saving the session state run in a thread, off the event loop.
+        """
+        state = await asyncio.to_thread(transfer.UploadState, filename)
+        session = transfer.SessionUpload(state, fragment=fragment_size, digest=digest)
+
+        if (saved_url := await asyncio.to_thread(session.saved_url)) is not None:
+            # The upload url is pre-authenticated, sending the app token along is not allowed.
+            response = await self.request("GET", url=saved_url)
+
+            if await asyncio.to_thread(session.resume, saved_url, response):
+                logger.info(f"Resuming upload session of {filename} ...")
+
+        if session.upload_url is None:
+            response = await self.request("POST", url=url, json=body, headers=header)
+
+            if response.status_code != status_code.OK:
+                return response
+
+            await asyncio.to_thread(session.open, response)
+
+        file = await asyncio.to_thread(open, filename, "rb")
+
+        try:
+            while (fragment := await asyncio.to_thread(session.next_fragment, file)) is not None:
+                start, end, data = fragment
+
+                try:
+                    response = await self.request(
+                        "PUT",
+                        url=session.upload_url,
+                        headers=session.headers(start, end),
+                        content=data
+                    )
+
+                except httpx.TransportError as error:
+                    if retries == 0:
+                        raise
+
+                    retries -= 1
+                    logger.warning(f"Connection lost while uploading {filename} ({error}), resuming ...")
+
+                    response = await self.request("GET", url=session.upload_url)
+                    if response.status_code != status_code.OK:
+                        return response
+
+                    await asyncio.to_thread(session.update, response)
+                    continue
+
+                if response.status_code in (status_code.OK, status_code.CREATED):
+                    await asyncio.to_thread(session.complete, file)
+                    break
+
+                if response.status_code != status_code.ACCEPTED:
+                    return response
+
+                await asyncio.to_thread(session.update, response)
+
+        finally:
+            await asyncio.to_thread(file.close)
+
+        return response
+
+    #@parameter.validate()
+    async def listdir(self, path: str = "/", recursive: bool = False) -> None:
+        """
+        List the contents of a remote directory.
+        Parameters
+        ----------
+        path: str, (default "/")
+            Remote path to list the contents from.
+        recursive: bool (default False)
+            Display the full tree below path, every folder of a level is listed concurrently.
+
+        Returns
+        -------
+        None
+
+        """
+        import rich
+
+        path = common.format_path(path)
+
+        tree = common.tree(path)
+        level = [(path, tree)]
+
+        while level:
+            listings = await asyncio.gather(*(self._list_folder(folder) for folder, _ in level))
+
+            following = []
+            for (folder, node), (response, entries) in zip(level, listings):
+                if response.status_code != status_code.OK:
+                    handler.error(response, table=self.verbose)
+
+                    if folder == path:
+                        return
+
+                    continue
+
+                nodes = common.add_entries(node, folder=folder, entries=entries)
+
+                if recursive:
+                    following.extend(nodes.items())
+
+            level = following
+
+        rich.print(tree)
+
+
+async def _receive(response: httpx.Response, target: str, digest: hashing.QuickXorHash) -> None:
+    """
+    Write a streamed response to target. Writing and hashing a chunk run in a thread while the next chunk is received,
+    at most one chunk is waiting to be written.
+    """
+    file = await asyncio.to_thread(open, target, "wb")
+    writing = None
+
+    try:
+        async for chunk in response.aiter_bytes(chunk_size=CHUNK_SIZE):
+            if writing is not None:
+                await writing
+
+            writing = asyncio.ensure_future(asyncio.to_thread(_write, file, chunk, digest))
+
+        if writing is not None:
+            await writing
+
+    finally:
+        # The file can only be closed once the thread is done with it
+        if writing is not None and not writing.done():
+            await asyncio.wait([writing])
+
+        await asyncio.to_thread(file.close)
+
+
+def _write(file: BinaryIO, chunk: bytes, digest: hashing.QuickXorHash) -> None:
+    file.write(chunk)
+    digest.update(chunk)
+
+
+def _read(filename: str, digest: hashing.QuickXorHash) -> bytes:
+    with open(filename, "rb") as file:
+        data = file.read()
+
+    digest.update(data)
+
+    return data
@@ -0,0 +1,470 @@
+# Local caches that save round trips and transfers to onedrive.
+
+import os
+import json
+import time
+import hashlib
+import shutil
+import pathlib
+import weakref
+import threading
+
+from collections import OrderedDict
+from typing import Union
+
+from vipertools._lazy import logger
+
+
+class ListingCache:
+    """
+    Folder listings keyed by remote path, kept in memory with LRU eviction and optionally persisted to disk. A listing
+    younger than ttl is trusted as is; an older one is only reused if the folder tag it was stored with, built from the
+    folder eTag/cTag, still matches the server. Every listing comes with an index of its entries by name, so looking a
+    file up in a cached folder is a dictionary access.
+    """
+
+    def __init__(self, ttl: float = 30.0, maxsize: int = 128, directory: Union[str, None] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.directory = None if directory is None else pathlib.Path(directory)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return f"ListingCache(ttl={self.ttl}, maxsize={self.maxsize}, directory={self.directory})"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path: str) -> Union[dict, None]:
+        """
+        Cached listing of a folder.
+        Parameters
+        ----------
+        path: str
+            Formatted remote path.
+
+        Returns dict | None
+        -------
+            Cached record with keys "entries", "index", "tag", "fresh" and "response", None on a miss. "index" maps the
+            entry names to the entries, "fresh" tells whether the listing is within its ttl, "response" is the response
+            the listing was validated with, if it is still in memory.
+        """
+        with self._lock:
+            record = self._entries.get(path)
+
+            if record is None:
+                record = self._load(path)
+
+                if record is not None:
+                    self._store(path, record)
+
+            if record is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(path)
+            fresh = time.time() - record["stored"] < self.ttl
+
+            # A stale record still costs a round trip to revalidate it, so it only counts as a hit when fresh.
+            if fresh:
+                self.hits += 1
+
+            else:
+                self.misses += 1
+
+            return dict(record, fresh=fresh)
+
+    def put(self, path: str, entries: list[dict], tag: Union[str, None], response=None) -> dict:
+        """
+        Store the listing of a folder.
+        Parameters
+        ----------
+        path: str
+            Formatted remote path.
+        entries: list[dict]
+            Drive item entries of the folder.
+        tag: str | None
+            Folder version tag the listing belongs to.
+        response: requests.Response
+            Response the listing was obtained with, kept in memory only.
+
+        Returns dict
+        -------
+            Stored record, as get() returns it.
+        """
+        record = {"entries": entries, "index": _name_index(entries), "tag": tag, "stored": time.time(),
+                  "response": response}
+
+        with self._lock:
+            self._store(path, record)
+
+        if self.directory is not None:
+            self._dump(path, record)
+
+        return dict(record, fresh=True)
+
+    def touch(self, path: str, response=None) -> None:
+        """
+        Mark a cached listing as revalidated.
+        Returns
+        -------
+
+        """
+        with self._lock:
+            record = self._entries.get(path)
+
+            if record is None:
+                return
+
+            record["stored"] = time.time()
+            record["response"] = response
+
+    def invalidate(self, path: Union[str, None] = None) -> None:
+        """
+        Drop the cached listing of a folder, or every listing if path is None.
+        Returns
+        -------
+
+        """
+        with self._lock:
+            paths = list(self._entries) if path is None else [path]
+
+            for key in paths:
+                self._entries.pop(key, None)
+
+            if self.directory is not None:
+                files = self.directory.glob("*.json") if path is None else [self._file(path)]
+
+                for file in files:
+                    file.unlink(missing_ok=True)
+
+    def _store(self, path: str, record: dict) -> None:
+        self._entries[path] = record
+        self._entries.move_to_end(path)
+
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            logger.debug(f"Evicting cached listing of {evicted}")
+
+    def _file(self, path: str) -> pathlib.Path:
+        return self.directory.joinpath(f"{hashlib.sha1(path.encode('utf-8')).hexdigest()}.json")
+
+    def _load(self, path: str) -> Union[dict, None]:
+        if self.directory is None or not self._file(path).exists():
+            return None
+
+        try:
+            with open(self._file(path), "r") as file:
+                record = json.load(file)
+
+        except (OSError, ValueError):
+            return None
+
+        # Listings read back from disk have no response attached and are always revalidated before use.
+        record["response"] = None
+        record["stored"] = 0.0
+        record["index"] = _name_index(record["entries"])
+
+        return record
+
+    def _dump(self, path: str, record: dict) -> None:
+        record = {"path": path, "entries": record["entries"], "tag": record["tag"]}
+
+        file = self._file(path)
+        temporary = file.with_name(f"{file.name}.{threading.get_ident()}.tmp")
+
+        with open(temporary, "w") as stream:
+            json.dump(record, stream)
+
+        os.replace(temporary, file)
+
+        # Apply the same size limit on disk, dropping the least recently written listings.
+        files = list(self.directory.glob("*.json"))
+        if len(files) <= self.maxsize:
+            return
+
+        try:
+            files.sort(key=lambda item: item.stat().st_mtime)
+
+        except FileNotFoundError:
+            # Another thread is evicting at the same time
+            return
+
+        for stale in files[:len(files) - self.maxsize]:
+            stale.unlink(missing_ok=True)
+
+
+class DownloadCache:
+    """
+    Local copies of downloaded files keyed by the content hash onedrive reports for the item, or by its eTag when no
+    hash is available. A hit is materialised as a copy instead of fetching the file again, so a download can be
+    modified without touching the cache; a cached file whose size or modification time no longer match the ones it
+    was stored with is dropped rather than served. The cache is kept within a size budget by evicting the least
+    recently used files.
+
+    The index is written when files are added or evicted. Hits and misses only update it in memory until close(),
+    which also runs when the cache is garbage collected or the interpreter exits.
+    """
+
+    def __init__(self, directory: str, budget: int = 10 * 1024 ** 3):
+        self.directory = pathlib.Path(directory)
+        self.budget = budget
+
+        self._lock = threading.Lock()
+
+        self.directory.joinpath("objects").mkdir(parents=True, exist_ok=True)
+
+        self._index = self._load_index()
+
+        # Set while the index in memory has changes the file doesn't
+        self._dirty = threading.Event()
+        self._finalizer = weakref.finalize(self, _flush_index, self.directory, self._index, self._dirty)
+
+    def __repr__(self):
+        return f"DownloadCache({str(self.directory)}, budget={self.budget})"
+
+    def __len__(self):
+        return len(self._index["objects"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the cached files in bytes.
+        """
+        return sum(record["size"] for record in self._index["objects"].values())
+
+    @property
+    def stats(self) -> dict:
+        """
+        Cache statistics: "hits", "misses", "bytes_saved", "files" and "size".
+        Returns dict
+        -------
+
+        """
+        with self._lock:
+            return dict(self._index["stats"], files=len(self), size=self.size)
+
+    @staticmethod
+    def key(item: dict) -> Union[str, None]:
+        """
+        Cache key of a drive item.
+        Parameters
+        ----------
+        item: dict
+            Drive item, with its file facet.
+
+        Returns str | None
+        -------
+            Key built from the item content hash, or from the item eTag if the drive reports no hash. None if the item
+            has neither.
+        """
+        hashes = item.get("file", {}).get("hashes", {})
+
+        for name in ("quickXorHash", "sha256Hash", "sha1Hash"):
+            if hashes.get(name):
+                return hashlib.sha1(f"{name}:{hashes[name]}:{item.get('size')}".encode("utf-8")).hexdigest()
+
+        if item.get("eTag"):
+            return hashlib.sha1(f"eTag:{item['eTag']}".encode("utf-8")).hexdigest()
+
+        return None
+
+    def fetch(self, item: dict, filename: str) -> bool:
+        """
+        Materialise a cached copy of an item at filename.
+        Parameters
+        ----------
+        item: dict
+            Drive item to look up.
+        filename: str
+            Local file to create, replaced if it exists.
+
+        Returns bool
+        -------
+            True on a hit, False if the item has to be downloaded.
+        """
+        key = self.key(item)
+
+        with self._lock:
+            record = None if key is None else self._index["objects"].get(key)
+
+            if record is None or not self._intact(key, record):
+                if record is not None:
+                    logger.warning(f"Cached copy of {record.get('name')} was modified or removed, dropping it ...")
+                    self._file(key).unlink(missing_ok=True)
+                    self._index["objects"].pop(key)
+                    self._dump_index()
+
+                self._index["stats"]["misses"] += 1
+                self._dirty.set()
+
+                return False
+
+            record["used"] = time.time()
+
+            _materialise(self._file(key), pathlib.Path(filename))
+
+            self._index["stats"]["hits"] += 1
+            self._index["stats"]["bytes_saved"] += record["size"]
+            self._dirty.set()
+
+        logger.info(f"Using cached copy of {pathlib.Path(filename).name}")
+
+        return True
+
+    def store(self, item: dict, filename: str) -> None:
+        """
+        Add a downloaded file to the cache, evicting the least recently used files to stay within the budget.
+        Parameters
+        ----------
+        item: dict
+            Drive item the file was downloaded from.
+        filename: str
+            Local copy of the item.
+
+        Returns
+        -------
+
+        """
+        key = self.key(item)
+        size = os.stat(filename).st_size
+
+        if key is None or size > self.budget:
+            return
+
+        with self._lock:
+            target = self._file(key)
+            record = self._index["objects"].get(key)
+
+            if record is None or not self._intact(key, record):
+                temporary = target.with_name(f"{target.name}.{threading.get_ident()}.tmp")
+
+                _materialise(pathlib.Path(filename), temporary)
+                os.replace(temporary, target)
+
+            self._index["objects"][key] = {
+                "size": size,
+                "mtime": target.stat().st_mtime_ns,
+                "used": time.time(),
+                "name": item.get("name")
+            }
+
+            self._evict()
+            self._dump_index()
+
+    def close(self) -> None:
+        """
+        Write the hits, misses and recency recorded since the index was last written.
+        Returns
+        -------
+
+        """
+        with self._lock:
+            _flush_index(self.directory, self._index, self._dirty)
+
+    def clear(self) -> None:
+        """
+        Remove every cached file, statistics are kept.
+        Returns
+        -------
+
+        """
+        with self._lock:
+            for key in list(self._index["objects"]):
+                self._file(key).unlink(missing_ok=True)
+
+            self._index["objects"] = {}
+            self._dump_index()
+
+    def _evict(self) -> None:
+        total = self.size
+
+        for key, record in sorted(self._index["objects"].items(), key=lambda pair: pair[1]["used"]):
+            if total <= self.budget:
+                break
+
+            logger.debug(f"Evicting cached download {record.get('name')}")
+
+            self._file(key).unlink(missing_ok=True)
+            self._index["objects"].pop(key)
+            total -= record["size"]
+
+    def _file(self, key: str) -> pathlib.Path:
+        return self.directory.joinpath("objects", key)
+
+    def _intact(self, key: str, record: dict) -> bool:
+        # The cached file is still the one that was stored
+        try:
+            stat = self._file(key).stat()
+
+        except FileNotFoundError:
+            return False
+
+        return (stat.st_size, stat.st_mtime_ns) == (record["size"], record.get("mtime"))
+
+    def _load_index(self) -> dict:
+        index = {"objects": {}, "stats": {"hits": 0, "misses": 0, "bytes_saved": 0}}
+
+        try:
+            with open(self.directory.joinpath("index.json"), "r") as file:
+                index.update(json.load(file))
+
+        except FileNotFoundError:
+            pass
+
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable download cache index in {str(self.directory)}, starting empty ...")
+
+        return index
+
+    def _dump_index(self) -> None:
+        self._dirty.set()
+        _flush_index(self.directory, self._index, self._dirty)
+
+
+def _flush_index(directory: pathlib.Path, index: dict, dirty: threading.Event) -> None:
+    # Write the index of a download cache if it has unsaved changes. This doesn't take the cache itself so that it can
+    # run as its finalizer.
+    if not dirty.is_set():
+        return
+
+    file = directory.joinpath("index.json")
+    temporary = file.with_name(f"{file.name}.{threading.get_ident()}.tmp")
+
+    try:
+        with open(temporary, "w") as stream:
+            json.dump(index, stream)
+
+        os.replace(temporary, file)
+
+    except OSError as error:
+        logger.warning(f"Unable to write the download cache index in {str(directory)}: {error}")
+        return
+
+    dirty.clear()
+
+
+def _materialise(source: pathlib.Path, target: pathlib.Path) -> None:
+    # A copy rather than a hardlink, the two files must not share content. copyfile uses an in-kernel copy where the
+    # platform has one.
+    target.unlink(missing_ok=True)
+    shutil.copyfile(source, target)
+
+
+def _name_index(entries: list[dict]) -> dict[str, dict]:
+    # Entries of a listing by name, names are unique within a folder
+    return {entry["name"]: entry for entry in entries}
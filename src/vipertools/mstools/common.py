@@ -0,0 +1,469 @@
+# Helpers shared by DriveTool and AsyncDriveTool: remote paths, upload checks, manifest generation and listings.
+
+import json
+import inspect
+import pathlib
+import functools
+import requests
+
+from typing import TYPE_CHECKING, Callable, Iterator, Union
+
+# rich renders the listings, its widgets are imported when something is displayed.
+if TYPE_CHECKING:
+    from rich.text import Text
+    from rich.tree import Tree
+
+from vipertools.graph import codes as status_code
+from vipertools.graph import GraphQuery
+from vipertools.graph.graph import item_url
+from vipertools.graph import handler
+from vipertools.mstools import hashing
+from vipertools.mstools import transfer
+
+from vipertools._lazy import logger
+
+# Sharing links created for the manifest are stored relative to this url
+SHAREPOINT_URL = "https://nrao-my.sharepoint.com/"
+
+
+def measured(name: str) -> Callable:
+    """
+    Record the requests a method makes under an operation of the graph metrics, and time the method. A coroutine
+    method, ie. of AsyncDriveTool, is timed until it completes.
+    """
+    def decorator(method: Callable) -> Callable:
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def coroutine(self, *args, **kwargs):
+                with self.graph.metrics.operation(name):
+                    return await method(self, *args, **kwargs)
+
+            return coroutine
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.graph.metrics.operation(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def format_path(path: str) -> str:
+    """
+    Format a remote path. The path that is sent to the remote query is picky about how the path is formatted so
+    beginning and trailing slashes must be trimmed.
+
+    Parameters
+    ----------
+    path: str
+        Remote path to format.
+
+    Returns str
+    -------
+        Trimmed path
+    """
+
+    if path == "/":
+        return path
+
+    if path.startswith("/"):
+        path = path[1:]
+
+    if path.endswith("/"):
+        path = path[:-1]
+
+    return path
+
+
+def join_path(folder: str, name: str) -> str:
+    """
+    Join a formatted remote folder path and an entry name.
+
+    Parameters
+    ----------
+    folder: str
+        Formatted remote folder path.
+    name: str
+        Name of the entry in the folder.
+
+    Returns str
+    -------
+        Formatted path of the entry
+    """
+    if folder == "/":
+        return name
+
+    return "/".join((folder, name))
+
+
+def children_url(base_url: str, path: str = "/", page_size: int = None) -> str:
+    """
+    Url of the first page of the children of a formatted remote folder path, with at most page_size entries a page.
+    """
+    url = item_url(base_url, path, action="children")
+
+    if page_size is not None:
+        url = f"{url}?$top={page_size}"
+
+    return url
+
+
+def use_session(filename: str, fragment_size: Union[int, None]) -> bool:
+    """
+    Decide whether a local file is sent through an upload session or a single PUT.
+
+    Parameters
+    ----------
+    filename: str
+        Local file to upload.
+    fragment_size: int | None
+        Fragment size explicitly requested by the caller.
+
+    Returns bool
+    -------
+
+    """
+    size = pathlib.Path(filename).stat().st_size
+
+    # An empty file can't be described by a Content-Range, it always goes through a simple upload.
+    if size == 0:
+        return False
+
+    return fragment_size is not None or size > transfer.SIMPLE_UPLOAD_LIMIT
+
+
+def check_upload(filename: str, response: requests.Response, digest: hashing.QuickXorHash) -> None:
+    """
+    Compare the hash of an uploaded file with the QuickXorHash onedrive reports for the item it created, raising
+    IntegrityError on a mismatch.
+    """
+    try:
+        expected = hashing.expected_hash(response.json())
+
+    except ValueError:
+        expected = None
+
+    if not verified(filename, expected=expected, digest=digest):
+        raise hashing.IntegrityError(filename, expected=expected, actual=digest.b64digest())
+
+
+def verified(filename: str, expected: Union[str, None], digest: hashing.QuickXorHash = None) -> bool:
+    """
+    Check a transferred file against the QuickXorHash reported by onedrive.
+
+    Parameters
+    ----------
+    filename: str
+        Local copy of the file.
+    expected: str | None
+        Base64 encoded hash reported by onedrive, nothing is checked if None.
+    digest: QuickXorHash
+        Hash computed while the file was transferred, the file is hashed from disk if None.
+
+    Returns bool
+    -------
+        True if the content matches or there is nothing to compare with.
+    """
+    if expected is None:
+        logger.debug(f"No QuickXorHash reported for {filename}, skipping the integrity check ...")
+        return True
+
+    actual = hashing.quickxorhash(filename) if digest is None else digest.b64digest()
+
+    if actual != expected:
+        logger.warning(f"QuickXorHash mismatch for {filename}: expected {expected}, computed {actual}")
+        return False
+
+    return True
+
+
+def _create_manifest(path: str) -> str:
+    manifest = {
+        "version": "",
+        "metadata": {
+
+        }
+    }
+    manifest_path = pathlib.Path(path).joinpath("file.download.json")
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=4)
+
+    return str(manifest_path)
+
+
+def load_manifest(destination: Union[str, None]) -> tuple[pathlib.Path, dict]:
+    """
+    Path and content of the file.download.json manifest in destination, created from the template if there is none.
+    """
+    # destination becomes current directory is not specified
+    if destination is None:
+        logger.debug("File destination not defined, writing to current working directory ...")
+        destination = str(pathlib.Path())
+
+    # Create the directory if it doesn't exist.
+    if not pathlib.Path(destination).exists():
+        logger.debug(f"Creating manifest directory: {str(pathlib.Path(destination).resolve())} ...")
+        pathlib.Path(destination).resolve().mkdir(parents=True, exist_ok=True)
+
+    manifest_path = pathlib.Path(destination).resolve().joinpath("file.download.json")
+    if not manifest_path.exists():
+        logger.debug(f"Creating new manifest file form template ...")
+        manifest_path = pathlib.Path(_create_manifest(str(manifest_path.parent)))
+
+    logger.info(f"Generating manifest for {str(manifest_path)}")
+
+    with open(manifest_path, "r") as file:
+        return manifest_path, json.load(file)
+
+
+def write_manifest(manifest_path: pathlib.Path, manifest: dict) -> None:
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+
+
+def select_entries(entries: Iterator[dict]) -> dict[str, dict]:
+    """
+    Drive items of a listing by manifest key, the file name without .zip. Only the first of items sharing a key is
+    kept, which can happen when crawling subfolders.
+    """
+    selected = {}
+
+    for entry in entries:
+        key_name = entry["name"].rsplit(".zip")[0]
+
+        if key_name in selected:
+            logger.warning(f"Duplicate manifest key {key_name} found, keeping the first entry ...")
+            continue
+
+        selected[key_name] = entry
+
+    return selected
+
+
+def plan_manifest(
+        manifest: dict,
+        _manifest: dict,
+        selected: dict[str, dict],
+        incremental: bool
+) -> tuple[dict[str, list], dict[str, dict]]:
+    """
+    Compare the listed items with the current manifest. Entries that keep their link, unchanged ones in incremental
+    mode, are copied to the new manifest _manifest.
+
+    Parameters
+    ----------
+    manifest: dict
+        Current manifest.
+    _manifest: dict
+        Manifest being generated.
+    selected: dict[str, dict]
+        Drive items by manifest key, see select_entries().
+    incremental: bool
+        Keep the link of the entries that didn't change.
+
+    Returns tuple[dict[str, list], dict[str, dict]]
+    -------
+        Manifest keys that are "added", "changed", "removed" or "unchanged", and the items to create a link for by key.
+        The keys whose link then fails are moved to "failed" by apply_links().
+    """
+    summary = {
+        "added": [key for key in selected if key not in manifest["metadata"]],
+        "changed": [],
+        "removed": sorted(key for key in manifest["metadata"] if key not in selected),
+        "unchanged": [],
+        "failed": []
+    }
+
+    # Entries whose remote item is the same version as the one recorded keep their link
+    linked = {}
+    for key_name, entry in selected.items():
+        if key_name not in manifest["metadata"]:
+            linked[key_name] = entry
+
+        elif _entry_changed(manifest["metadata"][key_name], entry):
+            summary["changed"].append(key_name)
+            linked[key_name] = entry
+
+        elif incremental:
+            summary["unchanged"].append(key_name)
+            _manifest["metadata"][key_name] = manifest["metadata"][key_name]
+
+        else:
+            summary["unchanged"].append(key_name)
+            linked[key_name] = entry
+
+    return summary, linked
+
+
+def link_requests(graph: GraphQuery, linked: dict[str, dict]) -> list[dict]:
+    """
+    $batch sub-requests creating a sharing link for every item of linked, their ids are the positions of the items.
+    """
+    sub_requests = []
+    for i, entry in enumerate(linked.values()):
+        url, body, header = graph.build_link_request(item_id=entry["id"])
+        sub_requests.append({"id": str(i), "method": "POST", "url": url, "body": body})
+
+    return sub_requests
+
+
+def apply_links(
+        manifest: dict,
+        _manifest: dict,
+        summary: dict[str, list],
+        linked: dict[str, dict],
+        responses: dict[str, dict],
+        verbose: bool = False
+) -> list[str]:
+    """
+    Record the sharing links created for linked in the new manifest _manifest. An entry whose link could not be created
+    keeps its previous record, if it has one, and its key is reported as "failed" instead of added or changed.
+
+    Parameters
+    ----------
+    manifest: dict
+        Current manifest.
+    _manifest: dict
+        Manifest being generated.
+    summary: dict[str, list]
+        Summary of the generation, see plan_manifest(), updated in place.
+    linked: dict[str, dict]
+        Drive items a link was requested for by manifest key, see plan_manifest().
+    responses: dict[str, dict]
+        Sub-responses of the link requests, see link_requests().
+    verbose: bool (default False)
+        Report failures as a table.
+
+    Returns list[str]
+    -------
+        Manifest keys that got a new link.
+    """
+    written = []
+
+    for i, (key_name, entry) in enumerate(linked.items()):
+        response = responses[str(i)]
+
+        if response["status"] not in (status_code.OK, status_code.CREATED):
+            logger.warning(f"Unable to create a link for {key_name}, keeping the previous entry ...")
+            handler.error(response, table=verbose)
+
+            if key_name in manifest["metadata"]:
+                _manifest["metadata"][key_name] = manifest["metadata"][key_name]
+
+            for keys in (summary["added"], summary["changed"], summary["unchanged"]):
+                if key_name in keys:
+                    keys.remove(key_name)
+
+            summary["failed"].append(key_name)
+            continue
+
+        record = manifest["metadata"].setdefault(
+            key_name, {
+                "file": entry["name"],
+                "id": "",
+                "dtype": "",
+                "telescope": "",
+                "size": entry["size"],
+                "mode": ""
+            })
+
+        record["id"] = response["body"]["link"]["webUrl"].split(SHAREPOINT_URL)[1]
+
+        # Remote version of the item the link was created for, checked by the next incremental run
+        record["etag"] = entry.get("eTag", "")
+        record["ctag"] = entry.get("cTag", "")
+
+        if isinstance(record["size"], int):
+            record["size"] = entry["size"]
+
+        _manifest["metadata"][key_name] = record
+        written.append(key_name)
+
+    return written
+
+
+def _entry_changed(record: dict, entry: dict) -> bool:
+    """
+    Tell whether a remote item differs from the version recorded in the manifest.
+
+    Parameters
+    ----------
+    record: dict
+        Manifest entry.
+    entry: dict
+        Drive item entry.
+
+    Returns bool
+    -------
+        True if the manifest entry has no link yet or was recorded for another version of the item.
+    """
+    if not record.get("id") or "etag" not in record:
+        return True
+
+    # Older manifests store the size in GB as a string, in which case only the tags are compared.
+    if isinstance(record.get("size"), int) and record["size"] != entry.get("size"):
+        return True
+
+    return (record["etag"], record.get("ctag")) != (entry.get("eTag", ""), entry.get("cTag", ""))
+
+
+def tree(path: str) -> "Tree":
+    """
+    Root node of the tree a remote folder is displayed as.
+    """
+    from rich.tree import Tree
+
+    return Tree(
+        f":open_file_folder: [link file://{path}]{path}",
+        guide_style="bold bright_blue",
+    )
+
+
+def add_entries(node: "Tree", folder: str, entries: list[dict]) -> dict[str, "Tree"]:
+    """
+    Add the entries of a remote folder below its node, returning the nodes of its subfolders by path.
+    """
+    nodes = {}
+
+    for entry in entries:
+        child = node.add(entry_label(entry=entry, path=folder))
+
+        if "folder" in entry.keys():
+            nodes[join_path(folder, entry["name"])] = child
+
+    return nodes
+
+
+def entry_label(entry: dict, path: str) -> "Text":
+    """
+    Build the rich label used to display a remote entry in a directory listing.
+
+    Parameters
+    ----------
+    entry: dict
+        Drive item entry.
+    path: str
+        Remote path of the folder containing the entry.
+
+    Returns Text
+    -------
+        Formatted label
+    """
+    from rich.filesize import decimal
+    from rich.markup import escape
+    from rich.text import Text
+
+    if "folder" in entry.keys():
+        return Text.from_markup(f"[bold magenta]:open_file_folder: [link file://{path}]{escape(entry['name'])}")
+
+    text_filename = Text(entry["name"], "green")
+
+    text_filename.highlight_regex(r"\..*$", "bold red")
+    text_filename.stylize(f" link file://{entry['parentReference']['path']}")
+    text_filename.append(f" ({decimal(entry['size'])})", "blue")
+
+    icon = "📦 " if entry['name'].rsplit(".")[-1] == "zip" else "📄 "
+
+    return Text(icon) + text_filename
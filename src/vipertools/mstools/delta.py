@@ -0,0 +1,252 @@
+# Local mirror of the remote drive tree, kept up to date from the graph /delta feed.
+
+import os
+import json
+import pathlib
+
+from typing import Iterator, Union
+
+from vipertools._lazy import logger
+
+
+class DeltaState:
+    """
+    Remote tree state along with the delta link that continues it. Only the drive item metadata needed to rebuild paths
+    and detect changes is kept: name, parent, eTag, cTag, size and whether the item is a folder. The children of every
+    item are indexed in memory, rebuilt on load, so removing a folder only visits what is below it.
+    """
+
+    def __init__(self, filename: str):
+        self.path = pathlib.Path(filename)
+        self.delta_link = None
+        self.root_id = None
+        self.items = {}
+
+        # Ids of the items recorded below each parent id
+        self._children = {}
+
+    def __repr__(self):
+        return f"DeltaState({str(self.path)}, items={len(self.items)})"
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self) -> "DeltaState":
+        """
+        Read the persisted state, if any.
+        Returns DeltaState
+        -------
+
+        """
+        if not self.path.exists():
+            return self
+
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable delta state {str(self.path)}, starting from scratch ...")
+            return self
+
+        self.delta_link = state.get("deltaLink")
+        self.root_id = state.get("root")
+        self.items = state.get("items", {})
+
+        self._children = {}
+        for item_id, item in self.items.items():
+            self._children.setdefault(item["parent"], set()).add(item_id)
+
+        return self
+
+    def save(self) -> None:
+        """
+        Persist the state and its delta link.
+        Returns
+        -------
+
+        """
+        state = {
+            "deltaLink": self.delta_link,
+            "root": self.root_id,
+            "items": self.items
+        }
+
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+
+        os.replace(temporary, self.path)
+
+    def reset(self) -> None:
+        """
+        Forget everything, the next sync enumerates the whole drive again.
+        Returns
+        -------
+
+        """
+        self.delta_link = None
+        self.root_id = None
+        self.items = {}
+        self._children = {}
+
+    def path_of(self, item_id: str) -> Union[str, None]:
+        """
+        Remote path of an item, rebuilt from the parent chain.
+
+        Parameters
+        ----------
+        item_id: str
+            Onedrive specific id associated with the item.
+
+        Returns str | None
+        -------
+            Path starting with "/", None if the chain is incomplete.
+        """
+        parts = []
+
+        while item_id != self.root_id:
+            item = self.items.get(item_id)
+
+            if item is None:
+                return None
+
+            parts.append(item["name"])
+            item_id = item["parent"]
+
+        return "/" + "/".join(reversed(parts))
+
+    def tree(self, path: str = "/") -> Iterator[tuple[str, dict]]:
+        """
+        Iterate over the items at or below a remote path.
+
+        Parameters
+        ----------
+        path: str
+            Remote path of the subtree.
+
+        Returns Iterator[tuple[str, dict]]
+        -------
+            Item path and record.
+        """
+        for item_id, item in self.items.items():
+            item_path = self.path_of(item_id)
+
+            if item_path is not None and _within(item_path, path):
+                yield item_path, item
+
+    def apply(self, changes: list[dict], scope: str = "/") -> dict[str, list]:
+        """
+        Apply a page of delta changes to the tree.
+
+        Parameters
+        ----------
+        changes: list[dict]
+            Drive items from the delta feed.
+        scope: str
+            Only changes at or below this remote path are reported, every change is applied regardless.
+
+        Returns dict[str, list]
+        -------
+            Paths "added", "removed" and "modified", and (old, new) path pairs "renamed".
+        """
+        summary = {"added": [], "removed": [], "renamed": [], "modified": []}
+
+        for entry in changes:
+            item_id = entry["id"]
+
+            if "root" in entry:
+                self.root_id = item_id
+                continue
+
+            if "deleted" in entry:
+                path = self.path_of(item_id)
+
+                for removed in self._remove(item_id):
+                    if path is not None and _within(path, scope):
+                        summary["removed"].append(removed)
+
+                continue
+
+            record = {
+                "name": entry.get("name"),
+                "parent": entry.get("parentReference", {}).get("id"),
+                "eTag": entry.get("eTag"),
+                "cTag": entry.get("cTag"),
+                "size": entry.get("size"),
+                "folder": "folder" in entry
+            }
+
+            previous = self.items.get(item_id)
+            old_path = None if previous is None else self.path_of(item_id)
+
+            self.items[item_id] = record
+            self._link(item_id, previous=previous)
+
+            path = self.path_of(item_id)
+
+            if path is None or not (_within(path, scope) or (old_path is not None and _within(old_path, scope))):
+                continue
+
+            if previous is None:
+                summary["added"].append(path)
+
+            elif (previous["name"], previous["parent"]) != (record["name"], record["parent"]):
+                summary["renamed"].append((old_path, path))
+
+            elif not record["folder"] and (previous["cTag"], previous["size"]) != (record["cTag"], record["size"]):
+                summary["modified"].append(path)
+
+        return summary
+
+    def _link(self, item_id: str, previous: Union[dict, None]) -> None:
+        # Move an item to the children of its current parent
+        parent = self.items[item_id]["parent"]
+
+        if previous is not None and previous["parent"] != parent:
+            self._unlink(item_id, parent=previous["parent"])
+
+        self._children.setdefault(parent, set()).add(item_id)
+
+    def _unlink(self, item_id: str, parent: str) -> None:
+        siblings = self._children.get(parent)
+
+        if siblings is not None:
+            siblings.discard(item_id)
+
+            if not siblings:
+                del self._children[parent]
+
+    def _remove(self, item_id: str) -> list[str]:
+        # Drop an item along with anything still recorded below it, returning the removed paths.
+        removed = []
+        path = self.path_of(item_id)
+
+        for child in list(self._children.pop(item_id, ())):
+            removed.extend(self._remove(child))
+
+        item = self.items.pop(item_id, None)
+
+        if item is not None:
+            self._unlink(item_id, parent=item["parent"])
+
+            if path is not None:
+                removed.append(path)
+
+        return removed
+
+
+def merge(summary: dict[str, list], update: dict[str, list]) -> dict[str, list]:
+    """
+    Combine the change summaries of consecutive delta pages.
+    """
+    for key, values in update.items():
+        summary.setdefault(key, []).extend(values)
+
+    return summary
+
+
+def _within(path: str, scope: str) -> bool:
+    scope = "/" + scope.strip("/")
+
+    return scope == "/" or path == scope or path.startswith(scope + "/")
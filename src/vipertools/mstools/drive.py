@@ -1,34 +1,82 @@
+import os
 import json
-import rich
+import functools
 import requests
 import pathlib
+import time
+import datetime
+import zipfile
+import threading
 
 from requests import Response
-from rich.filesize import decimal
-from rich.markup import escape
-from rich.text import Text
-from rich.tree import Tree
+from typing import TYPE_CHECKING, Callable, Iterator, Union
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+# rich renders the listings and progress, its console and widgets are imported when something is displayed.
+if TYPE_CHECKING:
+    from rich.console import Console
 
 from vipertools.graph import codes as status_code
 from vipertools.graph import GraphQuery
+from vipertools.graph.graph import item_url
 from vipertools.graph import handler
+from vipertools.mstools import common
+from vipertools.mstools import engine
+from vipertools.mstools import hashing
+from vipertools.mstools import transfer
+from vipertools.mstools import remote
+from vipertools.mstools.archive import ZipStream
+from vipertools.mstools.cache import DownloadCache, ListingCache
+from vipertools.mstools.delta import DeltaState, merge
+from vipertools.mstools.manifest import ManifestStore
 
-from graphviper.utils import logger
-from graphviper.utils import parameter
+from vipertools._lazy import logger
+from vipertools._lazy import parameter
 
-from rich.console import Console
+# Ways a sync can go: local to remote, remote to local, or whichever copy is newer
+SYNC_DIRECTIONS = ("upload", "download", "both")
 
-console = Console()
+# Modification times closer than this, in seconds, are the same; onedrive keeps them to the second.
+SYNC_TIME_RESOLUTION = 1.0
 
+# Formats upload_directory can pack a directory in
+ARCHIVE_FORMATS = ("zip",)
 
-class DriveTool:
-    __slots__ = ["graph", "response", "verbose"]
+# Download manifest shipped with the package
+MANIFEST = str(pathlib.Path(__file__).parent.joinpath(".manifest/file.download.json"))
 
-    def __init__(self, verbose: bool = False):
-        self.graph = GraphQuery(verbose=verbose)
+
+class DriveTool:
+    __slots__ = ["graph", "response", "verbose", "cache", "download_cache", "headless"]
+
+    def __init__(
+            self,
+            verbose: bool = False,
+            graph: GraphQuery = None,
+            cache: Union[ListingCache, bool, None] = True,
+            download_cache: Union[DownloadCache, str, None] = None,
+            headless: bool = False
+    ):
+        # A GraphQuery can be shared between tools so that they also share its connection pool.
+        self.graph = GraphQuery(verbose=verbose) if graph is None else graph
         self.response = None
         self.verbose = verbose
 
+        # Folder listings are cached in memory by default, pass a ListingCache to configure or persist it.
+        if cache is True:
+            cache = ListingCache()
+
+        self.cache = None if cache is False else cache
+
+        # Downloaded files are only cached when asked for, either with a DownloadCache or the directory to keep it in.
+        if isinstance(download_cache, str):
+            download_cache = DownloadCache(download_cache)
+
+        self.download_cache = download_cache
+
+        # Batch jobs don't need progress bars and spinners, in headless mode nothing is drawn with rich.
+        self.headless = headless
+
     def __repr__(self):
         return f"DriveTool(verbose={self.verbose})"
 
@@ -42,32 +90,32 @@ class DriveTool:
         -------
 
         """
+        import rich
 
         rich.inspect(self.__class__, methods=True, all=False, private=False, dunder=False)
 
     #@parameter.validate()
-    def get_path(self, path: str = "/") -> requests.Response:
+    def get_path(self, path: str = "/", page_size: int = None) -> requests.Response:
         """
-
+        Retrieve the first page of the children of a remote folder. Use iter_path() to see every entry of folders
+        larger than a single page.
         Parameters
         ----------
         path: str (defaults /)
             Remote path to retrieve.
+        page_size: int (defaults None)
+            Number of entries per page, the server default is used if not given.
 
         Returns
         -------
         requires.Response
 
         """
-        if path == "/":
-            # Root directory requires a different call - <sarcasim> this makes perfect sense.</sarcasim>
-            url = f"https://{self.graph.hostname}/{self.graph.version}/me/drive/root/children"
-
-        else:
-            url = f"https://{self.graph.hostname}/{self.graph.version}/me/drive/root:/{path}:/children"
+        url = common.children_url(self.graph.base_url, path=path, page_size=page_size)
 
         logger.debug(url)
-        self.response = requests.get(
+        self.response = self.graph.request(
+            "GET",
             url=url,
             headers=self.graph.header
         )
@@ -75,11 +123,349 @@ class DriveTool:
         return self.response
 
     #@parameter.validate()
-    def generate_manifest(self, path: str = "/", version: str = None, destination: str = None) -> None:
+    def iter_path(self, path: str = "/", page_size: int = None) -> Iterator[dict]:
+        """
+        Lazily iterate over every entry of a remote folder. Pages are requested one at a time, following
+        @odata.nextLink, so entries are yielded as soon as their page arrives and only a single page is held in memory.
+        If a page request fails the iteration stops; the failed response is left in self.response for the caller to
+        inspect.
+
+        When the listing cache is enabled the folder is read in full and stored instead, and later calls reuse it
+        while it is within its ttl or while the folder eTag/cTag is unchanged.
+        Parameters
+        ----------
+        path: str (defaults /)
+            Remote path to list.
+        page_size: int (defaults None)
+            Number of entries per page, the server default is used if not given.
+
+        Returns Iterator[dict]
+        -------
+            Drive item entries.
+        """
+        path = common.format_path(path)
+
+        if self.cache is None:
+            yield from self._stream_path(path=path, page_size=page_size)
+
+        else:
+            yield from self._cached_path(path=path, page_size=page_size)
+
+    def _stream_path(self, path: str, page_size: int = None) -> Iterator[dict]:
+        url = common.children_url(self.graph.base_url, path=path, page_size=page_size)
+
+        for response in self._iter_pages(url):
+            self.response = response
+
+            if response.status_code != status_code.OK:
+                return
+
+            yield from response.json()["value"]
+
+    def _cached_path(self, path: str, page_size: int = None) -> Iterator[dict]:
+        record = self._cached_listing(path=path, page_size=page_size)
+
+        if record is not None:
+            yield from record["entries"]
+
+    def _cached_listing(self, path: str, page_size: int = None) -> Union[dict, None]:
+        """
+        Cached listing record of a folder, revalidated or listed again when needed. None if the folder can't be
+        listed, the failed response is left in self.response.
+        """
+        record = self.cache.get(path)
+
+        if record is not None and record["fresh"] and record["response"] is not None:
+            self.graph.metrics.cache("listing", hit=True)
+
+            self.response = record["response"]
+            return record
+
+        # Revalidate with the folder tag, a much smaller request than the listing itself. The tag is read before the
+        # listing so that a change made in between only causes an extra listing later, never a stale one.
+        tag, response = self._folder_tag(path)
+
+        if record is not None:
+            if response.status_code == status_code.OK and tag == record["tag"]:
+                logger.debug(f"Cached listing of {path} is still valid")
+                self.graph.metrics.cache("listing", hit=True)
+
+                self.response = response
+                self.cache.touch(path, response=response)
+
+                return record
+
+            self.cache.invalidate(path)
+
+        if response.status_code != status_code.OK:
+            self.response = response
+            return None
+
+        self.graph.metrics.cache("listing", hit=False)
+
+        entries = list(self._stream_path(path=path, page_size=page_size))
+
+        if self.response.status_code != status_code.OK:
+            return None
+
+        return self.cache.put(path, entries=entries, tag=tag, response=self.response)
+
+    def _folder_tag(self, path: str) -> tuple[Union[str, None], requests.Response]:
+        """
+        Version tag of a remote folder, built from its eTag and cTag along with the modification time, size and
+        child count since folders don't always report a cTag.
+        """
+        select = "$select=id,eTag,cTag,lastModifiedDateTime,size,folder"
+
+        response = self.graph.request(
+            "GET",
+            url=f"{item_url(self.graph.base_url, path)}?{select}",
+            headers=self.graph.header
+        )
+
+        if response.status_code != status_code.OK:
+            return None, response
+
+        item = response.json()
+        tag = "|".join(
+            str(value) for value in (
+                item.get("eTag"),
+                item.get("cTag"),
+                item.get("lastModifiedDateTime"),
+                item.get("size"),
+                item.get("folder", {}).get("childCount")
+            )
+        )
+
+        return tag, response
+
+    def _invalidate(self, path: str) -> None:
+        """
+        Drop cached information about a remote folder after writing to it.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(common.format_path(path))
+
+    def _iter_pages(self, url: str) -> Iterator[requests.Response]:
+        """
+        Follow a paged collection from url, yielding the response of every page. The generator stops after the last
+        page or after the first response that is not OK, which is yielded so the caller can handle it.
+        """
+        while url is not None:
+            logger.debug(url)
+            response = self.graph.request(
+                "GET",
+                url=url,
+                headers=self.graph.header
+            )
+
+            yield response
+
+            if response.status_code != status_code.OK:
+                return
+
+            url = response.json().get("@odata.nextLink")
+
+    #@parameter.validate()
+    def walk(
+            self,
+            path: str = "/",
+            max_workers: int = 8,
+            max_depth: Union[int, None] = None,
+            page_size: int = None
+    ) -> Iterator[tuple[str, list[dict]]]:
+        """
+        Recursively crawl a remote folder. Folder listings are fetched concurrently by a bounded thread pool and each
+        (folder, entries) pair is yielded as soon as its listing completes, so the order is not deterministic; a folder
+        is always yielded before any of its subfolders. Folders that fail to list are reported and skipped.
+        Parameters
+        ----------
+        path: str (defaults /)
+            Remote path to start the crawl from.
+        max_workers: int (defaults 8)
+            Maximum number of folder listings in flight.
+        max_depth: int | None (defaults None)
+            Depth limit relative to path, 0 only lists path itself. No limit if None.
+        page_size: int (defaults None)
+            Number of entries per listing page, the server default is used if not given.
+
+        Returns Iterator[tuple[str, list[dict]]]
+        -------
+            Remote folder path and the entries it contains.
+        """
+        for folder, response, entries in self._crawl(path, max_workers=max_workers, max_depth=max_depth,
+                                                     page_size=page_size):
+            if response.status_code != status_code.OK:
+                logger.warning(f"Unable to list {folder}, skipping ...")
+                handler.error(response, table=self.verbose)
+                continue
+
+            yield folder, entries
+
+    def _crawl(
+            self,
+            path: str = "/",
+            max_workers: int = 8,
+            max_depth: Union[int, None] = None,
+            page_size: int = None
+    ) -> Iterator[tuple[str, requests.Response, list[dict]]]:
+        """
+        Concurrent crawl behind walk(), yielding the listing response of every folder along with its entries, failed
+        listings included. Only the folders that listed successfully are descended into.
+        """
+        path = common.format_path(path)
+
+        # Listings made by the workers are recorded under the operation of the caller
+        list_folder = self.graph.metrics.bind(self._list_folder)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(list_folder, path, page_size): (path, 0)}
+
+            try:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        folder, depth = pending.pop(future)
+                        response, entries = future.result()
+
+                        descend = max_depth is None or depth < max_depth
+
+                        if response.status_code == status_code.OK and descend:
+                            for entry in entries:
+                                if "folder" in entry.keys():
+                                    subfolder = common.join_path(folder, entry["name"])
+                                    future = executor.submit(list_folder, subfolder, page_size)
+                                    pending[future] = (subfolder, depth + 1)
+
+                        yield folder, response, entries
+
+            finally:
+                # Don't keep crawling if the caller stopped early
+                for future in pending:
+                    future.cancel()
+
+    def _list_folder(self, path: str, page_size: int = None) -> tuple[requests.Response, list[dict]]:
+        """
+        Collect all pages of a folder listing. This doesn't touch self.response so it is safe to call from worker
+        threads.
+        """
+        entries = []
+        response = None
+
+        for response in self._iter_pages(common.children_url(self.graph.base_url, path=path, page_size=page_size)):
+            if response.status_code == status_code.OK:
+                entries.extend(response.json()["value"])
+
+        return response, entries
+
+    #@parameter.validate()
+    @common.measured("delta")
+    def delta(self, path: str = "/", destination: str = None) -> dict[str, list]:
+        """
+        Bring the local copy of the remote tree up to date from the graph delta feed. The first call enumerates the
+        drive; later calls only receive what changed since the delta token saved with the state, next to the manifest
+        in destination. Cached folder listings touched by a change are invalidated.
+        Parameters
+        ----------
+        path: str (defaults /)
+            Only report changes at or below this remote path.
+        destination: str (defaults None)
+            Directory of the delta state file, file.delta.json. The directory of the download manifest shipped with the
+            package if None.
+
+        Returns dict[str, list]
+        -------
+            Paths "added", "removed" and "modified", and (old, new) path pairs "renamed".
+        """
+        # The delta token is kept next to the manifest it tracks changes for
+        if destination is None:
+            destination = str(pathlib.Path(MANIFEST).parent)
+
+        pathlib.Path(destination).resolve().mkdir(parents=True, exist_ok=True)
+
+        state = DeltaState(str(pathlib.Path(destination).resolve().joinpath("file.delta.json"))).load()
+
+        # Business drives only support delta on the root, so the whole drive is followed and changes are scoped to
+        # path locally. Only the fields the state needs are requested to keep the pages small.
+        select = "$select=id,name,parentReference,eTag,cTag,size,folder,file,deleted,root"
+        start = f"{self.graph.base_url}/me/drive/root/delta?{select}"
+
+        for attempt in range(2):
+            summary = {"added": [], "removed": [], "renamed": [], "modified": []}
+            delta_link = None
+
+            for response in self._iter_pages(state.delta_link or start):
+                self.response = response
+
+                if response.status_code != status_code.OK:
+                    break
+
+                page = response.json()
+                merge(summary, state.apply(page["value"], scope=path))
+                delta_link = page.get("@odata.deltaLink", delta_link)
+
+            # An expired token means the state has to be enumerated again
+            if self.response.status_code == status_code.GONE and attempt == 0:
+                logger.warning("Delta token has expired, resynchronizing the full tree ...")
+                state.reset()
+                continue
+
+            break
+
+        if self.response.status_code != status_code.OK:
+            handler.error(self.response, table=self.verbose)
+            return summary
+
+        state.delta_link = delta_link
+        state.save()
+
+        changed = summary["added"] + summary["removed"] + summary["modified"]
+        changed += [path for pair in summary["renamed"] for path in pair]
+
+        for folder in {item.rsplit("/", 1)[0] or "/" for item in changed}:
+            self._invalidate(folder)
+
+        logger.info(
+            f"Delta sync: {len(summary['added'])} added, {len(summary['removed'])} removed, "
+            f"{len(summary['renamed'])} renamed, {len(summary['modified'])} modified"
+        )
+
+        return summary
+
+    #@parameter.validate()
+    @common.measured("generate_manifest")
+    def generate_manifest(
+            self,
+            path: str = "/",
+            version: str = None,
+            destination: str = None,
+            recursive: bool = False,
+            max_workers: int = 8,
+            incremental: bool = False,
+            store: Union[ManifestStore, str, None] = None
+    ) -> dict[str, list]:
         """
         Generate a manifest file from files in NRAO one drive.
         Parameters
         ----------
+        store: ManifestStore | str | None (defaults None)
+            SQLite manifest store, or the path of one, to update instead of the file.download.json in destination.
+            Only the entries that changed are written to it.
+
+        incremental: bool (defaults False)
+            Only create sharing links for entries that are new or whose eTag, cTag or size changed since the manifest
+            was last generated, the link id of every other entry is kept as is.
+
+        recursive: bool (defaults False)
+            Include the files of every subfolder, crawled in parallel. Folders themselves are not added to the manifest
+            in this mode since their contents are. If any folder can't be listed nothing is written, since its entries
+            would otherwise be taken as removed.
+
+        max_workers: int (defaults 8)
+            Number of concurrent folder listings when running recursively, and of concurrent $batch calls used to
+            create the sharing links.
+
         destination: str (defaults None)
             Destination path to generate manifest.
 
@@ -89,332 +475,1593 @@ class DriveTool:
         path: str, (default /)
             The remote path to generate the manifest file from.
 
-        Returns
+        Returns dict[str, list]
         -------
-        None
+            Manifest keys that were "added", "changed", "removed" or left "unchanged", and the ones whose link could not
+            be created, "failed".
         """
 
-        sharepoint_url = "https://nrao-my.sharepoint.com/"
+        if isinstance(store, str):
+            store = ManifestStore(store)
 
-        # destination becomes current directory is not specified
-        if destination is None:
-            logger.debug("File destination not defined, writing to current working directory ...")
-            destination = str(pathlib.Path())
+        if store is not None:
+            logger.info(f"Generating manifest in {str(store.path)}")
+            manifest = {"version": store.version, "metadata": store.metadata()}
 
-        # Create the directory if it doesn't exist.
-        if not pathlib.Path(destination).exists():
-            logger.debug(f"Creating manifest directory: {str(pathlib.Path(destination).resolve())} ...")
-            pathlib.Path(destination).resolve().mkdir(parents=True, exist_ok=True)
+        else:
+            manifest_path, manifest = common.load_manifest(destination)
 
-        manifest_path = pathlib.Path(destination).resolve().joinpath("file.download.json")
-        if not manifest_path.exists():
-            logger.debug(f"Creating new manifest file form template ...")
-            manifest_path = _create_manifest(str(manifest_path.parent))
+        if version is not None:
+            manifest["version"] = version
 
-        logger.info(f"Generating manifest for {str(manifest_path)}")
+        # This is the base skeleton from the download manifest
+        _manifest = {
+            "version": manifest["version"],
+            "metadata": {}
+        }
 
-        # Open download manifest
-        with open(manifest_path, "r+") as file:
-            manifest = json.load(file)
-            file.seek(0)
+        path = common.format_path(path=path)
 
-            if version is not None:
-                manifest["version"] = version
+        with _status("[bold green] Building manifest...", headless=self.headless) as status:
+            # Query the graph to get the path information, one page or one folder at a time
+            failed = []
 
-            # This is the base skeleton from the download manifest
-            _manifest = {
-                "version": manifest["version"],
-                "metadata": {}
-            }
+            if recursive:
+                def crawl() -> Iterator[dict]:
+                    # Stop at the first folder that can't be listed, see below
+                    for _, response, folder_entries in self._crawl(path, max_workers=max_workers):
+                        if response.status_code != status_code.OK:
+                            failed.append(response)
+                            return
 
-            path = _format_path(path=path)
-            # Query the graph to get the dpath information
-            self.get_path(path)
+                        yield from (entry for entry in folder_entries if "folder" not in entry.keys())
 
-            file_list = self.response.json()["value"]
+                entries = crawl()
 
-            with console.status("[bold green] Building manifest...") as status:
-                for entry in file_list:
-                    url, body, header = self.graph.build_link_request(item_id=entry["id"])
+            else:
+                entries = self.iter_path(path)
 
-                    self.response = requests.post(
-                        url=url,
-                        json=body,
-                        headers=header
-                    )
+            # Collect the entries first so that the link creation can be batched
+            with self.graph.metrics.operation("list"):
+                selected = common.select_entries(entries)
+
+            if not recursive and self.response.status_code != status_code.OK:
+                handler.error(self.response, table=self.verbose)
+                return {}
+
+            # Every key below a folder missing from the listing would be removed from the manifest, a partial crawl
+            # leaves it untouched instead.
+            if failed:
+                logger.error(f"Unable to list every folder of {path}, the manifest is left unchanged.")
+                handler.error(failed[0], table=self.verbose)
+                return {}
+
+            summary, linked = common.plan_manifest(manifest, _manifest, selected=selected, incremental=incremental)
+            sub_requests = common.link_requests(self.graph, linked)
+
+            status.update(f"[bold green] Creating {len(sub_requests)} links...")
+
+            with self.graph.metrics.operation("create_links"):
+                responses = self.graph.batch(sub_requests, max_workers=max_workers) if sub_requests else {}
+
+            written = common.apply_links(
+                manifest, _manifest, summary,
+                linked=linked,
+                responses=responses,
+                verbose=self.verbose
+            )
+
+            for key_name in written:
+                if self.headless:
+                    logger.debug(f"processing: {key_name} ...")
+
+                else:
+                    _console().print(f"[blue]processing[/]: {key_name} ...")
 
-                    key_name = entry["name"].rsplit(".zip")[0]
-                    link_id = self.response.json()['link']['webUrl'].split(sharepoint_url)[1]
-                    console.print(f"[blue]processing[/]: {key_name} ...")
+        # Only the entries that got a new link are written to a store, along with the removals, in one transaction.
+        if store is not None:
+            with store.transaction():
+                store.version = _manifest["version"]
+                store.remove(summary["removed"])
+                store.update({key_name: _manifest["metadata"][key_name] for key_name in written})
 
-                    _manifest["metadata"][key_name] = manifest["metadata"].setdefault(
-                        key_name, {
-                            "file": entry["name"],
-                            "id": "",
-                            "dtype": "",
-                            "telescope": "",
-                            "size": entry["size"],
-                            "mode": ""
-                        })
+        else:
+            common.write_manifest(manifest_path, _manifest)
 
-                    _manifest["metadata"][key_name]["id"] = link_id
+        logger.info(
+            f"Manifest: {len(summary['added'])} added, {len(summary['changed'])} changed, "
+            f"{len(summary['removed'])} removed, {len(summary['unchanged'])} unchanged, "
+            f"{len(summary['failed'])} failed, {len(written)} links created"
+        )
 
-            json.dump(_manifest, file, indent=4, sort_keys=True)
-            file.truncate()
+        return summary
 
     #@parameter.validate()
-    def download(self, path: str, filename: str) -> Response | int:
+    @common.measured("download")
+    def download(
+            self,
+            path: str,
+            filename: str,
+            connections: int = 1,
+            segment_size: int = None
+    ) -> Response | int:
         """
         Download a file from onedrive give a path.
         Parameters
         ----------
         path: str  onedrive path where file exists.
         filename: str file to download
+        connections: int (default 1) number of concurrent range requests. With more than one connection the file is
+            split into segments that are fetched in parallel into a preallocated file; completed segments are recorded
+            next to it so an interrupted download only fetches what is missing when restarted.
+        segment_size: int (default None) size of the segments of a multi-connection download, 8 MiB if not given.
+
+        When the tool has a download cache, a file already fetched in the same version is copied from the cache and
+        every completed download is added to it.
+
+        The content is checked against the QuickXorHash onedrive reports for the file. A mismatching download is
+        fetched once more, a second mismatch removes the file and raises IntegrityError.
 
         Returns
         -------
 
         """
-        from rich.progress import (Progress, SpinnerColumn, TotalFileSizeColumn, TransferSpeedColumn,
-                                   TaskProgressColumn, BarColumn, TextColumn, TimeRemainingColumn)
+        logger.info(f"Downloading {filename} from {path}...")
 
-        item_id = None
+        # The item-id and hash needed to download the file
+        with self.graph.metrics.operation("find"):
+            item = self.resolve(path, filename)
 
-        logger.info(f"Downloading {filename} from {path}...")
+        if item is None:
+            return self.response
 
-        # Get the path information
-        response = self.get_path(path)
+        return self._download_item(item, filename=filename, connections=connections, segment_size=segment_size)
 
-        # Find the item-id needed to download the file
-        if response.status_code == status_code.OK:
-            for entry in response.json()["value"]:
-                if entry["name"] == filename:
-                    item_id = entry["id"]
-                    break
+    def _download_item(
+            self,
+            item: dict,
+            filename: str,
+            connections: int = 1,
+            segment_size: int = None
+    ) -> Response | int:
+        """
+        Download a drive item to filename, from the download cache if it holds it, checking the content hash. This
+        doesn't touch self.response so it is safe to call from worker threads.
+        """
+        if self.download_cache is not None:
+            hit = self.download_cache.fetch(item, filename)
+            self.graph.metrics.cache("download", hit=hit)
 
-        else:
-            handler.error(response, table=self.verbose)
-            return response
+            if hit:
+                return status_code.OK
 
         # Build the download request url
-        url, header = self.graph.build_download_request(item_id=item_id)
+        url, header = self.graph.build_download_request(item_id=item["id"])
+
+        expected = hashing.expected_hash(item)
+
+        for attempt in range(2):
+            # Segments arrive out of order, so a segmented download is hashed once it is complete.
+            digest = None
+
+            if connections > 1:
+                result = self._download_segmented(
+                    url=url,
+                    header=header,
+                    item=item,
+                    filename=filename,
+                    connections=connections,
+                    segment_size=segment_size
+                )
+
+            else:
+                digest = hashing.QuickXorHash()
+                result = self._download_stream(url=url, header=header, filename=filename, digest=digest)
+
+            if result != status_code.OK or common.verified(filename, expected=expected, digest=digest):
+                break
+
+            if attempt == 0:
+                logger.warning(f"{filename} does not match the remote content hash, downloading again ...")
+
+            else:
+                actual = hashing.quickxorhash(filename)
+                pathlib.Path(filename).unlink(missing_ok=True)
 
-        response = requests.get(
+                raise hashing.IntegrityError(filename, expected=expected, actual=actual)
+
+        if self.download_cache is not None and result == status_code.OK:
+            self.download_cache.store(item, filename)
+
+        return result
+
+    def _download_stream(
+            self,
+            url: str,
+            header: dict,
+            filename: str,
+            digest: hashing.QuickXorHash = None
+    ) -> Response | int:
+        """
+        Download a file over a single streamed request, feeding the content to digest as it is written.
+        """
+        response = self.graph.request(
+            "GET",
             url=url,
-            headers=header
+            headers=header,
+            stream=True
         )
 
         if response.status_code == status_code.OK:
             total = int(response.headers.get("content-length", 0))
 
-            with Progress(
-                    SpinnerColumn(),
-                    TextColumn("[progress.description]{task.description}"),
-                    BarColumn(),
-                    TaskProgressColumn(),
-                    TransferSpeedColumn(),
-                    TimeRemainingColumn(),
-                    TotalFileSizeColumn()
-            ) as progress:
+            with _progress(headless=self.headless) as progress:
                 task = progress.add_task(f"Downloading: {filename}", total=total)
 
-                with open(filename, "wb") as file:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        if chunk:
-                            size = file.write(chunk)
-                            progress.update(task, advance=size)
+                _stream_to_file(
+                    response,
+                    filename=filename,
+                    advance=lambda size: progress.update(task, advance=size),
+                    digest=digest
+                )
 
             return response.status_code
 
         else:
             handler.error(response, table=self.verbose)
+            return response
 
-    #@parameter.validate()
-    def upload(self, filename: str, path: str) -> requests.Response:
+    def _download_segmented(
+            self,
+            url: str,
+            header: dict,
+            item: dict,
+            filename: str,
+            connections: int,
+            segment_size: int = None
+    ) -> Response | int:
         """
-        Upload a file on onedrive given a file path.
-        Parameters
-        ----------
-        filename: str local filename of file to be uploaded.
-        path: str  onedrive path where file exists.
+        Fetch a file as concurrent byte ranges written in place into a preallocated file. Completed segments are saved
+        to a sidecar after each one finishes so a restart skips them.
+        """
+        segment_size = transfer.DOWNLOAD_SEGMENT_SIZE if segment_size is None else segment_size
 
-        Returns
-        -------
+        # The pre-authenticated url skips the redirect every range request would otherwise go through; it must not be
+        # sent the app token.
+        source, source_header = item.get("@microsoft.graph.downloadUrl"), {}
+        if source is None:
+            source, source_header = url, header
 
-        """
+        total = item["size"]
+        segments = transfer.segments(size=total, segment_size=segment_size)
 
-        item_id = None
+        state = transfer.DownloadState(filename, size=total, segment_size=segment_size, etag=item.get("eTag"))
+        done = state.load()
 
-        logger.info(f"Uploading {filename} to {path}...")
+        if done:
+            logger.info(f"Resuming download of {filename}, {len(done)}/{len(segments)} segments already on disk ...")
 
-        path = _format_path(path=path)
+        else:
+            # Preallocate the output so that every segment can be written at its own offset
+            with open(filename, "wb") as file:
+                file.truncate(total)
 
-        # Get the path information
-        response = self.get_path(path)
+        lock = threading.Lock()
 
-        # Find the item-id needed to download the file
-        if response.status_code == status_code.OK:
-            for entry in response.json()["value"]:
-                if entry["name"] == filename:
-                    item_id = entry["id"]
-                    break
+        # Every connection reads into the same few buffers, written in place by a single writer thread
+        pool = engine.BufferPool(count=connections + engine.WRITE_BUFFERS)
 
-            # Need to separate the filename from the full file path before sending the request else we end up
-            # uploading the full directory structure.
-            name = pathlib.Path(filename).name
+        with _progress(headless=self.headless) as progress, open(filename, "r+b") as file, \
+                engine.FileWriter(file, pool=pool) as writer:
+            task = progress.add_task(
+                f"Downloading: {filename}",
+                total=total,
+                completed=sum(segments[i][1] - segments[i][0] + 1 for i in done)
+            )
 
-            # If the item_id is not set, the file doesn't exist in the remote directory; create it.
-            if item_id is None:
-                logger.info(f"{filename} not found, creating new remote file ...")
-                return self.upload_new_file(filename=name, path=path)
+            advance = engine.Throttle(lambda size: progress.update(task, advance=size))
 
-            with open(f"{filename}", "rb") as file:
-                data = file.read()
+            def complete(index: int) -> None:
+                # Called by the writer once the whole segment is on disk
+                with lock:
+                    done.add(index)
+                    state.save(done)
 
-            # Build the upload request url
-            url, header = self.graph.build_upload_request(item_id=item_id, filename=name, mode="update")
+            def fetch(index: int) -> Union[requests.Response, None]:
+                start, end = segments[index]
 
-            with console.status("[bold green] Uploading file...") as status:
-                response = requests.put(
-                    url=url,
-                    headers=header,
-                    data=data
-                )
+                try:
+                    response = self.graph.request(
+                        "GET",
+                        url=source,
+                        headers={**source_header, "Range": f"bytes={start}-{end}"},
+                        stream=True
+                    )
 
-            if response.status_code == status_code.OK:
-                logger.info(f"Uploaded {filename} to {path}")
-                return response
+                    if response.status_code != status_code.PARTIAL_CONTENT:
+                        # Don't pull a whole file the server sent back instead of the range
+                        if response.status_code == status_code.OK:
+                            response.close()
 
-            else:
-                handler.error(response, table=self.verbose)
-                return response
+                        return response
 
-        else:
-            handler.error(response)
-            return response
+                    received = engine.receive(response, writer=writer, offset=start, advance=advance)
 
-    def upload_new_file(self, filename: str, path: str) -> requests.Response:
-        """
-        Upload a new file on onedrive given a file path.
-        Parameters
-        ----------
+                except requests.RequestException as error:
+                    logger.warning(f"Segment {start}-{end} of {filename} failed: {error}")
+                    return None
 
-        filename: str local filename of file to be uploaded.
-        path: str  onedrive path where file exists.
+                if received != end - start + 1:
+                    logger.warning(f"Segment {start}-{end} of {filename} was truncated after {received} bytes")
+                    return None
 
-        Returns
-        -------
+                writer.then(functools.partial(complete, index))
 
-        """
+                return response
 
-        with open(f"{filename}", "rb") as file:
-            data = file.read()
+            missing = [i for i in range(len(segments)) if i not in done]
 
-        # Build the upload request url
-        url, header = self.graph.build_upload_request(filename=filename, path=path, mode="create")
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                responses = list(executor.map(self.graph.metrics.bind(fetch), missing))
 
-        with console.status("[bold green] Uploading file...") as status:
-            response = requests.put(
-                url=url,
-                headers=header,
-                data=data
-            )
+            advance.flush()
 
-        if response.status_code == response.status_code == status_code.CREATED:
-            logger.info(f"Uploaded {filename} to {path}")
-            return response
+        failed = [
+            response for response in responses
+            if response is None or response.status_code != status_code.PARTIAL_CONTENT
+        ]
 
-        else:
+        if not failed:
+            state.remove()
+            return status_code.OK
+
+        response = failed[0]
+
+        if response is not None and response.status_code == status_code.OK:
+            # The server ignored the Range header and sent the whole file each time
+            logger.warning("Range requests are not supported for this file, downloading over a single connection ...")
+            state.remove()
+            return self._download_stream(url=url, header=header, filename=filename)
+
+        logger.error(f"{len(failed)} segments of {filename} failed, run the download again to resume.")
+
+        if response is not None:
             handler.error(response, table=self.verbose)
             return response
 
+        return status_code.SERVICE_UNAVAILABLE
+
     #@parameter.validate()
-    def listdir(self, path: str = "/") -> None:
+    @common.measured("download_many")
+    def download_many(
+            self,
+            manifest: Union[str, dict, ManifestStore, None] = None,
+            keys: Union[list[str], None] = None,
+            telescope: str = None,
+            mode: str = None,
+            dtype: str = None,
+            destination: str = None,
+            max_workers: int = 4
+    ) -> list[dict]:
         """
-        List the contents of a remote directory.
+        Download a selection of the datasets listed in a download manifest concurrently. The drive items behind the
+        manifest sharing links are resolved once, in batches, and the files are then fetched by a pool of workers
+        under a single progress display.
         Parameters
         ----------
-        path: str, (default "/")
-            Remote path to list the contents from.
-
-        Returns
+        manifest: str | dict | ManifestStore | None (default None)
+            Path of a download manifest, an already loaded one or a manifest store. The manifest shipped with the
+            package if None.
+        keys: list[str] | None (default None)
+            Manifest keys to download, all of them if None.
+        telescope: str (default None)
+            Only download datasets from this telescope.
+        mode: str (default None)
+            Only download datasets of this mode.
+        dtype: str (default None)
+            Only download datasets of this data type.
+        destination: str (default None)
+            Local directory to download into, the current working directory if None.
+        max_workers: int (default 4)
+            Number of concurrent downloads.
+
+        Returns list[dict]
         -------
-        None
-
+            One report per selected dataset with keys "key", "file", "status", "size", "seconds" and "error". The
+            status is "downloaded", "cached" when served from the download cache, or "failed".
         """
-        path = _format_path(path)
+        if manifest is None:
+            manifest = MANIFEST
 
-        response = self.get_path(path)
+        if isinstance(manifest, str):
+            with open(manifest, "r") as file:
+                manifest = json.load(file)
 
-        # Check that folder exists
-        if response.status_code == status_code.OK:
-            tree = Tree(
-                f":open_file_folder: [link file://{path}]{path}",
-                guide_style="bold bright_blue",
+        # A manifest store answers the selection from its indexes
+        if isinstance(manifest, ManifestStore):
+            selection = manifest.query(keys=keys, telescope=telescope, mode=mode, dtype=dtype)
+
+        else:
+            selection = _select(manifest["metadata"], keys=keys, telescope=telescope, mode=mode, dtype=dtype)
+
+        if not selection:
+            logger.warning("No manifest entries match the selection, nothing to download.")
+            return []
+
+        destination = pathlib.Path.cwd() if destination is None else pathlib.Path(destination)
+        destination.mkdir(parents=True, exist_ok=True)
+
+        logger.info(f"Resolving {len(selection)} manifest entries ...")
+
+        sub_requests = []
+        for i, entry in enumerate(selection.values()):
+            url, header = self.graph.build_share_request(link=f"{common.SHAREPOINT_URL}{entry['id']}")
+            sub_requests.append({"id": str(i), "method": "GET", "url": url})
+
+        with self.graph.metrics.operation("resolve"):
+            responses = self.graph.batch(sub_requests, max_workers=max_workers)
+
+        reports = []
+        items = {}
+        for i, (key, entry) in enumerate(selection.items()):
+            response = responses[str(i)]
+            report = {"key": key, "file": entry["file"], "status": "pending", "size": 0, "seconds": 0.0, "error": None}
+
+            if response["status"] == status_code.OK:
+                items[key] = response["body"]
+                report["size"] = response["body"]["size"]
+
+            else:
+                report["status"] = "failed"
+                report["error"] = response["body"]["error"]["message"]
+
+            reports.append(report)
+
+        with _progress(headless=self.headless) as progress:
+            overall = progress.add_task(
+                f"Downloading {len(items)} files",
+                total=sum(item["size"] for item in items.values())
             )
 
-            for entry in self.response.json()["value"]:
-                if "folder" in entry.keys():
-                    style = ""
-                    tree.add(
-                        f"[bold magenta]:open_file_folder: [link file://{path}]{escape(entry['name'])}",
-                        style=style,
-                        guide_style=style,
-                    )
+            def fetch(report: dict) -> dict:
+                item = items[report["key"]]
+                filename = str(destination.joinpath(report["file"]))
+                task = progress.add_task(f"Downloading: {report['file']}", total=item["size"])
 
-                else:
-                    text_filename = Text(entry["name"], "green")
+                def advance(size: int) -> None:
+                    progress.update(task, advance=size)
+                    progress.update(overall, advance=size)
 
-                    text_filename.highlight_regex(r"\..*$", "bold red")
-                    text_filename.stylize(f" link file://{entry['parentReference']['path']}")
-                    text_filename.append(f" ({decimal(entry['size'])})", "blue")
+                start = time.perf_counter()
 
-                    icon = "📦 " if entry['name'].rsplit(".")[-1] == "zip" else "📄 "
+                try:
+                    hit = self.download_cache is not None and self.download_cache.fetch(item, filename)
 
-                    tree.add(Text(icon) + text_filename)
+                    if self.download_cache is not None:
+                        self.graph.metrics.cache("download", hit=hit)
 
-            rich.print(tree)
+                    if hit:
+                        progress.update(overall, advance=item["size"])
+                        report["status"] = "cached"
+                        report["seconds"] = time.perf_counter() - start
+                        progress.remove_task(task)
 
-        else:
-            handler.error(response, table=self.verbose)
+                        return report
 
+                    url, header = item.get("@microsoft.graph.downloadUrl"), {}
+                    if url is None:
+                        url, header = self.graph.build_download_request(item_id=item["id"])
 
-def _format_path(path: str) -> str:
-    """
-    Format a remote path. The path that is sent to the remote query is picky about how the path is formatted so
-    beginning and trailing slashes must be trimmed.
+                    # Closing the response releases the connection, whether or not the body was read
+                    with self.graph.request("GET", url=url, headers=header, stream=True) as response:
+                        if response.status_code == status_code.OK:
+                            digest = hashing.QuickXorHash()
+                            _stream_to_file(response, filename=filename, advance=advance, digest=digest)
 
-    Parameters
-    ----------
-    path: str
-        Remote path to format.
+                            if not common.verified(filename, expected=hashing.expected_hash(item), digest=digest):
+                                pathlib.Path(filename).unlink(missing_ok=True)
+                                raise hashing.IntegrityError(
+                                    filename,
+                                    expected=hashing.expected_hash(item),
+                                    actual=digest.b64digest()
+                                )
 
-    Returns str
-    -------
-        Trimmed path
-    """
+                            report["status"] = "downloaded"
 
-    if path == "/":
-        return path
+                            if self.download_cache is not None:
+                                self.download_cache.store(item, filename)
 
-    if path.startswith("/"):
-        path = path[1:]
+                        else:
+                            report["status"] = "failed"
+                            report["error"] = f"{response.status_code}: {response.text}"
 
-    if path.endswith("/"):
-        path = path[:-1]
+                except (OSError, requests.RequestException, hashing.IntegrityError) as error:
+                    report["status"] = "failed"
+                    report["error"] = str(error)
 
-    return path
+                report["seconds"] = time.perf_counter() - start
+                progress.remove_task(task)
 
+                return report
 
-def _create_manifest(path: str) -> str:
-    manifest = {
-        "version": "",
-        "metadata": {
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(
+                    self.graph.metrics.bind(fetch),
+                    [report for report in reports if report["key"] in items]
+                ))
 
-        }
+        failed = [report for report in reports if report["status"] == "failed"]
+        for report in failed:
+            logger.error(f"Failed to download {report['key']}: {report['error']}")
+
+        logger.info(f"Downloaded {len(reports) - len(failed)}/{len(reports)} datasets to {str(destination)}")
+
+        return reports
+
+    #@parameter.validate()
+    def open(
+            self,
+            path: str,
+            filename: str,
+            block_size: int = remote.BLOCK_SIZE
+    ) -> Union[remote.RemoteFile, Response, None]:
+        """
+        Open a remote file for random access. Only the regions that are read are transferred, with range requests
+        through a block cache.
+        Parameters
+        ----------
+        path: str
+            Remote folder the file is in.
+        filename: str
+            Name of the file.
+        block_size: int (default 64 KiB)
+            Size of the blocks content is fetched and cached in.
+
+        Returns RemoteFile | Response
+        -------
+            Seekable, read-only file object; the failed response if the folder can't be listed, None if it has no
+            such file.
+        """
+        item = self.resolve(path, filename)
+
+        if item is None:
+            return None if self.response.status_code == status_code.OK else self.response
+
+        return remote.RemoteFile(self.graph, item=item, block_size=block_size)
+
+    #@parameter.validate()
+    @common.measured("list_zip")
+    def list_zip(self, path: str, filename: str) -> Union[list[dict], Response, None]:
+        """
+        List the members of a remote zip archive without downloading it, only its central directory is fetched.
+        Parameters
+        ----------
+        path: str
+            Remote folder the archive is in.
+        filename: str
+            Name of the archive, ie. a .ms.zip measurement set.
+
+        Returns list[dict] | Response
+        -------
+            One entry per member with keys "name", "size" and "compressed_size"; as open() if the archive can't be
+            found.
+        """
+        file = self.open(path, filename)
+
+        if not isinstance(file, remote.RemoteFile):
+            return file
+
+        with file, zipfile.ZipFile(file) as archive:
+            return [
+                {"name": info.filename, "size": info.file_size, "compressed_size": info.compress_size}
+                for info in archive.infolist()
+            ]
+
+    #@parameter.validate()
+    @common.measured("extract")
+    def extract(
+            self,
+            path: str,
+            filename: str,
+            members: Union[list[str], None] = None,
+            destination: str = None
+    ) -> Union[list[str], Response, None]:
+        """
+        Extract members of a remote zip archive, only the central directory and the selected members are transferred.
+        Fetching a single table of a measurement set costs about the size of that table rather than of the archive.
+        Parameters
+        ----------
+        path: str
+            Remote folder the archive is in.
+        filename: str
+            Name of the archive.
+        members: list[str] | None (default None)
+            Member names to extract. A folder, ie. "data.ms/ANTENNA", selects every member below it. All if None.
+        destination: str (default None)
+            Local directory to extract into, the current working directory if None.
+
+        Returns list[str] | Response
+        -------
+            Paths of the extracted files; as open() if the archive can't be found.
+        """
+        destination = pathlib.Path.cwd() if destination is None else pathlib.Path(destination)
+        destination.mkdir(parents=True, exist_ok=True)
+
+        file = self.open(path, filename)
+
+        if not isinstance(file, remote.RemoteFile):
+            return file
+
+        extracted = []
+
+        with file, zipfile.ZipFile(file) as archive:
+            selected = [info for info in archive.infolist() if remote.member_matches(info.filename, members)]
+
+            if not selected:
+                logger.warning(f"No members of {filename} match the selection, nothing to extract.")
+
+            for info in selected:
+                extracted.append(archive.extract(info, path=str(destination)))
+
+            logger.info(
+                f"Extracted {len(selected)} members of {filename}, {file.transferred} of {file.size} bytes transferred "
+                f"in {file.requests} requests."
+            )
+
+        return extracted
+
+    #@parameter.validate()
+    def load_array(
+            self,
+            path: str,
+            filename: str,
+            block_size: int = remote.BLOCK_SIZE
+    ) -> Union[remote.RemoteArray, Response, None]:
+        """
+        Open a remote .npy file as a lazy, read-only array. Only the header is read here, indexing the array fetches
+        the byte ranges the selection needs and returns a numpy array, np.asarray() reads all of it.
+        Parameters
+        ----------
+        path: str
+            Remote folder the file is in.
+        filename: str
+            Name of the .npy file.
+        block_size: int (default 64 KiB)
+            Size of the blocks content is fetched and cached in.
+
+        Returns RemoteArray | Response | None
+        -------
+            Lazy array; as open() if the file can't be found.
+        """
+        file = self.open(path, filename, block_size=block_size)
+
+        if not isinstance(file, remote.RemoteFile):
+            return file
+
+        return remote.RemoteArray(file)
+
+    #@parameter.validate()
+    def resolve(self, path: str, filename: str) -> Union[dict, None]:
+        """
+        Drive item of a file. The item is addressed by its path, a single small request whatever the size of the
+        folder, or read from the name index of the folder listing when the listing cache holds a fresh one.
+        Parameters
+        ----------
+        path: str
+            Remote folder of the file.
+        filename: str
+            Name of the file.
+
+        Returns dict | None
+        -------
+            Drive item, None if the file doesn't exist or the lookup failed; failures are reported and the response is
+            left in self.response.
+        """
+        response, item = self._find(path, filename)
+        self.response = response
+
+        if item is not None:
+            return item
+
+        if response.status_code == status_code.NOT_FOUND:
+            logger.error(f"{filename} not found in {path}")
+
+        else:
+            handler.error(response, table=self.verbose)
+
+        return None
+
+    #@parameter.validate()
+    def resolve_many(self, path: str, filenames: list[str]) -> Union[dict[str, Union[dict, None]], requests.Response]:
+        """
+        Drive items of many files of the same folder. The folder is listed once and its entries indexed by name; with
+        the listing cache the index is kept along with the listing and dropped with it, so later lookups in the folder
+        are dictionary accesses until it changes.
+        Parameters
+        ----------
+        path: str
+            Remote folder of the files.
+        filenames: list[str]
+            Names of the files.
+
+        Returns dict[str, dict | None] | requests.Response
+        -------
+            Drive item of every name, None for the ones that don't exist. The failed response if the folder can't be
+            listed.
+        """
+        path = common.format_path(path)
+
+        if self.cache is not None:
+            record = self._cached_listing(path)
+            index = None if record is None else record["index"]
+
+        else:
+            index = {entry["name"]: entry for entry in self._stream_path(path)}
+
+        if self.response.status_code != status_code.OK:
+            handler.error(self.response, table=self.verbose)
+            return self.response
+
+        return {filename: index.get(filename) for filename in filenames}
+
+    def _find(self, path: str, name: str) -> tuple[requests.Response, Union[dict, None]]:
+        """
+        Look a file up for resolve(). Like _list_folder, the response is returned rather than kept in self.response,
+        so this is safe to call from worker threads. The item is None with a NOT_FOUND response if the file doesn't
+        exist.
+        """
+        path = common.format_path(path)
+
+        if self.cache is not None:
+            record = self.cache.get(path)
+
+            # A name missing from the cached listing may have been created since, only the server can tell.
+            if record is not None and record["fresh"] and record["response"] is not None and name in record["index"]:
+                self.graph.metrics.cache("listing", hit=True)
+                return record["response"], record["index"][name]
+
+        response = self.graph.request(
+            "GET",
+            url=item_url(self.graph.base_url, common.join_path(path, name)),
+            headers=self.graph.header
+        )
+
+        if response.status_code != status_code.OK:
+            return response, None
+
+        return response, response.json()
+
+    #@parameter.validate()
+    @common.measured("upload")
+    def upload(self, filename: str, path: str, fragment_size: int = None) -> requests.Response:
+        """
+        Upload a file on onedrive given a file path. Files larger than a simple upload allows are streamed from disk
+        through a resumable upload session; an interrupted session upload continues where it stopped when upload is
+        called again for the same, unchanged file. IntegrityError is raised if the content hash onedrive reports for
+        the uploaded file does not match the local one.
+        Parameters
+        ----------
+        filename: str local filename of file to be uploaded.
+        path: str  onedrive path where file exists.
+        fragment_size: int (default None) force an upload session with fragments of this size, rounded down to a
+            multiple of 320 KiB. Large files use 10 MiB fragments by default.
+
+        Returns
+        -------
+
+        """
+
+        logger.info(f"Uploading {filename} to {path}...")
+
+        path = common.format_path(path=path)
+
+        # Need to separate the filename from the full file path before sending the request else we end up
+        # uploading the full directory structure.
+        name = pathlib.Path(filename).name
+
+        # Find the item-id needed to update the file
+        self.response, item = self._find(path, name)
+
+        # If the item is not found, the file doesn't exist in the remote directory; create it.
+        if item is None and self.response.status_code == status_code.NOT_FOUND:
+            logger.info(f"{filename} not found, creating new remote file ...")
+            return self.upload_new_file(filename=filename, path=path, fragment_size=fragment_size)
+
+        if item is None:
+            handler.error(self.response)
+            return self.response
+
+        return self._put_file(filename=filename, path=path, item_id=item["id"], fragment_size=fragment_size)
+
+    @common.measured("upload_new_file")
+    def upload_new_file(self, filename: str, path: str, fragment_size: int = None) -> requests.Response:
+        """
+        Upload a new file on onedrive given a file path. IntegrityError is raised if the content hash onedrive reports
+        for the uploaded file does not match the local one.
+        Parameters
+        ----------
+
+        filename: str local filename of file to be uploaded.
+        path: str  onedrive path where file exists.
+        fragment_size: int (default None) force an upload session with fragments of this size, rounded down to a
+            multiple of 320 KiB. Large files use 10 MiB fragments by default.
+
+        Returns
+        -------
+
+        """
+        return self._put_file(filename=filename, path=path, fragment_size=fragment_size)
+
+    def _put_file(
+            self,
+            filename: str,
+            path: str,
+            item_id: str = None,
+            fragment_size: int = None
+    ) -> requests.Response:
+        """
+        Send a local file to onedrive, replacing the content of item_id or creating the file in the remote folder path
+        if item_id is None, and check the hash of the result. This doesn't touch self.response so it is safe to call
+        from worker threads.
+        """
+        name = pathlib.Path(filename).name
+        mode = "create" if item_id is None else "update"
+
+        # Local content hash, compared with the one onedrive computes for the uploaded file
+        digest = hashing.QuickXorHash()
+
+        if common.use_session(filename=filename, fragment_size=fragment_size):
+            url, body, header = self.graph.build_upload_session_request(
+                item_id=item_id,
+                filename=name,
+                path=path,
+                mode=mode
+            )
+
+            response = self._upload_session(
+                filename=filename,
+                url=url,
+                body=body,
+                header=header,
+                fragment_size=fragment_size,
+                digest=digest
+            )
+
+        else:
+            with open(f"{filename}", "rb") as file:
+                data = file.read()
+
+            digest.update(data)
+
+            # Build the upload request url
+            url, header = self.graph.build_upload_request(item_id=item_id, filename=name, path=path, mode=mode)
+
+            with _status("[bold green] Uploading file...", headless=self.headless) as status:
+                response = self.graph.request(
+                    "PUT",
+                    url=url,
+                    headers=header,
+                    data=data
+                )
+
+        # The folder changed, or may have if the upload failed part way.
+        self._invalidate(path)
+
+        if response.status_code in (status_code.OK, status_code.CREATED):
+            common.check_upload(filename, response=response, digest=digest)
+            logger.info(f"Uploaded {filename} to {path}")
+            return response
+
+        else:
+            handler.error(response, table=self.verbose)
+            return response
+
+    #@parameter.validate()
+    @common.measured("upload_directory")
+    def upload_directory(
+            self,
+            directory: str,
+            path: str,
+            archive: str = "zip",
+            fragment_size: int = None
+    ) -> requests.Response:
+        """
+        Upload a local directory, ie. a measurement set, as a single archive named after it: dataset.ms is uploaded
+        as dataset.ms.zip, the name generate_manifest expects. The archive is generated while it is sent through an
+        upload session, no copy of it is written to disk and only a single fragment is held in memory whatever the size
+        of the directory. Members are stored without compression.
+
+        An interrupted upload continues where it stopped when upload_directory is called again for the unchanged
+        directory, the session is saved next to it. IntegrityError is raised if the content hash onedrive reports for
+        the archive does not match the one computed as it was sent.
+        Parameters
+        ----------
+        directory: str
+            Local directory to upload.
+        path: str
+            Remote folder to upload the archive to, an archive of the same name is replaced.
+        archive: str (default "zip")
+            Archive format, only "zip" is supported.
+        fragment_size: int (default None)
+            Size of the upload session fragments, rounded down to a multiple of 320 KiB. 10 MiB if not given.
+
+        Returns requests.Response
+        -------
+
+        """
+        if archive not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unsupported archive format ({archive}), expected one of {', '.join(ARCHIVE_FORMATS)}")
+
+        source = pathlib.Path(directory).resolve()
+
+        if not source.is_dir():
+            raise NotADirectoryError(f"{directory} is not a directory")
+
+        from rich.filesize import decimal
+
+        path = common.format_path(path=path)
+        stream = ZipStream(str(source))
+
+        logger.info(
+            f"Uploading {directory} to {path} as {stream.name}, {len(stream.members)} members in "
+            f"{decimal(stream.size)} ..."
+        )
+
+        # Hash of the archive as it is sent, compared with the one onedrive computes
+        digest = hashing.QuickXorHash()
+
+        url, body, header = self.graph.build_upload_session_request(filename=stream.name, path=path, mode="create")
+        response = self._upload_session(
+            filename=str(source.with_name(stream.name)),
+            url=url,
+            body=body,
+            header=header,
+            fragment_size=fragment_size,
+            digest=digest,
+            source=stream
+        )
+
+        self._invalidate(path)
+
+        if response.status_code in (status_code.OK, status_code.CREATED):
+            common.check_upload(stream.name, response=response, digest=digest)
+            logger.info(f"Uploaded {directory} to {path}/{stream.name}")
+            return response
+
+        else:
+            handler.error(response, table=self.verbose)
+            return response
+
+    def _upload_session(
+            self,
+            filename: str,
+            url: str,
+            body: dict,
+            header: dict,
+            fragment_size: int = None,
+            retries: int = 3,
+            digest: hashing.QuickXorHash = None,
+            source: ZipStream = None
+    ) -> requests.Response:
+        """
+        Stream a local file into an upload session one fragment at a time, so only a single fragment is ever held in
+        memory. The session url and the ranges the server still expects are saved next to the file after every
+        fragment; a saved session that is still alive is resumed instead of opening a new one. A dropped connection is
+        retried from the ranges the server reports. Fragments are fed to digest in order as they are sent.
+
+        The content is read from source instead of filename when given, filename then only names the saved session.
+        """
+        if source is None:
+            state = transfer.UploadState(filename)
+
+        else:
+            state = transfer.UploadState(filename, size=source.size, mtime=source.mtime)
+
+        session = transfer.SessionUpload(state, fragment=fragment_size, digest=digest)
+
+        if (saved_url := session.saved_url()) is not None:
+            # The upload url is pre-authenticated, sending the app token along is not allowed.
+            if session.resume(saved_url, self.graph.request("GET", url=saved_url)):
+                logger.info(f"Resuming upload session of {filename} ...")
+
+            else:
+                logger.info(f"Upload session of {filename} has expired, starting a new one ...")
+
+        if session.upload_url is None:
+            response = self.graph.request(
+                "POST",
+                url=url,
+                json=body,
+                headers=header
+            )
+
+            if response.status_code != status_code.OK:
+                return response
+
+            session.open(response)
+
+        with _progress(headless=self.headless) as progress, \
+                (open(filename, "rb") if source is None else source) as file:
+            task = progress.add_task(
+                f"Uploading: {pathlib.Path(filename).name}",
+                total=session.size,
+                completed=session.sent
+            )
+
+            while (fragment := session.next_fragment(file)) is not None:
+                start, end, data = fragment
+
+                try:
+                    response = self.graph.request(
+                        "PUT",
+                        url=session.upload_url,
+                        headers=session.headers(start, end),
+                        data=data
+                    )
+
+                except requests.ConnectionError as error:
+                    if retries == 0:
+                        raise
+
+                    retries -= 1
+                    logger.warning(f"Connection lost while uploading {filename} ({error}), resuming ...")
+
+                    response = self.graph.request("GET", url=session.upload_url)
+                    if response.status_code != status_code.OK:
+                        return response
+
+                    session.update(response)
+                    continue
+
+                if response.status_code in (status_code.OK, status_code.CREATED):
+                    # The final fragment returns the completed drive item.
+                    session.complete(file)
+                    progress.update(task, completed=session.size)
+                    break
+
+                if response.status_code != status_code.ACCEPTED:
+                    return response
+
+                session.update(response)
+                progress.update(task, completed=session.sent)
+
+        return response
+
+    #@parameter.validate()
+    @common.measured("sync")
+    def sync(
+            self,
+            local_dir: str,
+            remote_path: str,
+            direction: str = "upload",
+            delete: bool = False,
+            dry_run: bool = False,
+            max_workers: int = 4
+    ) -> Union[dict[str, list], requests.Response]:
+        """
+        Bring a local directory and a remote folder in line, transferring only the files that differ. Both trees are
+        listed once; a file is unchanged when the sizes match and either the modification times agree to the second or
+        the content hashes do. The transfers then run concurrently under a single progress display, and every copy is
+        given the modification time of its source so the next sync doesn't need to hash it.
+        Parameters
+        ----------
+        local_dir: str
+            Local directory.
+        remote_path: str
+            Remote folder, created by the first upload if it doesn't exist.
+        direction: str (default "upload")
+            "upload" to make the remote folder match the local directory, "download" for the reverse, or "both" to copy
+            new files either way and, of two copies that differ, the most recently modified one.
+        delete: bool (default False)
+            Remove the files of the destination that are not in the source. Ignored when direction is "both".
+        dry_run: bool (default False)
+            Only work out and log the plan, nothing is changed.
+        max_workers: int (default 4)
+            Number of concurrent transfers and hashes.
+
+        Returns dict[str, list] | requests.Response
+        -------
+            Paths relative to both roots of the files to "upload", "download", "delete", the "unchanged" ones and the
+            ones that "failed". The response of the listing if the remote folder can't be listed.
+        """
+        if direction not in SYNC_DIRECTIONS:
+            raise ValueError(f"Invalid sync direction ({direction}), expected one of {', '.join(SYNC_DIRECTIONS)}")
+
+        root = pathlib.Path(local_dir)
+        remote_path = common.format_path(remote_path)
+
+        if not root.is_dir():
+            if direction != "download":
+                raise NotADirectoryError(f"{local_dir} is not a directory")
+
+            root.mkdir(parents=True)
+
+        with self.graph.metrics.operation("list"):
+            response, remote_files = self._remote_tree(remote_path, max_workers=max_workers)
+
+        if remote_files is None:
+            handler.error(response, table=self.verbose)
+            return response
+
+        local_files = _local_tree(root)
+
+        plan = {"upload": [], "download": [], "delete": [], "unchanged": [], "failed": []}
+
+        # Same size but a different modification time, only the content hash can tell
+        undecided = []
+
+        for name in sorted(local_files.keys() | remote_files.keys()):
+            local, entry = local_files.get(name), remote_files.get(name)
+
+            if entry is None:
+                if direction != "download":
+                    plan["upload"].append(name)
+
+                elif delete:
+                    plan["delete"].append(name)
+
+            elif local is None:
+                if direction != "upload":
+                    plan["download"].append(name)
+
+                elif delete:
+                    plan["delete"].append(name)
+
+            elif local.st_size != entry["size"]:
+                plan[_newer(direction, local=local, entry=entry)].append(name)
+
+            elif _same_time(local.st_mtime, _modified(entry)):
+                plan["unchanged"].append(name)
+
+            else:
+                undecided.append(name)
+
+        # Files found identical by hash get the modification time of their source, so they aren't hashed every time.
+        touch = []
+
+        if undecided:
+            logger.info(f"Hashing {len(undecided)} files with a different modification time ...")
+
+            def compare(name: str) -> bool:
+                return hashing.quickxorhash(str(root.joinpath(name))) == hashing.expected_hash(remote_files[name])
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {name: executor.submit(self.graph.metrics.bind(compare), name) for name in undecided}
+
+            for name, future in futures.items():
+                try:
+                    same = future.result()
+
+                except OSError as error:
+                    logger.error(f"Unable to hash {name}: {error}")
+                    plan["failed"].append(name)
+                    continue
+
+                if same:
+                    plan["unchanged"].append(name)
+                    touch.append(name)
+
+                else:
+                    plan[_newer(direction, local=local_files[name], entry=remote_files[name])].append(name)
+
+            plan["unchanged"].sort()
+
+        logger.info(
+            f"Sync of {str(root)} and {remote_path} ({direction}): {len(plan['upload'])} to upload, "
+            f"{len(plan['download'])} to download, {len(plan['delete'])} to delete, {len(plan['unchanged'])} unchanged"
+        )
+
+        if dry_run:
+            for action in ("upload", "download", "delete"):
+                for name in plan[action]:
+                    logger.info(f"{action}: {name}")
+
+            return plan
+
+        # Each transfer runs in a headless tool of its own, the overall progress is shown here.
+        worker = DriveTool(
+            verbose=self.verbose,
+            graph=self.graph,
+            cache=self.cache if self.cache is not None else False,
+            download_cache=self.download_cache,
+            headless=True
+        )
+
+        # Drive items of the uploaded files, whose modification time is set once they are all sent
+        uploaded = {}
+
+        def upload(name: str) -> None:
+            parent = name.rpartition("/")[0]
+            entry = remote_files.get(name)
+
+            response = worker._put_file(
+                filename=str(root.joinpath(name)),
+                path=common.join_path(remote_path, parent) if parent else remote_path,
+                item_id=None if entry is None else entry["id"]
+            )
+
+            if response.status_code not in (status_code.OK, status_code.CREATED):
+                raise OSError(f"upload failed with {response.status_code}")
+
+            uploaded[name] = response.json()["id"]
+
+        def download(name: str) -> None:
+            filename = root.joinpath(name)
+            filename.parent.mkdir(parents=True, exist_ok=True)
+
+            result = worker._download_item(remote_files[name], filename=str(filename))
+
+            if result != status_code.OK:
+                raise OSError(f"download failed with {getattr(result, 'status_code', result)}")
+
+            _set_time(filename, _modified(remote_files[name]))
+
+        transfers = [(name, upload, local_files[name].st_size) for name in plan["upload"]]
+        transfers.extend((name, download, remote_files[name]["size"]) for name in plan["download"])
+
+        with _progress(headless=self.headless) as progress:
+            task = progress.add_task(
+                f"Syncing {len(transfers)} files",
+                total=sum(size for _, _, size in transfers)
+            )
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self.graph.metrics.bind(transfer_file), name): (name, size)
+                    for name, transfer_file, size in transfers
+                }
+
+                for future in as_completed(futures):
+                    name, size = futures[future]
+
+                    try:
+                        future.result()
+
+                    except (OSError, requests.RequestException, hashing.IntegrityError) as error:
+                        logger.error(f"Failed to sync {name}: {error}")
+                        plan["failed"].append(name)
+
+                    progress.update(task, advance=size)
+
+        if direction == "upload":
+            uploaded.update((name, remote_files[name]["id"]) for name in touch)
+
+        else:
+            for name in touch:
+                _set_time(root.joinpath(name), _modified(remote_files[name]))
+
+        # Onedrive stamps uploads with the time they were received, give them the modification time of the local file.
+        sub_requests = [
+            {
+                "method": "PATCH",
+                "url": f"/me/drive/items/{item_id}",
+                "body": {"fileSystemInfo": {"lastModifiedDateTime": _timestamp(local_files[name].st_mtime)}}
+            }
+            for name, item_id in uploaded.items()
+        ]
+
+        if delete and direction == "upload":
+            sub_requests.extend(
+                {"method": "DELETE", "url": f"/me/drive/items/{remote_files[name]['id']}"}
+                for name in plan["delete"]
+            )
+
+        elif delete and direction == "download":
+            for name in plan["delete"]:
+                try:
+                    root.joinpath(name).unlink()
+
+                except OSError as error:
+                    logger.error(f"Failed to delete {name}: {error}")
+                    plan["failed"].append(name)
+
+        if sub_requests:
+            # Sub-requests are identified by their position, which is also the one of their file in names
+            names = list(uploaded.keys()) + (plan["delete"] if delete and direction == "upload" else [])
+            responses = self.graph.batch(sub_requests, max_workers=max_workers)
+
+            for i, name in enumerate(names):
+                response = responses[str(i)]
+
+                if response["status"] not in (status_code.OK, status_code.NO_CONTENT):
+                    logger.error(f"Failed to update {name}: {response['body']['error']['message']}")
+                    plan["failed"].append(name)
+
+            self._invalidate(remote_path)
+
+        logger.info(
+            f"Synced {str(root)} and {remote_path}: {len(plan['upload'])} uploaded, "
+            f"{len(plan['download'])} downloaded, {len(plan['delete'])} deleted, {len(plan['failed'])} failed"
+        )
+
+        return plan
+
+    def _remote_tree(self, path: str, max_workers: int = 8) -> tuple[requests.Response, Union[dict[str, dict], None]]:
+        """
+        Drive items of every file below a remote folder, by path relative to it; a folder that doesn't exist is empty.
+        The files are None, along with the failed response, if the folder or any of its subfolders can't be listed:
+        a partial tree would turn into spurious transfers and deletions.
+        """
+        tag, response = self._folder_tag(path)
+
+        if response.status_code == status_code.NOT_FOUND:
+            return response, {}
+
+        if response.status_code != status_code.OK:
+            return response, None
+
+        files = {}
+
+        for folder, response, entries in self._crawl(path, max_workers=max_workers):
+            if response.status_code != status_code.OK:
+                return response, None
+
+            for entry in entries:
+                if "folder" not in entry.keys():
+                    files[_relative_path(common.join_path(folder, entry["name"]), root=path)] = entry
+
+        return response, files
+
+    #@parameter.validate()
+    def listdir(self, path: str = "/", recursive: bool = False, max_workers: int = 8) -> None:
+        """
+        List the contents of a remote directory.
+        Parameters
+        ----------
+        path: str, (default "/")
+            Remote path to list the contents from.
+        recursive: bool (default False)
+            Display the full tree below path, crawling subfolders in parallel.
+        max_workers: int (default 8)
+            Number of concurrent folder listings when running recursively.
+
+        Returns
+        -------
+        None
+
+        """
+        path = common.format_path(path)
+
+        if recursive:
+            return self._listdir_recursive(path=path, max_workers=max_workers)
+
+        # Entries are rendered as their pages arrive rather than collected into a tree first, so listing a very large
+        # folder doesn't hold it in memory. One entry of lookahead is kept to know which one gets the closing guide.
+        # The listing cache is bypassed for the same reason.
+        entries = self._stream_path(path)
+        current = next(entries, None)
+
+        # Check that folder exists
+        if self.response.status_code != status_code.OK:
+            handler.error(self.response, table=self.verbose)
+            return
+
+        import rich
+        from rich.text import Text
+
+        rich.print(common.tree(path))
+
+        while current is not None:
+            following = next(entries, None)
+            guide = "┗━━ " if following is None else "┣━━ "
+
+            rich.print(Text(guide, style="bold bright_blue") + common.entry_label(entry=current, path=path))
+            current = following
+
+        if self.response.status_code != status_code.OK:
+            handler.error(self.response, table=self.verbose)
+
+    def _listdir_recursive(self, path: str, max_workers: int = 8) -> None:
+        import rich
+
+        tree = common.tree(path)
+
+        # walk() yields a folder before its subfolders so the parent node always exists by the time it is needed.
+        nodes = {path: tree}
+
+        for folder, entries in self.walk(path, max_workers=max_workers):
+            nodes.update(common.add_entries(nodes[folder], folder=folder, entries=entries))
+
+        rich.print(tree)
+
+
+@functools.cache
+def _console() -> "Console":
+    from rich.console import Console
+
+    return Console()
+
+
+def _status(message: str, headless: bool = False):
+    """
+    Spinner with a status message, one that draws nothing in headless mode.
+    """
+    if headless:
+        return engine.NullProgress()
+
+    return _console().status(message)
+
+
+
+def _stream_to_file(
+        response: requests.Response,
+        filename: str,
+        advance: Callable[[int], None] = None,
+        digest: hashing.QuickXorHash = None
+) -> int:
+    """
+    Write the body of a streamed response to a local file. The body is read in adaptive, MB sized chunks into a few
+    reusable buffers that a background thread writes out while the next chunk is received.
+
+    Parameters
+    ----------
+    response: requests.Response
+        Streamed response.
+    filename: str
+        Local file to write.
+    advance: Callable[[int], None]
+        Called with the size received since the last call, at most every engine.PROGRESS_INTERVAL seconds, ie. to
+        update a progress display.
+    digest: QuickXorHash
+        Hash updated with every chunk written.
+
+    Returns int
+    -------
+        Number of bytes written
+    """
+    # The digest is fed by the writer thread, the network and the hash and disk work overlap.
+    pool = engine.BufferPool(count=engine.WRITE_BUFFERS)
+    progress = engine.Throttle(advance)
+
+    with open(filename, "wb") as file, engine.FileWriter(file, pool=pool, digest=digest) as writer:
+        received = engine.receive(response, writer=writer, advance=progress)
+
+    progress.flush()
+
+    return received
+
+
+
+def _select(
+        metadata: dict,
+        keys: Union[list[str], None] = None,
+        telescope: str = None,
+        mode: str = None,
+        dtype: str = None
+) -> dict:
+    """
+    Select manifest entries by key and attribute, attributes are matched ignoring case.
+
+    Parameters
+    ----------
+    metadata: dict
+        Manifest metadata.
+    keys: list[str] | None
+        Keys to keep, all if None.
+    telescope: str
+        Telescope to match.
+    mode: str
+        Mode to match.
+    dtype: str
+        Data type to match.
+
+    Returns dict
+    -------
+        Selected metadata entries
+    """
+    if keys is not None:
+        missing = [key for key in keys if key not in metadata]
+        if missing:
+            logger.warning(f"Keys not found in manifest: {', '.join(missing)}")
+
+        metadata = {key: metadata[key] for key in keys if key in metadata}
+
+    attributes = {"telescope": telescope, "mode": mode, "dtype": dtype}
+
+    return {
+        key: entry for key, entry in metadata.items()
+        if all(
+            value is None or str(entry.get(attribute, "")).lower() == value.lower()
+            for attribute, value in attributes.items()
+        )
     }
-    manifest_path = pathlib.Path(path).joinpath("file.download.json")
-    with open(manifest_path, "w") as file:
-        json.dump(manifest, file, indent=4)
 
-    return str(manifest_path)
+
+def _progress(headless: bool = False):
+    """
+    Progress display shared by the transfer methods, one that draws nothing in headless mode.
+
+    Returns rich.progress.Progress | NullProgress
+    -------
+
+    """
+    if headless:
+        return engine.NullProgress()
+
+    from rich.progress import (Progress, SpinnerColumn, TotalFileSizeColumn, TransferSpeedColumn,
+                               TaskProgressColumn, BarColumn, TextColumn, TimeRemainingColumn)
+
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+        TotalFileSizeColumn()
+    )
+
+
+
+def _relative_path(path: str, root: str) -> str:
+    """
+    Path of a remote entry relative to the formatted remote folder root it is in.
+    """
+    if root == "/":
+        return path
+
+    return path[len(root) + 1:]
+
+
+def _local_tree(root: pathlib.Path) -> dict[str, os.stat_result]:
+    """
+    Status of every file below a local directory, by posix path relative to it. Transfer sidecars are left out, and
+    so are the files they belong to when a download of them is still in progress.
+    """
+    files = {}
+
+    for folder, _, names in os.walk(root):
+        relative = pathlib.Path(folder).relative_to(root)
+
+        for name in names:
+            if transfer.is_state_file(name) or f"{name}.download.json" in names:
+                continue
+
+            files[relative.joinpath(name).as_posix()] = os.stat(os.path.join(folder, name))
+
+    return files
+
+
+def _modified(entry: dict) -> Union[float, None]:
+    """
+    Modification time of a drive item as a timestamp: the one of the file it was uploaded from when onedrive knows it,
+    the time it was last written to otherwise.
+    """
+    value = entry.get("fileSystemInfo", {}).get("lastModifiedDateTime", entry.get("lastModifiedDateTime"))
+
+    if value is None:
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+    except ValueError:
+        return None
+
+
+def _same_time(local: float, remote: Union[float, None]) -> bool:
+    return remote is not None and abs(local - remote) < SYNC_TIME_RESOLUTION
+
+
+def _newer(direction: str, local: os.stat_result, entry: dict) -> str:
+    """
+    Transfer that settles a file whose local and remote copies differ, for a sync going in direction.
+    """
+    if direction != "both":
+        return direction
+
+    remote = _modified(entry)
+
+    return "upload" if remote is None or local.st_mtime > remote else "download"
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _set_time(filename: pathlib.Path, seconds: Union[float, None]) -> None:
+    # Give a local copy the modification time of the remote one, keeping its access time
+    if seconds is not None:
+        os.utime(filename, (filename.stat().st_atime, seconds))
+
+
@@ -0,0 +1,342 @@
+# Download engine: responses are read into reusable buffers and written to disk by a background thread.
+
+import time
+import queue
+import threading
+
+from typing import BinaryIO, Callable, Union
+
+from vipertools._lazy import logger
+
+# Bounds of the adaptive read size
+MIN_CHUNK = 256 * 1024
+INITIAL_CHUNK = 1024 * 1024
+MAX_CHUNK = 8 * 1024 * 1024
+
+# A read is resized to take between these many seconds, long enough to amortize the per-read overhead and short
+# enough to keep the writer and the progress display busy.
+FAST_READ = 0.05
+SLOW_READ = 0.5
+
+# Buffers of a single stream download, one being received while the others wait to be written
+WRITE_BUFFERS = 4
+
+# Minimum interval between two progress updates, in seconds
+PROGRESS_INTERVAL = 0.1
+
+
+class ChunkSizer:
+    """
+    Size of the next read of a response. The size doubles while reads complete faster than FAST_READ and halves when
+    one takes longer than SLOW_READ, so a fast connection is read in a few MB sized chunks and a slow one still reports
+    progress regularly.
+    """
+
+    def __init__(self, initial: int = INITIAL_CHUNK, minimum: int = MIN_CHUNK, maximum: int = MAX_CHUNK):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = min(max(initial, minimum), maximum)
+
+    def __repr__(self):
+        return f"ChunkSizer(size={self.size})"
+
+    def update(self, size: int, seconds: float) -> int:
+        """
+        Adapt to a read of size bytes that took seconds, returning the size of the next read.
+        """
+        # A short read is the end of the body, it says nothing about the connection.
+        if size >= self.size:
+            if seconds < FAST_READ:
+                self.size = min(self.size * 2, self.maximum)
+
+            elif seconds > SLOW_READ:
+                self.size = max(self.size // 2, self.minimum)
+
+        return self.size
+
+
+class BufferPool:
+    """
+    Fixed number of reusable read buffers. Taking a buffer blocks while all of them are waiting to be written, which
+    bounds the memory held by a download to count buffers and holds the network back when the disk can't keep up.
+    """
+
+    def __init__(self, count: int, size: int = INITIAL_CHUNK):
+        self.count = count
+        self._free = queue.Queue()
+
+        for _ in range(count):
+            self._free.put(bytearray(size))
+
+    def __repr__(self):
+        return f"BufferPool(count={self.count}, free={self._free.qsize()})"
+
+    def acquire(self, size: int) -> bytearray:
+        """
+        Take a buffer of at least size bytes, a smaller one is replaced.
+        """
+        buffer = self._free.get()
+
+        if len(buffer) < size:
+            buffer = bytearray(size)
+
+        return buffer
+
+    def release(self, buffer: bytearray) -> None:
+        self._free.put(buffer)
+
+
+class FileWriter:
+    """
+    Background thread writing buffers to a file at their offset, so receiving the next chunk overlaps with writing
+    the previous one. The writer also feeds the digest, in the order the buffers are submitted, which is the order of
+    the content for a single stream.
+
+    A write error is raised by the next submit() and by close(); the buffers still queued are given back to the pool
+    without being written so that the threads filling them don't block.
+    """
+
+    def __init__(self, file: BinaryIO, pool: BufferPool, digest=None):
+        self.file = file
+        self.pool = pool
+        self.digest = digest
+        self.written = 0
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="vipertools-writer", daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"FileWriter({getattr(self.file, 'name', self.file)}, written={self.written})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Don't hide the exception that ended the block behind a write error
+        self.close(check=exc_type is None)
+
+    def submit(self, offset: int, buffer: Union[bytearray, bytes], size: int, release: bool = True) -> None:
+        """
+        Queue size bytes of buffer to be written at offset.
+        Parameters
+        ----------
+        offset: int
+            Position in the file.
+        buffer: bytearray | bytes
+            Data to write.
+        size: int
+            Number of bytes of buffer to write.
+        release: bool (default True)
+            Give the buffer back to the pool once written, False for buffers that are not from the pool.
+
+        Returns
+        -------
+
+        """
+        self._check()
+        self._queue.put((offset, buffer, size, release))
+
+    def then(self, callback: Callable[[], None]) -> None:
+        """
+        Call callback from the writer thread once everything submitted so far is written, ie. to record that a segment
+        is complete. It is not called if a write failed.
+        """
+        self._check()
+        self._queue.put(callback)
+
+    def close(self, check: bool = True) -> int:
+        """
+        Wait for the queued writes and stop the thread.
+        Parameters
+        ----------
+        check: bool (default True)
+            Raise the error of a failed write.
+
+        Returns int
+        -------
+            Number of bytes written.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        if check:
+            self._check()
+
+        return self.written
+
+    def _check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def _run(self) -> None:
+        while (item := self._queue.get()) is not None:
+            if callable(item):
+                try:
+                    if self.error is None:
+                        item()
+
+                except Exception as error:
+                    logger.error(f"Writer callback {item!r} failed: {error}")
+                    self.error = error
+
+                continue
+
+            offset, buffer, size, release = item
+
+            try:
+                if self.error is None:
+                    view = memoryview(buffer)[:size]
+
+                    self.file.seek(offset)
+                    self.file.write(view)
+                    self.written += size
+
+                    if self.digest is not None:
+                        self.digest.update(view)
+
+            except Exception as error:
+                logger.error(f"Writing to {getattr(self.file, 'name', self.file)} failed: {error}")
+                self.error = error
+
+            finally:
+                if release:
+                    self.pool.release(buffer)
+
+
+class Throttle:
+    """
+    Progress callback that forwards the accumulated size at most once per interval instead of once per chunk. Safe to
+    share between threads; call flush() once the transfer is over so nothing is left unreported.
+    """
+
+    def __init__(self, advance: Union[Callable[[int], None], None], interval: float = PROGRESS_INTERVAL):
+        self.advance = advance
+        self.interval = interval
+
+        self._pending = 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, size: int) -> None:
+        if self.advance is None:
+            return
+
+        with self._lock:
+            self._pending += size
+            now = time.monotonic()
+
+            if now - self._last < self.interval:
+                return
+
+            pending, self._pending, self._last = self._pending, 0, now
+
+        self.advance(pending)
+
+    def flush(self) -> None:
+        if self.advance is None:
+            return
+
+        with self._lock:
+            pending, self._pending = self._pending, 0
+
+        if pending:
+            self.advance(pending)
+
+
+class NullProgress:
+    """
+    Stand-in for the rich progress and status displays in headless mode, every call is ignored.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def add_task(self, *args, **kwargs) -> int:
+        return 0
+
+    def update(self, *args, **kwargs) -> None:
+        pass
+
+    def remove_task(self, *args, **kwargs) -> None:
+        pass
+
+
+def receive(
+        response,
+        writer: FileWriter,
+        offset: int = 0,
+        sizer: ChunkSizer = None,
+        advance: Callable[[int], None] = None
+) -> int:
+    """
+    Read the body of a streamed response into buffers of the writer pool and hand them to the writer.
+
+    Parameters
+    ----------
+    response: requests.Response
+        Streamed response.
+    writer: FileWriter
+        Writer of the destination file.
+    offset: int
+        Position in the file of the first byte of the body.
+    sizer: ChunkSizer
+        Adapts the size of the reads, a new one if None.
+    advance: Callable[[int], None]
+        Called with the size of every chunk received.
+
+    Returns int
+    -------
+        Number of bytes received.
+    """
+    sizer = ChunkSizer() if sizer is None else sizer
+    received = 0
+
+    # The raw stream is read straight into the buffers, unless the body has to be decoded on the way.
+    if response.headers.get("Content-Encoding", "identity").lower() not in ("identity", ""):
+        for chunk in response.iter_content(chunk_size=sizer.size):
+            writer.submit(offset + received, chunk, len(chunk), release=False)
+            received += len(chunk)
+
+            if advance is not None:
+                advance(len(chunk))
+
+        return received
+
+    while True:
+        buffer = writer.pool.acquire(sizer.size)
+        view = memoryview(buffer)[:sizer.size]
+
+        start = time.perf_counter()
+        size = _fill(response.raw, view)
+        sizer.update(size, time.perf_counter() - start)
+
+        if size == 0:
+            writer.pool.release(buffer)
+            return received
+
+        writer.submit(offset + received, buffer, size)
+        received += size
+
+        if advance is not None:
+            advance(size)
+
+
+def _fill(raw, view: memoryview) -> int:
+    # Read until the view is full or the body ends
+    filled = 0
+
+    while filled < len(view):
+        size = raw.readinto(view[filled:])
+
+        if not size:
+            break
+
+        filled += size
+
+    return filled
@@ -0,0 +1,159 @@
+# QuickXorHash, the content hash onedrive business reports for every file.
+
+import base64
+
+from typing import Union
+
+from vipertools import _lazy
+
+np = _lazy.module("numpy")
+
+# The hash is a 160 bit register, byte n of the content is xor-ed into it at bit 11 * n modulo 160.
+WIDTH = 160
+SHIFT = 11
+
+
+class IntegrityError(Exception):
+    """
+    Raised when the content of a transfer does not hash to the value reported by onedrive.
+    """
+
+    def __init__(self, filename: str, expected: str, actual: str):
+        self.filename = filename
+        self.expected = expected
+        self.actual = actual
+
+        super().__init__(f"QuickXorHash mismatch for {filename}: expected {expected}, computed {actual}")
+
+
+class QuickXorHash:
+    """
+    Incremental QuickXorHash with a hashlib-like interface.
+
+    Since the position a byte lands at only depends on its offset modulo 160, content is folded into 160 column bytes,
+    one per offset class, with a vectorized xor reduction over 160 byte rows. The columns are only rotated into the
+    register when the digest is requested, which keeps the cost per update to a few passes of numpy over the buffer.
+    """
+    name = "quickxorhash"
+    digest_size = WIDTH // 8
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview, None] = None):
+        self.length = 0
+        self._columns = np.zeros(WIDTH, dtype=np.uint8)
+
+        if data is not None:
+            self.update(data)
+
+    def __repr__(self):
+        return f"QuickXorHash(length={self.length})"
+
+    def update(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        """
+        Add content to the hash.
+        Parameters
+        ----------
+        data: bytes | bytearray | memoryview
+            Next chunk of the content.
+
+        Returns
+        -------
+
+        """
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        size = buffer.size
+
+        if size == 0:
+            return
+
+        offset = self.length % WIDTH
+        self.length += size
+
+        # Bring the buffer in line with the 160 byte rows
+        head = min((WIDTH - offset) % WIDTH, size)
+        if head:
+            self._columns[offset:offset + head] ^= buffer[:head]
+
+        rows = (size - head) // WIDTH
+        if rows:
+            body = buffer[head:head + rows * WIDTH]
+
+            # Rows of 20 words xor-reduce eight times faster than rows of 160 bytes
+            folded = np.bitwise_xor.reduce(body.view(np.uint64).reshape(rows, WIDTH // 8), axis=0)
+            self._columns ^= folded.view(np.uint8)
+
+        tail = buffer[head + rows * WIDTH:]
+        if tail.size:
+            self._columns[:tail.size] ^= tail
+
+    def digest(self) -> bytes:
+        """
+        Hash of the content so far, as 20 bytes.
+        Returns bytes
+        -------
+
+        """
+        register = 0
+        mask = (1 << WIDTH) - 1
+
+        for index, value in enumerate(self._columns.tolist()):
+            if value:
+                shift = SHIFT * index % WIDTH
+                register ^= ((value << shift) | (value >> (WIDTH - shift))) & mask
+
+        result = bytearray(register.to_bytes(self.digest_size, "little"))
+
+        # The content length is xor-ed into the last 8 bytes
+        for index, value in enumerate(self.length.to_bytes(8, "little")):
+            result[self.digest_size - 8 + index] ^= value
+
+        return bytes(result)
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def b64digest(self) -> str:
+        """
+        Hash of the content so far, base64 encoded as in the quickXorHash field of a drive item.
+        Returns str
+        -------
+
+        """
+        return base64.b64encode(self.digest()).decode("ascii")
+
+    def copy(self) -> "QuickXorHash":
+        other = QuickXorHash()
+        other.length = self.length
+        other._columns = self._columns.copy()
+
+        return other
+
+
+def quickxorhash(filename: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    """
+    QuickXorHash of a local file.
+
+    Parameters
+    ----------
+    filename: str
+        Local file to hash.
+    chunk_size: int
+        Size of the reads.
+
+    Returns str
+    -------
+        Base64 encoded hash
+    """
+    digest = QuickXorHash()
+
+    with open(filename, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.b64digest()
+
+
+def expected_hash(item: dict) -> Union[str, None]:
+    """
+    QuickXorHash reported by onedrive for a drive item, None if the drive does not report one.
+    """
+    return item.get("file", {}).get("hashes", {}).get("quickXorHash")
@@ -0,0 +1,354 @@
+# SQLite backed download manifest, for manifests too large to load, rewrite and scan as a single json file.
+
+import json
+import sqlite3
+import pathlib
+import threading
+
+from contextlib import contextmanager
+from typing import Iterator, Union
+
+from vipertools._lazy import logger
+
+# Older manifest entries record their size as a string, in GB
+GIGABYTE = 1_000_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file TEXT NOT NULL DEFAULT '',
+    telescope TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    mode TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    dtype TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    size INTEGER,
+    record TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS entries_telescope ON entries (telescope);
+CREATE INDEX IF NOT EXISTS entries_mode ON entries (mode);
+CREATE INDEX IF NOT EXISTS entries_dtype ON entries (dtype);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+"""
+
+# Attributes that are matched ignoring case, each one has its own index
+ATTRIBUTES = ("telescope", "mode", "dtype")
+
+
+class ManifestStore:
+    """
+    Download manifest kept in an SQLite database. Entries are indexed by key, telescope, mode, dtype and size so a
+    selection is answered by the database instead of a scan over every entry, and updates only write the entries that
+    changed, in a single transaction.
+
+    Every entry is stored exactly as it appears in file.download.json, next to the columns it is queried by, so the
+    json manifest can be exported back unchanged. Sizes are indexed in bytes whichever unit the entry records them in.
+    """
+
+    def __init__(self, filename: str):
+        self.path = pathlib.Path(filename)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+        self._depth = 0
+
+    def __repr__(self):
+        return f"ManifestStore({str(self.path)}, version={self.version}, entries={len(self)})"
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, key: str):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def version(self) -> str:
+        """
+        Version of the manifest.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM info WHERE name = 'version'").fetchone()
+
+        return "" if row is None else row[0]
+
+    @version.setter
+    def version(self, value: str) -> None:
+        with self.transaction() as cursor:
+            cursor.execute("INSERT OR REPLACE INTO info (name, value) VALUES ('version', ?)", (value,))
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Group updates so they are applied all together or not at all, transactions can be nested.
+        Returns Iterator[sqlite3.Cursor]
+        -------
+
+        """
+        with self._lock:
+            cursor = self._connection.cursor()
+
+            if self._depth == 0:
+                cursor.execute("BEGIN IMMEDIATE")
+
+            self._depth += 1
+
+            try:
+                yield cursor
+
+            except BaseException:
+                self._depth -= 1
+
+                if self._depth == 0:
+                    cursor.execute("ROLLBACK")
+
+                raise
+
+            self._depth -= 1
+
+            if self._depth == 0:
+                cursor.execute("COMMIT")
+
+    def get(self, key: str) -> Union[dict, None]:
+        """
+        Manifest entry of a key, None if the manifest has no such key.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT record FROM entries WHERE key = ?", (key,)).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT key FROM entries ORDER BY key")]
+
+    def metadata(self) -> dict:
+        """
+        Every entry of the manifest, as the "metadata" of file.download.json.
+        Returns dict
+        -------
+
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT key, record FROM entries ORDER BY key").fetchall()
+
+        return {key: json.loads(record) for key, record in rows}
+
+    def update(self, entries: dict) -> None:
+        """
+        Add or replace manifest entries in a single transaction.
+        Parameters
+        ----------
+        entries: dict
+            Manifest entries by key, as in the "metadata" of file.download.json.
+
+        Returns
+        -------
+
+        """
+        rows = [_row(key, entry) for key, entry in entries.items()]
+
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO entries (key, file, telescope, mode, dtype, size, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def remove(self, keys: list[str]) -> None:
+        """
+        Remove manifest entries in a single transaction, unknown keys are ignored.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+
+    def query(
+            self,
+            keys: Union[list[str], None] = None,
+            telescope: str = None,
+            mode: str = None,
+            dtype: str = None,
+            min_size: int = None,
+            max_size: int = None
+    ) -> dict:
+        """
+        Select manifest entries by key and attribute, attributes are matched ignoring case. For instance, every ALMA
+        Holography dataset under 1 GB is
+
+            store.query(telescope="ALMA", mode="Holography", max_size=1_000_000_000)
+
+        Parameters
+        ----------
+        keys: list[str] | None
+            Keys to keep, all if None.
+        telescope: str
+            Telescope to match.
+        mode: str
+            Mode to match.
+        dtype: str
+            Data type to match.
+        min_size: int
+            Smallest size to keep, in bytes.
+        max_size: int
+            Largest size to keep, in bytes.
+
+        Returns dict
+        -------
+            Selected entries by key
+        """
+        clauses = []
+        arguments = []
+
+        for attribute, value in zip(ATTRIBUTES, (telescope, mode, dtype)):
+            if value is not None:
+                clauses.append(f"{attribute} = ?")
+                arguments.append(value)
+
+        if min_size is not None:
+            clauses.append("size >= ?")
+            arguments.append(min_size)
+
+        if max_size is not None:
+            clauses.append("size <= ?")
+            arguments.append(max_size)
+
+        statement = "SELECT key, record FROM entries"
+        if clauses:
+            statement = f"{statement} WHERE {' AND '.join(clauses)}"
+
+        with self._lock:
+            rows = self._connection.execute(f"{statement} ORDER BY key", arguments).fetchall()
+
+        selection = {key: json.loads(record) for key, record in rows}
+
+        if keys is None:
+            return selection
+
+        missing = [key for key in keys if key not in selection and key not in self]
+        if missing:
+            logger.warning(f"Keys not found in manifest: {', '.join(missing)}")
+
+        return {key: selection[key] for key in keys if key in selection}
+
+    def import_json(self, filename: str, replace: bool = True) -> int:
+        """
+        Load a json download manifest into the store.
+        Parameters
+        ----------
+        filename: str
+            Path of a file.download.json manifest.
+        replace: bool (default True)
+            Drop the entries that are not in the json manifest, otherwise they are kept.
+
+        Returns int
+        -------
+            Number of entries imported.
+        """
+        with open(filename, "r") as file:
+            manifest = json.load(file)
+
+        with self.transaction() as cursor:
+            if replace:
+                cursor.execute("DELETE FROM entries")
+
+            self.version = manifest.get("version", "")
+            self.update(manifest["metadata"])
+
+        logger.debug(f"Imported {len(manifest['metadata'])} manifest entries from {filename}")
+
+        return len(manifest["metadata"])
+
+    def export_json(self, filename: str) -> str:
+        """
+        Write the store as a json download manifest, in the same layout generate_manifest() writes.
+        Parameters
+        ----------
+        filename: str
+            Path of the json manifest to write.
+
+        Returns str
+        -------
+            Path of the manifest.
+        """
+        manifest = {
+            "version": self.version,
+            "metadata": self.metadata()
+        }
+
+        with open(filename, "w") as file:
+            json.dump(manifest, file, indent=4, sort_keys=True)
+
+        return str(filename)
+
+    @classmethod
+    def from_json(cls, filename: str, database: str) -> "ManifestStore":
+        """
+        Create a store from a json download manifest.
+        Parameters
+        ----------
+        filename: str
+            Path of a file.download.json manifest.
+        database: str
+            Path of the SQLite database to create.
+
+        Returns ManifestStore
+        -------
+
+        """
+        store = cls(database)
+        store.import_json(filename)
+
+        return store
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def size_in_bytes(size: Union[int, float, str, None]) -> Union[int, None]:
+    """
+    Size of a manifest entry in bytes. Sizes given as strings are in GB, None if the size can't be read.
+    """
+    if isinstance(size, bool):
+        return None
+
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    try:
+        return int(float(size) * GIGABYTE)
+
+    except (TypeError, ValueError):
+        return None
+
+
+def _row(key: str, entry: dict) -> tuple:
+    return (
+        key,
+        entry.get("file", ""),
+        str(entry.get("telescope", "")),
+        str(entry.get("mode", "")),
+        str(entry.get("dtype", "")),
+        size_in_bytes(entry.get("size")),
+        json.dumps(entry, sort_keys=True)
+    )
@@ -0,0 +1,433 @@
+# Random access to the content of a remote file over range requests, without downloading it.
+
+import io
+import threading
+
+from collections import OrderedDict
+from typing import Union
+
+from vipertools import _lazy
+from vipertools._lazy import logger
+
+from vipertools.graph import codes as status_code
+from vipertools.graph import GraphQuery
+
+# Content is fetched and cached in blocks of this size, contiguous missing blocks go out as a single range request.
+BLOCK_SIZE = 64 * 1024
+
+# Blocks kept in memory per file, 16 MiB with the default block size
+MAX_BLOCKS = 256
+
+# Above this many separate runs of rows, a selection is gathered with one vectorized index instead of run by run
+GATHER_RUNS = 4096
+
+np = _lazy.module("numpy")
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only, seekable file object over a drive item. Reads are served from an LRU cache of fixed size blocks, the
+    blocks that are missing are fetched with range requests, so a reader that only touches a few regions of a large
+    file, ie. zipfile reading the central directory and a handful of members, only transfers those regions.
+
+    Failed requests surface as OSError like any other file read error.
+    """
+
+    def __init__(
+            self,
+            graph: GraphQuery,
+            item: dict,
+            block_size: int = BLOCK_SIZE,
+            max_blocks: int = MAX_BLOCKS
+    ):
+        super().__init__()
+
+        self.graph = graph
+        self.item = item
+        self.name = item["name"]
+        self.size = item["size"]
+
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+
+        # The pre-authenticated url skips the redirect every range request would otherwise go through; it must not be
+        # sent the app token.
+        self.url, self.header = item.get("@microsoft.graph.downloadUrl"), {}
+        if self.url is None:
+            self.url, self.header = graph.build_download_request(item_id=item["id"])
+
+        self.requests = 0
+        self.transferred = 0
+
+        self._position = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"RemoteFile({self.name}, size={self.size}, transferred={self.transferred})"
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self._position = position
+
+        return position
+
+    def readinto(self, buffer) -> int:
+        data = self.read_at(self._position, len(buffer))
+        buffer[:len(data)] = data
+
+        self._position += len(data)
+
+        return len(data)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """
+        Read content at an offset without moving the file position.
+        Parameters
+        ----------
+        offset: int
+            Position of the first byte.
+        size: int
+            Number of bytes, fewer are returned past the end of the file.
+
+        Returns bytes
+        -------
+
+        """
+        end = min(offset + size, self.size)
+
+        if offset >= end:
+            return b""
+
+        first, last = offset // self.block_size, (end - 1) // self.block_size
+        blocks = self._fetch(first, last)
+
+        data = b"".join(blocks)
+        start = offset - first * self.block_size
+
+        return data[start:start + end - offset]
+
+    @property
+    def stats(self) -> dict:
+        """
+        Number of range "requests" sent, bytes "transferred" and "cached" blocks.
+        Returns dict
+        -------
+
+        """
+        return {"requests": self.requests, "transferred": self.transferred, "cached": len(self._blocks)}
+
+    def _fetch(self, first: int, last: int) -> list[bytes]:
+        # Blocks first to last inclusive
+        blocks = self._blocks_of(range(first, last + 1))
+
+        return [blocks[index] for index in range(first, last + 1)]
+
+    def _blocks_of(self, indices) -> dict[int, bytes]:
+        # Blocks by index, each run of consecutive missing blocks is fetched with one range request.
+        with self._lock:
+            blocks = {index: self._blocks.get(index) for index in indices}
+
+        missing = sorted(index for index, block in blocks.items() if block is None)
+
+        for start, stop in _runs(missing):
+            data = self._request(start * self.block_size, min((stop + 1) * self.block_size, self.size) - 1)
+
+            for index in range(start, stop + 1):
+                offset = (index - start) * self.block_size
+                blocks[index] = data[offset:offset + self.block_size]
+
+        with self._lock:
+            for index, block in blocks.items():
+                self._blocks[index] = block
+                self._blocks.move_to_end(index)
+
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+
+        return blocks
+
+    def _request(self, start: int, end: int) -> bytes:
+        response = self.graph.request(
+            "GET",
+            url=self.url,
+            headers={**self.header, "Range": f"bytes={start}-{end}"}
+        )
+
+        self.requests += 1
+
+        if response.status_code == status_code.OK and len(response.content) == self.size:
+            # The server ignored the Range header, the requested part of the whole file is still usable.
+            logger.debug(f"Range requests are not supported for {self.name}, received the whole file.")
+            data = response.content[start:end + 1]
+
+        elif response.status_code == status_code.PARTIAL_CONTENT:
+            data = response.content
+
+        else:
+            raise OSError(f"Unable to read bytes {start}-{end} of {self.name}: ({response.status_code}) {response.text}")
+
+        if len(data) != end - start + 1:
+            raise OSError(f"Short read of bytes {start}-{end} of {self.name}, received {len(data)} bytes")
+
+        self.transferred += len(response.content)
+
+        return data
+
+
+class RemoteArray:
+    """
+    Array-like view of a remote .npy file, in the spirit of a read-only numpy memmap. Only the header is read when it
+    is created; indexing it fetches the rows the selection needs through the block cache of the underlying RemoteFile
+    and returns a numpy array.
+
+    The selection is fetched as the outer product of the indices along each axis, down to the trailing axes that are
+    taken whole, whose rows are contiguous in the file. The original index is then applied to that block, so the result
+    is exactly what indexing the full array would give. Selections numpy can't split per axis, ie. with np.newaxis or a
+    multidimensional boolean mask, read the whole array.
+    """
+
+    def __init__(self, file: RemoteFile):
+        from numpy.lib import format as npy
+
+        self.file = file
+
+        version = npy.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy.read_array_header_1_0(file)
+
+        else:
+            shape, fortran_order, dtype = npy.read_array_header_2_0(file)
+
+        if dtype.hasobject:
+            raise ValueError(f"{file.name} holds python objects, which can't be read without loading the whole file")
+
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.fortran_order = fortran_order
+
+        # Array data starts right after the header
+        self.offset = file.tell()
+
+    def __repr__(self):
+        return f"RemoteArray({self.file.name}, shape={self.shape}, dtype={self.dtype})"
+
+    def __len__(self):
+        if not self.shape:
+            raise TypeError("len() of unsized object")
+
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.read()
+
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    def read(self) -> "np.ndarray":
+        """
+        The whole array.
+        Returns np.ndarray
+        -------
+
+        """
+        data = np.frombuffer(self.file.read_at(self.offset, self.nbytes), dtype=self.dtype)
+
+        if self.fortran_order:
+            return data.reshape(self.shape[::-1]).transpose()
+
+        return data.reshape(self.shape)
+
+    def __getitem__(self, key) -> "np.ndarray":
+        expanded = _expand(key, self.ndim)
+
+        if expanded is None or self.ndim == 0:
+            return self.read()[key]
+
+        indices, local = [], []
+        for index, length in zip(expanded, self.shape):
+            if isinstance(index, slice):
+                indices.append(np.arange(length)[index])
+                local.append(slice(None))
+
+            elif np.ndim(index) == 0:
+                position = int(index)
+
+                if not -length <= position < length:
+                    raise IndexError(f"index {position} is out of bounds for axis with size {length}")
+
+                indices.append(np.array([position % length]))
+                local.append(0)
+
+            else:
+                # Fetch each index once, in order, and pick them back out of the block with the original layout
+                index = np.asarray(index)
+
+                if index.dtype == bool:
+                    if index.shape != (length,):
+                        raise IndexError(f"boolean index of shape {index.shape} does not match axis of size {length}")
+
+                    index = np.nonzero(index)[0]
+
+                wrapped = np.where(index < 0, index + length, index)
+
+                if wrapped.size and (wrapped.min() < 0 or wrapped.max() >= length):
+                    raise IndexError(f"index out of bounds for axis with size {length}")
+
+                unique = np.unique(wrapped)
+                indices.append(unique)
+                local.append(np.searchsorted(unique, wrapped))
+
+        # A fortran ordered array is stored as the transpose of its shape in C order
+        if self.fortran_order:
+            block = self._fetch(indices[::-1], self.shape[::-1]).transpose()
+
+        else:
+            block = self._fetch(indices, self.shape)
+
+        return block[tuple(local)]
+
+    def _fetch(self, indices: list, shape: tuple) -> "np.ndarray":
+        # Outer product of the indices along each axis of an array stored in C order.
+        lengths = tuple(len(index) for index in indices)
+
+        if 0 in lengths:
+            return np.empty(lengths, dtype=self.dtype)
+
+        # Trailing axes taken whole form contiguous rows
+        split = len(shape)
+        while split > 0 and _whole(indices[split - 1], shape[split - 1]):
+            split -= 1
+
+        if split == 0:
+            return self.read() if not self.fortran_order else self.read().transpose()
+
+        row_bytes = int(np.prod(shape[split:], dtype=np.int64)) * self.dtype.itemsize
+        rows = np.ravel_multi_index(np.ix_(*indices[:split]), shape[:split]).ravel()
+
+        # Consecutive rows are read as one contiguous run
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(rows) != 1) + 1, [len(rows)]))
+
+        run_starts = self.offset + rows[bounds[:-1]] * row_bytes
+        run_bytes = np.diff(bounds) * row_bytes
+
+        # Every block a run touches, in one pass
+        block_size = self.file.block_size
+        first = run_starts // block_size
+        counts = (run_starts + run_bytes - 1) // block_size - first + 1
+
+        needed = np.unique(
+            np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        )
+
+        blocks = self.file._blocks_of(needed.tolist())
+
+        # Lay the needed blocks out back to back, a run is contiguous there as well
+        data = np.frombuffer(b"".join(blocks[index] for index in needed.tolist()), dtype=np.uint8)
+        positions = np.searchsorted(needed, first) * block_size + run_starts % block_size
+
+        if len(run_starts) <= GATHER_RUNS:
+            gathered = np.concatenate([
+                data[position:position + size] for position, size in zip(positions.tolist(), run_bytes.tolist())
+            ])
+
+        else:
+            # Many short runs are gathered row by row in a single indexing operation
+            starts = self.offset + rows * row_bytes
+            row_positions = np.searchsorted(needed, starts // block_size) * block_size + starts % block_size
+            gathered = data[row_positions[:, None] + np.arange(row_bytes)]
+
+        return gathered.view(self.dtype).reshape(lengths[:split] + tuple(shape[split:]))
+
+
+def _runs(indices: list[int]) -> list[tuple[int, int]]:
+    """
+    Group sorted block indices into (first, last) runs of consecutive indices.
+    """
+    runs = []
+
+    for index in indices:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1] = (runs[-1][0], index)
+
+        else:
+            runs.append((index, index))
+
+    return runs
+
+
+def _whole(index, length: int) -> bool:
+    # Whether the indices along an axis take all of it, in order
+    return len(index) == length and index[0] == 0 and bool((np.diff(index) == 1).all())
+
+
+def _expand(key, ndim: int) -> Union[tuple, None]:
+    """
+    Index expanded to one entry per axis, None if it can't be split per axis.
+    """
+    key = key if isinstance(key, tuple) else (key,)
+
+    if any(index is None for index in key):
+        return None
+
+    if any(np.ndim(index) > 1 and np.asarray(index).dtype == bool for index in key if index is not Ellipsis):
+        return None
+
+    ellipses = [position for position, index in enumerate(key) if index is Ellipsis]
+
+    if len(ellipses) > 1:
+        raise IndexError("an index can only have a single ellipsis ('...')")
+
+    if ellipses:
+        position = ellipses[0]
+        key = key[:position] + (slice(None),) * (ndim - len(key) + 1) + key[position + 1:]
+
+    if len(key) > ndim:
+        raise IndexError(f"too many indices for array: array is {ndim}-dimensional, but {len(key)} were indexed")
+
+    return key + (slice(None),) * (ndim - len(key))
+
+
+def member_matches(name: str, members: Union[list[str], None]) -> bool:
+    """
+    Whether an archive member is selected, members are either exact names or folders that select everything below
+    them, ie. "data.ms/ANTENNA" selects every file of the ANTENNA table.
+    """
+    if members is None:
+        return True
+
+    return any(name == member or name.startswith(member.rstrip("/") + "/") for member in members)
@@ -0,0 +1,374 @@
+# Bookkeeping for resumable transfers between the local disk and onedrive.
+
+import os
+import json
+import pathlib
+
+from typing import Union
+
+from vipertools.graph import codes as status_code
+
+from vipertools._lazy import logger
+
+# Upload session fragments must be a multiple of 320 KiB
+FRAGMENT_UNIT = 320 * 1024
+
+# Default upload fragment, 10 MiB
+UPLOAD_FRAGMENT_SIZE = 32 * FRAGMENT_UNIT
+
+# Files larger than this are sent through an upload session instead of a single PUT
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+
+# Default byte range fetched by each request of a segmented download, 8 MiB
+DOWNLOAD_SEGMENT_SIZE = 8 * 1024 * 1024
+
+# Sidecars written next to transfers in progress, along with the temporary files they are saved through
+STATE_SUFFIXES = (".upload.json", ".download.json", ".upload.json.tmp", ".download.json.tmp")
+
+
+def fragment_size(size: Union[int, None]) -> int:
+    """
+    Round a requested fragment size down to a multiple of 320 KiB, as required by upload sessions.
+
+    Parameters
+    ----------
+    size: int | None
+        Requested fragment size in bytes, the default is used if None.
+
+    Returns int
+    -------
+        Valid fragment size
+    """
+    if size is None:
+        return UPLOAD_FRAGMENT_SIZE
+
+    return max(FRAGMENT_UNIT, size - size % FRAGMENT_UNIT)
+
+
+def next_range(ranges: list[str], size: int, fragment: int) -> Union[tuple[int, int], None]:
+    """
+    Pick the next fragment to send from the nextExpectedRanges reported by an upload session.
+
+    Parameters
+    ----------
+    ranges: list[str]
+        Missing ranges, ie. ["0-"] or ["26-", "12-25"].
+    size: int
+        Total size of the file.
+    fragment: int
+        Maximum fragment size.
+
+    Returns tuple[int, int] | None
+    -------
+        Inclusive start and end byte of the next fragment, None if nothing is missing.
+    """
+    if not ranges:
+        return None
+
+    start, end = sorted(_parse_range(entry, size) for entry in ranges)[0]
+
+    return start, min(end, start + fragment - 1)
+
+
+def segments(size: int, segment_size: int) -> list[tuple[int, int]]:
+    """
+    Split a file into inclusive byte ranges of at most segment_size.
+
+    Parameters
+    ----------
+    size: int
+        Total size of the file.
+    segment_size: int
+        Maximum size of a segment.
+
+    Returns list[tuple[int, int]]
+    -------
+        Start and end byte of every segment
+    """
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+
+def remaining(ranges: list[str], size: int) -> int:
+    """
+    Number of bytes still expected by an upload session.
+    """
+    return sum(end - start + 1 for start, end in (_parse_range(entry, size) for entry in ranges))
+
+
+def is_state_file(filename: str) -> bool:
+    """
+    Whether a file is the sidecar of a transfer in progress rather than data of its own.
+
+    Parameters
+    ----------
+    filename: str
+        Name or path of the file.
+
+    Returns bool
+    -------
+
+    """
+    return filename.endswith(STATE_SUFFIXES)
+
+
+def _parse_range(entry: str, size: int) -> tuple[int, int]:
+    start, _, end = entry.partition("-")
+
+    return int(start), int(end) if end else size - 1
+
+
+class UploadState:
+    """
+    Sidecar file that remembers the upload session of a local file so that an interrupted upload can pick up from the
+    last committed fragment. The state is ignored if the local file changed since the session was opened.
+    """
+
+    def __init__(self, filename: str, size: int = None, mtime: float = None):
+        # Content that is generated rather than read from filename, ie. an archive, passes its own size and mtime.
+        if size is None:
+            stat = os.stat(filename)
+            size, mtime = stat.st_size, stat.st_mtime
+
+        self.path = pathlib.Path(f"{filename}.upload.json")
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        return f"UploadState({str(self.path)})"
+
+    def load(self) -> Union[dict, None]:
+        """
+        Load the saved session, if there is one for the current version of the file.
+        Returns dict | None
+        -------
+
+        """
+        if not self.path.exists():
+            return None
+
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable upload state {str(self.path)}, ignoring ...")
+            return None
+
+        if state.get("size") != self.size or state.get("mtime") != self.mtime:
+            logger.info(f"{str(self.path)} is out of date, starting a new upload session ...")
+            return None
+
+        return state
+
+    def save(self, upload_url: str, ranges: list[str]) -> None:
+        """
+        Persist the session url and the ranges the server is still expecting.
+        Returns
+        -------
+
+        """
+        state = {
+            "uploadUrl": upload_url,
+            "nextExpectedRanges": ranges,
+            "size": self.size,
+            "mtime": self.mtime
+        }
+
+        # Write then rename so that an interruption never leaves a truncated state file behind.
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+
+        os.replace(temporary, self.path)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class SessionUpload:
+    """
+    Progress of an upload session, apart from the requests that make it so that DriveTool and AsyncDriveTool share it:
+    the session url, the ranges the server still expects, saved to the UploadState after every fragment, and the hash
+    of the content sent so far. Fragments are fed to the digest in order as they are read; whatever a resumed session
+    skipped is hashed from the file once the upload is complete.
+
+    Reading fragments and saving the state touch the disk, an asyncio caller runs those methods in a thread.
+    """
+
+    def __init__(self, state: UploadState, fragment: int = None, digest=None):
+        self.state = state
+        self.fragment = fragment_size(fragment)
+        self.digest = digest
+
+        self.upload_url = None
+        self.ranges = None
+
+        # Bytes of the content fed to the digest so far
+        self.hashed = 0
+
+    def __repr__(self):
+        return f"SessionUpload({str(self.state.path)}, sent={self.sent})"
+
+    @property
+    def size(self) -> int:
+        return self.state.size
+
+    @property
+    def sent(self) -> int:
+        """
+        Bytes the server already holds.
+        """
+        return 0 if self.ranges is None else self.size - remaining(self.ranges, self.size)
+
+    def saved_url(self) -> Union[str, None]:
+        """
+        Url of the session saved for the current version of the content, if there is one.
+        """
+        saved = self.state.load()
+
+        return None if saved is None else saved["uploadUrl"]
+
+    def resume(self, upload_url: str, response) -> bool:
+        """
+        Continue the saved session upload_url given the response of its status request. A session that expired is
+        forgotten and False returned, a new one must then be opened.
+        """
+        if response.status_code != status_code.OK:
+            self.state.remove()
+            return False
+
+        self.upload_url = upload_url
+        self.ranges = response.json()["nextExpectedRanges"]
+
+        return True
+
+    def open(self, response) -> None:
+        """
+        Start the session created by response, the response of a createUploadSession request.
+        """
+        self.upload_url = response.json()["uploadUrl"]
+        self.ranges = response.json().get("nextExpectedRanges", ["0-"])
+        self.state.save(upload_url=self.upload_url, ranges=self.ranges)
+
+    def update(self, response) -> None:
+        """
+        Take the ranges the server expects from the response of an accepted fragment or of a status request.
+        """
+        self.ranges = response.json()["nextExpectedRanges"]
+        self.state.save(upload_url=self.upload_url, ranges=self.ranges)
+
+    def next_fragment(self, file) -> Union[tuple[int, int, bytes], None]:
+        """
+        Read the next fragment the server expects from file.
+        Returns tuple[int, int, bytes] | None
+        -------
+            First and last byte of the fragment and its content; None once the server expects nothing more.
+        """
+        fragment_range = next_range(self.ranges, self.size, self.fragment)
+
+        if fragment_range is None:
+            return None
+
+        start, end = fragment_range
+
+        file.seek(start)
+        data = file.read(end - start + 1)
+
+        if self.digest is not None and start == self.hashed:
+            self.digest.update(data)
+            self.hashed += len(data)
+
+        return start, end, data
+
+    def headers(self, start: int, end: int) -> dict[str, str]:
+        """
+        Headers of the request sending the fragment start-end. The upload url is pre-authenticated, sending the app
+        token along is not allowed.
+        """
+        return {
+            "Content-Length": f"{end - start + 1}",
+            "Content-Range": f"bytes {start}-{end}/{self.size}"
+        }
+
+    def complete(self, file) -> None:
+        """
+        Forget the finished session and hash the content a resumed session did not send.
+        """
+        self.state.remove()
+
+        if self.digest is not None and self.hashed < self.size:
+            file.seek(self.hashed)
+
+            while chunk := file.read(UPLOAD_FRAGMENT_SIZE):
+                self.digest.update(chunk)
+
+            self.hashed = self.size
+
+
+class DownloadState:
+    """
+    Sidecar file that records which segments of a segmented download are already on disk so that a restart only
+    fetches the missing ones. The state is only trusted if the remote item, the segment layout and the partial file
+    are still the ones it was written for.
+    """
+
+    def __init__(self, filename: str, size: int, segment_size: int, etag: Union[str, None] = None):
+        self.filename = pathlib.Path(filename)
+        self.path = pathlib.Path(f"{filename}.download.json")
+        self.size = size
+        self.segment_size = segment_size
+        self.etag = etag
+
+    def __repr__(self):
+        return f"DownloadState({str(self.path)})"
+
+    def load(self) -> set[int]:
+        """
+        Indices of the segments already downloaded, empty if there is nothing to resume.
+        Returns set[int]
+        -------
+
+        """
+        if not (self.path.exists() and self.filename.exists()):
+            return set()
+
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable download state {str(self.path)}, ignoring ...")
+            return set()
+
+        current = {"size": self.size, "segment_size": self.segment_size, "etag": self.etag}
+        if any(state.get(key) != value for key, value in current.items()):
+            logger.info(f"{str(self.path)} is out of date, starting over ...")
+            return set()
+
+        if self.filename.stat().st_size != self.size:
+            return set()
+
+        return set(state.get("done", []))
+
+    def save(self, done: set[int]) -> None:
+        """
+        Persist the indices of the completed segments.
+        Returns
+        -------
+
+        """
+        state = {
+            "size": self.size,
+            "segment_size": self.segment_size,
+            "etag": self.etag,
+            "done": sorted(done)
+        }
+
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+
+        os.replace(temporary, self.path)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
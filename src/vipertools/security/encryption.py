@@ -2,11 +2,9 @@ import os
 import pathlib
 import shutil
 import getpass
-import paramiko
 import configparser
 
-from scp import SCPClient
-from graphviper.utils import logger
+from vipertools._lazy import logger
 
 
 def write_to_config(file: str, credential: str, value: str) -> None:
@@ -49,6 +47,9 @@ def get_credentials(persistent=False):
     username = input("Username: ")
     password = getpass.getpass()
 
+    import paramiko
+    from scp import SCPClient
+
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
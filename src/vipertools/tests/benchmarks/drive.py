@@ -0,0 +1,250 @@
+# Throughput and latency of the DriveTool operations against a local mock graph server, no network or account needed.
+#
+#   python src/vipertools/tests/benchmarks/drive.py --save baseline.json
+#   python src/vipertools/tests/benchmarks/drive.py --baseline baseline.json --tolerance 0.25
+#
+# The server latency and bandwidth are fixed by the options, so results are comparable between runs on the same
+# machine. With a baseline the script exits with 1 if any scenario got slower than the baseline by more than the
+# tolerance.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+from typing import Callable
+
+from vipertools._lazy import logger
+from vipertools.mstools import DriveTool
+from vipertools.tests.mock_graph import MockGraph
+from vipertools.tests.benchmarks.imports import compare
+
+MEGABYTE = 1024 * 1024
+
+
+class Scenario:
+    """
+    One benchmarked operation: setup() fills the mock drive once, run() performs the operation and returns how much
+    work it did, in unit, so throughput can be reported alongside latency.
+    """
+
+    def __init__(self, name: str, unit: str, setup: Callable, run: Callable):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+
+
+def scenarios(options: argparse.Namespace) -> list[Scenario]:
+    size = options.size * MEGABYTE
+
+    def listing_setup(server):
+        for i in range(options.entries):
+            server.drive.add_file(f"listing/file{i:05d}.ms.zip", data=b"x")
+
+    def listing_run(tool, workdir):
+        return sum(1 for _ in tool.iter_path("listing", page_size=200))
+
+    def resolve_run(tool, workdir):
+        step = max(options.entries // 20, 1)
+        return sum(tool.resolve("listing", f"file{i:05d}.ms.zip") is not None for i in range(0, options.entries, step))
+
+    def walk_setup(server):
+        for folder in range(options.folders):
+            for i in range(20):
+                server.drive.add_file(f"walk/folder{folder:03d}/file{i:02d}.bin", data=b"x")
+
+    def walk_run(tool, workdir):
+        return sum(len(entries) for _, entries in tool.walk("walk", max_workers=16))
+
+    def manifest_setup(server):
+        for i in range(options.links):
+            server.drive.add_file(f"manifest/dataset{i:04d}.ms.zip", data=b"x")
+
+    def manifest_run(tool, workdir):
+        destination = os.path.join(workdir, "manifest")
+        shutil.rmtree(destination, ignore_errors=True)
+
+        return len(tool.generate_manifest("manifest", version="benchmark", destination=destination)["added"])
+
+    def download_setup(server):
+        server.drive.add_file("transfer/download.bin", size=size, seed=1)
+
+    def download_run(tool, workdir, connections=1):
+        tool.download("transfer", "download.bin", connections=connections)
+        return os.path.getsize("download.bin") / MEGABYTE
+
+    manifest = {"version": "benchmark", "metadata": {}}
+
+    def download_many_setup(server):
+        for i in range(options.files):
+            item = server.drive.add_file(f"many/file{i:03d}.zip", size=MEGABYTE, seed=i)
+
+            manifest["metadata"][f"file{i:03d}"] = {
+                "file": f"file{i:03d}.zip",
+                "id": f":u:/g/personal/mock/{item}",
+                "dtype": "",
+                "telescope": "",
+                "size": MEGABYTE,
+                "mode": ""
+            }
+
+    def download_many_run(tool, workdir):
+        reports = tool.download_many(manifest, destination=os.path.join(workdir, "many"))
+
+        return sum(report["size"] for report in reports) / MEGABYTE
+
+    def upload_setup(server):
+        server.drive.add_folder("uploads")
+
+    def upload_run(tool, workdir, filesize=size):
+        filename = f"upload-{filesize}.bin"
+
+        if not os.path.exists(filename):
+            with open(filename, "wb") as file:
+                file.write(os.urandom(filesize))
+
+        tool.upload_new_file(filename, "uploads")
+        return filesize / MEGABYTE
+
+    def upload_directory_run(tool, workdir):
+        directory = os.path.join(workdir, "dataset.ms")
+
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+
+            for i in range(8):
+                with open(os.path.join(directory, f"table.f{i}"), "wb") as file:
+                    file.write(os.urandom(size // 8))
+
+        tool.upload_directory(directory, "uploads")
+        return size / MEGABYTE
+
+    return [
+        Scenario("listing", "entries/s", listing_setup, listing_run),
+        Scenario("resolve", "lookups/s", listing_setup, resolve_run),
+        Scenario("walk", "entries/s", walk_setup, walk_run),
+        Scenario("manifest", "links/s", manifest_setup, manifest_run),
+        Scenario("download", "MiB/s", download_setup, download_run),
+        Scenario("download_segmented", "MiB/s", download_setup, lambda tool, workdir: download_run(tool, workdir, 4)),
+        Scenario("download_many", "MiB/s", download_many_setup, download_many_run),
+        Scenario("upload_simple", "MiB/s", upload_setup, lambda tool, workdir: upload_run(tool, workdir, MEGABYTE)),
+        Scenario("upload_session", "MiB/s", upload_setup, upload_run),
+        Scenario("upload_directory", "MiB/s", upload_setup, upload_directory_run),
+    ]
+
+
+def measure(scenario: Scenario, options: argparse.Namespace) -> dict:
+    """
+    Run a scenario against a fresh server.
+
+    Parameters
+    ----------
+    scenario: Scenario
+        Operation to benchmark.
+    options: argparse.Namespace
+        Server latency, bandwidth and throttling along with the number of repeats.
+
+    Returns dict
+    -------
+        Median "seconds" with the "min" and "max", the "throughput" of the median run and the number of "requests"
+        the server answered per run.
+    """
+    bandwidth = None if options.bandwidth is None else options.bandwidth * MEGABYTE
+
+    with MockGraph(latency=options.latency, bandwidth=bandwidth, max_concurrency=options.max_concurrency) as server:
+        scenario.setup(server)
+
+        workdir = tempfile.mkdtemp(prefix=f"vipertools-{scenario.name}-")
+        current = os.getcwd()
+
+        try:
+            os.chdir(workdir)
+
+            # A new tool per run, so no listing cache or connection is carried from one run to the next
+            timings = []
+            for _ in range(options.repeat):
+                tool = DriveTool(graph=server.graph(), cache=False)
+                server.reset_stats()
+
+                start = time.perf_counter()
+                amount = scenario.run(tool, workdir)
+                timings.append(time.perf_counter() - start)
+
+                tool.graph.close()
+
+        finally:
+            os.chdir(current)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        seconds = statistics.median(timings)
+
+        return {
+            "seconds": seconds,
+            "min": min(timings),
+            "max": max(timings),
+            "throughput": amount / seconds,
+            "unit": scenario.unit,
+            "requests": server.stats["requests"],
+            "throttled": server.stats["throttled"]
+        }
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark DriveTool against a local mock graph server.")
+    parser.add_argument("--latency", type=float, default=0.005, help="server latency per request, in seconds")
+    parser.add_argument("--bandwidth", type=float, default=None, help="server bandwidth per connection, in MiB/s")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="requests in flight before the server "
+                                                                          "answers 429")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the median is reported")
+    parser.add_argument("--size", type=int, default=64, help="size of the transferred file, in MiB")
+    parser.add_argument("--entries", type=int, default=2000, help="entries of the listed folder")
+    parser.add_argument("--folders", type=int, default=50, help="folders of the walked tree")
+    parser.add_argument("--links", type=int, default=200, help="entries of the manifest folder")
+    parser.add_argument("--files", type=int, default=16, help="files downloaded by download_many")
+    parser.add_argument("--only", nargs="+", default=None, help="scenarios to run, all by default")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown relative to the baseline")
+
+    options = parser.parse_args(arguments)
+
+    # Transfers report through progress bars, the log would only add noise
+    logger.get_logger().setLevel("WARNING")
+
+    selected = [scenario for scenario in scenarios(options) if options.only is None or scenario.name in options.only]
+    results = {scenario.name: measure(scenario, options) for scenario in selected}
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline, "r") as file:
+            baseline = json.load(file)
+
+    print(f"{'scenario':<22}{'median':>10}{'min':>10}{'max':>10}{'throughput':>22}{'requests':>10}{'baseline':>10}")
+
+    for name, result in results.items():
+        reference = f"{baseline[name]['seconds']:9.3f}s" if name in baseline else f"{'-':>10}"
+
+        print(
+            f"{name:<22}{result['seconds']:9.3f}s{result['min']:9.3f}s{result['max']:9.3f}s"
+            f"{result['throughput']:12.1f} {result['unit']:<9}{result['requests']:>10}{reference}"
+        )
+
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump(results, file, indent=4)
+
+    regressions = compare(results, baseline, tolerance=options.tolerance)
+
+    for name in regressions:
+        print(f"Regression: {name} is more than {options.tolerance:.0%} slower than the baseline")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
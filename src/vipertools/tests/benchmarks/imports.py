@@ -0,0 +1,125 @@
+# Import time of the vipertools entry points, each one measured in a fresh interpreter.
+#
+#   python src/vipertools/tests/benchmarks/imports.py --save baseline.json
+#   python src/vipertools/tests/benchmarks/imports.py --baseline baseline.json --tolerance 0.25
+#
+# With a baseline the script exits with 1 if any entry point got slower than the baseline by more than the tolerance.
+
+import sys
+import json
+import argparse
+import subprocess
+
+ENTRY_POINTS = (
+    "import vipertools",
+    "from vipertools.mstools import DriveTool",
+    "from vipertools.mstools import AsyncDriveTool",
+    "from vipertools.graph import GraphQuery",
+)
+
+# Dependencies that are expensive to import and should only be loaded by the code that needs them
+HEAVY_MODULES = (
+    "azure.identity",
+    "msgraph",
+    "paramiko",
+    "numpy",
+    "rich.console",
+    "dask",
+    "httpx",
+)
+
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(statement: str, runs: int = 5) -> dict:
+    """
+    Time an import statement in a fresh interpreter.
+
+    Parameters
+    ----------
+    statement: str
+        Import statement to time.
+    runs: int
+        Number of interpreters to start, the fastest one is kept since slower runs only add noise.
+
+    Returns dict
+    -------
+        Fastest time in "seconds" and the heavy modules the statement "loaded".
+    """
+    results = []
+
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    return min(results, key=lambda result: result["seconds"])
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Entry points that are slower than the baseline by more than the tolerance, as a fraction of the baseline time.
+    """
+    regressions = []
+
+    for statement, result in results.items():
+        if statement not in baseline:
+            continue
+
+        limit = baseline[statement]["seconds"] * (1.0 + tolerance)
+
+        if result["seconds"] > limit:
+            regressions.append(statement)
+
+    return regressions
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the import time of the vipertools entry points.")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters started per entry point")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown relative to the baseline")
+
+    options = parser.parse_args(arguments)
+
+    results = {statement: measure(statement, runs=options.runs) for statement in ENTRY_POINTS}
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline, "r") as file:
+            baseline = json.load(file)
+
+    print(f"{'entry point':<50}{'time':>10}{'baseline':>10}  heavy modules loaded")
+
+    for statement, result in results.items():
+        reference = f"{baseline[statement]['seconds'] * 1000:8.1f}ms" if statement in baseline else f"{'-':>10}"
+        loaded = ", ".join(result["loaded"]) or "-"
+
+        print(f"{statement:<50}{result['seconds'] * 1000:8.1f}ms{reference}  {loaded}")
+
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump(results, file, indent=4)
+
+    regressions = compare(results, baseline, tolerance=options.tolerance)
+
+    for statement in regressions:
+        print(f"Regression: {statement} is more than {options.tolerance:.0%} slower than the baseline")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
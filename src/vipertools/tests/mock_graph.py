@@ -0,0 +1,807 @@
+# Local stand-in for the parts of the graph api the drive tools use, so they can be exercised and benchmarked offline.
+#
+#   with MockGraph(latency=0.02, bandwidth=50e6) as server:
+#       server.drive.add_file("data/file.ms.zip", size=64 * 1024 * 1024)
+#
+#       tool = DriveTool(graph=server.graph())
+#       tool.download(path="data", filename="file.ms.zip")
+
+import re
+import json
+import time
+import base64
+import random
+import threading
+import http.server
+import urllib.parse
+
+from typing import Union
+
+from vipertools.graph import codes as status_code
+from vipertools.graph import GraphQuery
+from vipertools.mstools.hashing import QuickXorHash
+
+SHAREPOINT_URL = "https://nrao-my.sharepoint.com/"
+
+# Bandwidth limited bodies are written in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+
+class MockDrive:
+    """
+    In-memory drive: a tree of folders and files with the metadata graph reports for them, along with the log of
+    changes the delta endpoint replays.
+    """
+
+    def __init__(self):
+        self.items = {"root": {"id": "root", "name": "root", "parent": None, "data": None, "version": 0}}
+        self.changes = []
+
+        # Children of every folder by name, so listing a folder doesn't scan the whole drive
+        self._children = {"root": {}}
+
+        self._count = 0
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"MockDrive(items={len(self.items) - 1})"
+
+    def add_folder(self, path: str) -> str:
+        """
+        Create a folder and its parents, returning its id.
+        """
+        with self._lock:
+            parent = "root"
+
+            for name in _parts(path):
+                child = self.child(parent, name)
+                parent = child if child is not None else self._create(parent, name, data=None)
+
+            return parent
+
+    def add_file(self, path: str, data: bytes = None, size: int = None, seed: int = 0) -> str:
+        """
+        Create or replace a file, returning its id. Without data, size bytes of reproducible random content are made up
+        from seed.
+        """
+        if data is None:
+            generator = random.Random(seed)
+
+            # randbytes() is limited to 256 MiB at a time
+            data = b"".join(generator.randbytes(min(CHUNK_SIZE, size - offset)) for offset in range(0, size, CHUNK_SIZE))
+
+        folder, _, name = path.strip("/").rpartition("/")
+
+        with self._lock:
+            parent = self.add_folder(folder)
+            item = self.child(parent, name)
+
+            if item is None:
+                return self._create(parent, name, data=data)
+
+            self.write(item, data)
+
+            return item
+
+    def write(self, item: str, data: bytes, mtime: str = None) -> None:
+        """
+        Replace the content of a file. Its fileSystemInfo modification time is mtime, or the time of the write as when
+        a client doesn't set it.
+        """
+        with self._lock:
+            self.items[item]["data"] = data
+            self.items[item]["hash"] = QuickXorHash(data).b64digest()
+            self._touch(item)
+
+            if mtime is not None:
+                self.items[item]["mtime"] = mtime
+
+            else:
+                self.items[item].pop("mtime", None)
+
+    def remove(self, item: str) -> None:
+        with self._lock:
+            for child in self.children(item):
+                self.remove(child)
+
+            record = self.items.pop(item)
+            self._children.pop(item, None)
+            del self._children[record["parent"]][record["name"]]
+
+            self.changes.append(item)
+
+    def child(self, parent: str, name: str) -> Union[str, None]:
+        with self._lock:
+            return self._children.get(parent, {}).get(name)
+
+    def children(self, parent: str) -> list[str]:
+        with self._lock:
+            return list(self._children.get(parent, {}).values())
+
+    def resolve(self, path: Union[str, None]) -> Union[str, None]:
+        """
+        Id of the item at path, None if there is no such item.
+        """
+        with self._lock:
+            item = "root"
+
+            for name in _parts(path or ""):
+                item = self.child(item, name)
+
+                if item is None:
+                    return None
+
+            return item
+
+    def path_of(self, item: str) -> str:
+        names = []
+
+        while item != "root":
+            names.append(self.items[item]["name"])
+            item = self.items[item]["parent"]
+
+        return "/".join(reversed(names))
+
+    def entry(self, item: str, download_url: str = None) -> dict:
+        """
+        Drive item resource of an item.
+        """
+        with self._lock:
+            record = self.items[item]
+
+            entry = {
+                "id": item,
+                "name": record["name"],
+                "eTag": f"\"{{{item}}},{record['version']}\"",
+                "cTag": f"\"c:{{{item}}},{record['version']}\"",
+                "lastModifiedDateTime": record.get("modified", "2024-01-01T00:00:00Z"),
+                "fileSystemInfo": {
+                    "lastModifiedDateTime": record.get("mtime", record.get("modified", "2024-01-01T00:00:00Z"))
+                },
+                "parentReference": {
+                    "id": record["parent"],
+                    "path": f"/drive/root:/{self.path_of(record['parent'])}" if record["parent"] else None
+                }
+            }
+
+            if record["data"] is None:
+                entry["size"] = sum(self.entry(child)["size"] for child in self.children(item))
+                entry["folder"] = {"childCount": len(self.children(item))}
+
+                if item == "root":
+                    entry["root"] = {}
+
+            else:
+                entry["size"] = len(record["data"])
+                entry["file"] = {"hashes": {"quickXorHash": record["hash"]}}
+
+                if download_url is not None:
+                    entry["@microsoft.graph.downloadUrl"] = f"{download_url}/{item}"
+
+            return entry
+
+    def _create(self, parent: str, name: str, data: Union[bytes, None]) -> str:
+        self._count += 1
+        item = f"ITEM{self._count:06d}"
+
+        self.items[item] = {"id": item, "name": name, "parent": parent, "data": None, "version": 0}
+        self._children[parent][name] = item
+
+        if data is not None:
+            self.write(item, data)
+
+        else:
+            self._children[item] = {}
+            self._touch(item)
+
+        return item
+
+    def _touch(self, item: str) -> None:
+        # A change bumps the version of the item and of every folder above it, like eTags do
+        while item is not None:
+            self.items[item]["version"] += 1
+            self.items[item]["modified"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            self.changes.append(item)
+
+            item = self.items[item]["parent"]
+
+
+class MockGraph:
+    """
+    Threaded http server answering the graph endpoints used by DriveTool and AsyncDriveTool:
+
+        - GET /me, used to check the app-token
+        - GET /me/drive/root[:/{path}] and its /children, paged with $top and @odata.nextLink
+        - GET /me/drive/root/delta, replaying the changes of the drive
+        - GET /me/drive/items/{id}/content, redirected to a pre-authenticated download url that honors Range
+        - PUT /me/drive/root:/{path}:/content and /me/drive/items/{id}/content, simple uploads
+        - POST createUploadSession, then PUT fragments with Content-Range and GET the expected ranges
+        - PATCH and DELETE /me/drive/items/{id}, to set the fileSystemInfo of an item or remove it
+        - POST /me/drive/items/{id}/createLink and GET /shares/{id}/driveItem
+        - POST /$batch, each sub-request is routed like a request of its own
+
+    Every request is delayed by latency seconds and bodies are sent or received at most at bandwidth bytes per second
+    per connection. Above max_concurrency requests in flight the server answers 429 with a Retry-After header, as the
+    graph does when a tenant is throttled. Failures of given requests are injected with fail().
+    """
+
+    def __init__(
+            self,
+            drive: MockDrive = None,
+            latency: float = 0.0,
+            bandwidth: float = None,
+            max_concurrency: int = None,
+            retry_after: float = 1.0,
+            page_size: int = 200,
+            version: str = "v1.0"
+    ):
+        self.drive = MockDrive() if drive is None else drive
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.version = version
+
+        self.sessions = {}
+        self.counts = {}
+        self.served = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.throttled = 0
+        self.ranges = 0
+        self.downloaded = 0
+
+        # Failures to answer instead of routing, see fail()
+        self.faults = []
+
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __repr__(self):
+        return f"MockGraph({self.hostname}, latency={self.latency}, bandwidth={self.bandwidth})"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def hostname(self) -> Union[str, None]:
+        if self._server is None:
+            return None
+
+        host, port = self._server.server_address[:2]
+
+        return f"{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.hostname}/{self.version}"
+
+    @property
+    def stats(self) -> dict:
+        """
+        Number of http "requests" served and the number of "endpoints" called, batch sub-requests included, along with
+        the "peak" number of requests in flight, the number "throttled", the number of downloads that asked for
+        "ranges" and the bytes of content "downloaded".
+        Returns dict
+        -------
+
+        """
+        with self._lock:
+            return {
+                "requests": self.served,
+                "endpoints": dict(self.counts),
+                "peak": self.peak,
+                "throttled": self.throttled,
+                "ranges": self.ranges,
+                "downloaded": self.downloaded
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.counts = {}
+            self.served = 0
+            self.peak = 0
+            self.throttled = 0
+            self.ranges = 0
+            self.downloaded = 0
+
+    def start(self) -> "MockGraph":
+        """
+        Serve on a free local port from a background thread.
+        Returns MockGraph
+        -------
+
+        """
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def graph(self, **kwargs) -> GraphQuery:
+        """
+        GraphQuery talking to this server.
+        Parameters
+        ----------
+        kwargs:
+            Any keyword accepted by GraphQuery.
+
+        Returns GraphQuery
+        -------
+
+        """
+        return GraphQuery(hostname=self.hostname, scheme="http", app_token="mock-token", **kwargs)
+
+    def fail(
+            self,
+            pattern: str,
+            status: int,
+            method: str = None,
+            count: int = 1,
+            after: int = 0,
+            retry_after: float = None
+    ) -> None:
+        """
+        Answer requests whose path, without the version prefix, fully matches the regular expression pattern with an
+        error of the given status instead of routing them. The first after matching requests are served normally, the
+        count following ones fail. Batch sub-requests are matched like requests of their own.
+        Parameters
+        ----------
+        pattern: str
+            Regular expression the unquoted path must fully match, ie. r"/upload/.*".
+        status: int
+            Status code of the error.
+        method: str (default None)
+            Only fail requests of this method, any if None.
+        count: int (default 1)
+            Number of requests to fail.
+        after: int (default 0)
+            Number of matching requests served before failing.
+        retry_after: float (default None)
+            Value of the Retry-After header sent with the error, none if None.
+
+        Returns
+        -------
+
+        """
+        with self._lock:
+            self.faults.append({
+                "pattern": pattern, "status": status, "method": method, "count": count, "after": after,
+                "retry_after": retry_after
+            })
+
+    def route(self, method: str, target: str, headers: dict, body: bytes) -> tuple[int, dict, Union[bytes, dict, None]]:
+        """
+        Answer a request, returning its status, headers and body. Dictionaries are sent as json.
+        """
+        url = urllib.parse.urlparse(target)
+        query = urllib.parse.parse_qs(url.query)
+        path = urllib.parse.unquote(url.path)
+
+        prefix = f"/{self.version}"
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+
+        fault = self._fault(method, path)
+        if fault is not None:
+            return fault
+
+        for pattern, endpoint, handler in self._routes():
+            match = re.fullmatch(pattern, path)
+
+            if match is not None and method == endpoint:
+                self._count(handler.__name__)
+                return handler(match, query=query, headers=headers, body=body)
+
+        return _error(status_code.NOT_FOUND, "itemNotFound", f"No mock endpoint for {method} {path}")
+
+    def _routes(self) -> list:
+        return [
+            (r"/me", "GET", self._me),
+            (r"/me/drive/root(?::/(.*?))?:?/children", "GET", self._children),
+            (r"/me/drive/root/delta", "GET", self._delta),
+            (r"/me/drive/root(?::/(.*))?", "GET", self._item),
+            (r"/me/drive/items/([^/]+)/content", "GET", self._content),
+            (r"/download/([^/]+)", "GET", self._download),
+            (r"/me/drive/(?:items/([^/]+)|root:/(.*):)/content", "PUT", self._simple_upload),
+            (r"/me/drive/(?:items/([^/]+)|root:/(.*):)/createUploadSession", "POST", self._create_session),
+            (r"/upload/([^/]+)", "PUT", self._upload_fragment),
+            (r"/upload/([^/]+)", "GET", self._session_status),
+            (r"/me/drive/items/([^/]+)", "PATCH", self._update),
+            (r"/me/drive/items/([^/]+)", "DELETE", self._delete),
+            (r"/me/drive/items/([^/]+)/createLink", "POST", self._create_link),
+            (r"/shares/u!([^/]+)/driveItem", "GET", self._share),
+            (r"/\$batch", "POST", self._batch),
+        ]
+
+    def _fault(self, method: str, path: str) -> Union[tuple[int, dict, dict], None]:
+        # Injected failure for this request, if any, see fail()
+        with self._lock:
+            for fault in self.faults:
+                if fault["count"] <= 0 or fault["method"] not in (None, method):
+                    continue
+
+                if re.fullmatch(fault["pattern"], path) is None:
+                    continue
+
+                if fault["after"] > 0:
+                    fault["after"] -= 1
+                    continue
+
+                fault["count"] -= 1
+
+                status, headers, content = _error(fault["status"], "mockFault", f"Injected failure of {method} {path}")
+
+                if fault["retry_after"] is not None:
+                    headers["Retry-After"] = f"{fault['retry_after']:g}"
+
+                return status, headers, content
+
+        return None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name.lstrip("_")] = self.counts.get(name.lstrip("_"), 0) + 1
+
+    def _downloaded(self, size: int, ranged: bool = False) -> None:
+        with self._lock:
+            self.ranges += int(ranged)
+            self.downloaded += size
+
+    def _admit(self) -> bool:
+        with self._lock:
+            self.served += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+            if self.max_concurrency is not None and self.in_flight > self.max_concurrency:
+                self.throttled += 1
+                return False
+
+            return True
+
+    def _leave(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def _me(self, match, **kwargs):
+        return status_code.OK, {}, {"displayName": "Mock User", "id": "mock"}
+
+    def _item(self, match, **kwargs):
+        item = self.drive.resolve(match.group(1))
+
+        if item is None:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        return status_code.OK, {}, self._entry(item)
+
+    def _children(self, match, query: dict, **kwargs):
+        item = self.drive.resolve(match.group(1))
+
+        if item is None:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        top = int(query.get("$top", [self.page_size])[0])
+        skip = int(query.get("$skiptoken", [0])[0])
+
+        children = self.drive.children(item)
+        page = {"value": [self._entry(child) for child in children[skip:skip + top]]}
+
+        if skip + top < len(children):
+            target = "root/children" if item == "root" else f"root:/{urllib.parse.quote(self.drive.path_of(item))}:/children"
+            page["@odata.nextLink"] = f"{self.base_url}/me/drive/{target}?$top={top}&$skiptoken={skip + top}"
+
+        return status_code.OK, {}, page
+
+    def _delta(self, match, query: dict, **kwargs):
+        token = query.get("token", [None])[0]
+
+        if token is None:
+            changed = list(self.drive.items)
+
+        elif int(token) > len(self.drive.changes):
+            return _error(status_code.GONE, "resyncRequired", "The delta token is no longer valid.")
+
+        else:
+            changed = list(dict.fromkeys(self.drive.changes[int(token):]))
+
+        value = [
+            self._entry(item) if item in self.drive.items else {"id": item, "deleted": {"state": "deleted"}}
+            for item in changed
+        ]
+
+        return status_code.OK, {}, {
+            "value": value,
+            "@odata.deltaLink": f"{self.base_url}/me/drive/root/delta?token={len(self.drive.changes)}"
+        }
+
+    def _content(self, match, **kwargs):
+        if match.group(1) not in self.drive.items:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        # Like the graph, content is served from a pre-authenticated url
+        return status_code.FILE_FOUND, {"Location": f"http://{self.hostname}/download/{match.group(1)}"}, None
+
+    def _download(self, match, headers: dict, **kwargs):
+        record = self.drive.items.get(match.group(1))
+
+        if record is None or record["data"] is None:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        data = record["data"]
+        requested = headers.get("Range")
+
+        if requested is None:
+            self._downloaded(len(data))
+            return status_code.OK, {"Content-Type": "application/octet-stream"}, data
+
+        start, _, end = requested.split("=", 1)[1].partition("-")
+        start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+
+        if start >= len(data):
+            return status_code.REQUEST_RANGE_INVALID, {"Content-Range": f"bytes */{len(data)}"}, b""
+
+        self._downloaded(end + 1 - start, ranged=True)
+        return status_code.PARTIAL_CONTENT, {"Content-Range": f"bytes {start}-{end}/{len(data)}"}, data[start:end + 1]
+
+    def _simple_upload(self, match, body: bytes, **kwargs):
+        item_id, path = match.groups()
+
+        if item_id is not None:
+            if item_id not in self.drive.items:
+                return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+            self.drive.write(item_id, body)
+            return status_code.OK, {}, self._entry(item_id)
+
+        return status_code.CREATED, {}, self._entry(self.drive.add_file(path, data=body))
+
+    def _create_session(self, match, body: bytes, **kwargs):
+        item_id, path = match.groups()
+
+        if item_id is not None and item_id not in self.drive.items:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        properties = json.loads(body or b"{}").get("item", {})
+        mtime = properties.get("fileSystemInfo", {}).get("lastModifiedDateTime")
+
+        with self._lock:
+            session = f"session{len(self.sessions) + 1}"
+            self.sessions[session] = {"item": item_id, "path": path, "fragments": {}, "received": 0, "mtime": mtime}
+
+        return status_code.OK, {}, {
+            "uploadUrl": f"http://{self.hostname}/upload/{session}",
+            "expirationDateTime": "2099-01-01T00:00:00Z",
+            "nextExpectedRanges": ["0-"]
+        }
+
+    def _session_status(self, match, **kwargs):
+        session = self.sessions.get(match.group(1))
+
+        if session is None:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The upload session does not exist.")
+
+        return status_code.OK, {}, {"nextExpectedRanges": [f"{session['received']}-"]}
+
+    def _upload_fragment(self, match, headers: dict, body: bytes, **kwargs):
+        session = self.sessions.get(match.group(1))
+
+        if session is None:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The upload session does not exist.")
+
+        if "Authorization" in headers:
+            return _error(status_code.UNAUTHORIZED, "unauthenticated", "Upload urls must not be sent a token.")
+
+        span, _, total = headers["Content-Range"].split(" ", 1)[1].partition("/")
+        start, end = (int(value) for value in span.split("-"))
+
+        if start != session["received"] or len(body) != end - start + 1:
+            return _error(status_code.REQUEST_RANGE_INVALID, "invalidRange", "Unexpected fragment range.")
+
+        session["fragments"][start] = body
+        session["received"] = end + 1
+
+        if session["received"] < int(total):
+            return status_code.ACCEPTED, {}, {"nextExpectedRanges": [f"{session['received']}-"]}
+
+        data = b"".join(session["fragments"][offset] for offset in sorted(session["fragments"]))
+        del self.sessions[match.group(1)]
+
+        if session["item"] is not None:
+            self.drive.write(session["item"], data, mtime=session["mtime"])
+            return status_code.OK, {}, self._entry(session["item"])
+
+        item = self.drive.add_file(session["path"], data=data)
+
+        if session["mtime"] is not None:
+            self.drive.write(item, data, mtime=session["mtime"])
+
+        return status_code.CREATED, {}, self._entry(item)
+
+    def _update(self, match, body: bytes, **kwargs):
+        item = match.group(1)
+
+        if item not in self.drive.items:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        mtime = json.loads(body or b"{}").get("fileSystemInfo", {}).get("lastModifiedDateTime")
+
+        if mtime is not None:
+            with self.drive._lock:
+                self.drive.items[item]["mtime"] = mtime
+
+        return status_code.OK, {}, self._entry(item)
+
+    def _delete(self, match, **kwargs):
+        if match.group(1) not in self.drive.items:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        self.drive.remove(match.group(1))
+
+        return status_code.NO_CONTENT, {}, None
+
+    def _create_link(self, match, **kwargs):
+        if match.group(1) not in self.drive.items:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The resource could not be found.")
+
+        return status_code.CREATED, {}, {
+            "link": {"type": "view", "webUrl": f"{SHAREPOINT_URL}:u:/g/personal/mock/{match.group(1)}"}
+        }
+
+    def _share(self, match, **kwargs):
+        encoded = match.group(1)
+        link = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+        item = link.rstrip("/").rsplit("/", 1)[-1]
+
+        if item not in self.drive.items:
+            return _error(status_code.NOT_FOUND, "itemNotFound", "The sharing link could not be resolved.")
+
+        return status_code.OK, {}, self._entry(item)
+
+    def _batch(self, match, body: bytes, **kwargs):
+        requests = json.loads(body)["requests"]
+
+        if len(requests) > 20:
+            return _error(status_code.BAD_REQUEST, "invalidRequest", "A batch holds at most 20 requests.")
+
+        responses = []
+        for request in requests:
+            sub_body = request.get("body")
+            sub_body = json.dumps(sub_body).encode() if sub_body is not None else b""
+
+            status, headers, content = self.route(
+                request["method"],
+                f"/{self.version}{request['url']}",
+                headers=request.get("headers", {}),
+                body=sub_body
+            )
+
+            responses.append({"id": request["id"], "status": status, "headers": headers, "body": content})
+
+        return status_code.OK, {}, {"responses": responses}
+
+    def _entry(self, item: str) -> dict:
+        return self.drive.entry(item, download_url=f"http://{self.hostname}/download")
+
+
+def _handler(server: MockGraph) -> type:
+    # Request handler class bound to a server
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Headers and body go out in separate writes, Nagle would hold small bodies back until the client acks
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            # Clients drop connections they have no use for, ie. the one of a throttled streamed response
+            try:
+                super().handle()
+
+            except ConnectionError:
+                pass
+
+        def do_GET(self):
+            self._serve("GET")
+
+        def do_PUT(self):
+            self._serve("PUT")
+
+        def do_POST(self):
+            self._serve("POST")
+
+        def do_PATCH(self):
+            self._serve("PATCH")
+
+        def do_DELETE(self):
+            self._serve("DELETE")
+
+        def _serve(self, method: str):
+            body = self._receive(int(self.headers.get("Content-Length", 0)))
+
+            try:
+                if not server._admit():
+                    status, headers, content = _error(
+                        status_code.TOO_MANY_REQUESTS, "activityLimitReached", "The request has been throttled."
+                    )
+                    headers["Retry-After"] = f"{server.retry_after:g}"
+
+                else:
+                    if server.latency:
+                        time.sleep(server.latency)
+
+                    try:
+                        status, headers, content = server.route(method, self.path, headers=dict(self.headers), body=body)
+
+                    except Exception as error:
+                        status, headers, content = _error(status_code.INTERNAL_SERVER_ERROR, "generalException", str(error))
+
+            finally:
+                server._leave()
+
+            self._send(status, headers, content)
+
+        def _receive(self, size: int) -> bytes:
+            chunks = []
+
+            while size > 0:
+                chunk = self.rfile.read(min(size, CHUNK_SIZE))
+
+                if not chunk:
+                    break
+
+                chunks.append(chunk)
+                size -= len(chunk)
+                self._throttle(len(chunk))
+
+            return b"".join(chunks)
+
+        def _send(self, status: int, headers: dict, content):
+            if isinstance(content, dict):
+                content = json.dumps(content).encode()
+                headers.setdefault("Content-Type", "application/json")
+
+            content = b"" if content is None else content
+
+            self.send_response(status)
+
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+
+            view = memoryview(content)
+            for offset in range(0, len(content), CHUNK_SIZE):
+                self.wfile.write(view[offset:offset + CHUNK_SIZE])
+                self._throttle(len(view[offset:offset + CHUNK_SIZE]))
+
+        def _throttle(self, size: int):
+            if server.bandwidth:
+                time.sleep(size / server.bandwidth)
+
+    return Handler
+
+
+def _error(status: int, code: str, message: str) -> tuple[int, dict, dict]:
+    return status, {}, {"error": {"code": code, "message": message}}
+
+
+def _parts(path: str) -> list[str]:
+    return [name for name in path.strip("/").split("/") if name]
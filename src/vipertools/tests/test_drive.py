@@ -0,0 +1,944 @@
+import io
+import os
+import json
+import sys
+import datetime
+import random
+import asyncio
+import zipfile
+import subprocess
+
+import numpy as np
+import pytest
+import requests
+
+from vipertools.graph import codes as status_code
+from vipertools.graph import GraphQuery
+from vipertools.mstools import AsyncDriveTool, DriveTool, ZipStream
+from vipertools.mstools import drive
+from vipertools.mstools.cache import DownloadCache, ListingCache
+from vipertools.mstools.delta import DeltaState
+from vipertools.mstools.manifest import ManifestStore
+from vipertools.mstools.hashing import QuickXorHash, quickxorhash
+from vipertools.tests.mock_graph import MockGraph
+
+KIBIBYTE = 1024
+
+# Upload fragments are multiples of 320 KiB
+FRAGMENT = 320 * KIBIBYTE
+
+
+def _random(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def _reference_hash(data: bytes) -> bytes:
+    # QuickXorHash as specified: every byte is xored into a 160 bit register at a position advancing by 11 bits and
+    # wrapping around, then the length is xored into the last 8 bytes.
+    register = 0
+    for i, byte in enumerate(data):
+        shift = (i * 11) % 160
+        value = byte << shift
+        register ^= (value | (value >> 160)) & ((1 << 160) - 1)
+
+    digest = bytearray(register.to_bytes(20, "little"))
+    for i, byte in enumerate(len(data).to_bytes(8, "little")):
+        digest[12 + i] ^= byte
+
+    return bytes(digest)
+
+
+@pytest.fixture
+def server():
+    with MockGraph() as server:
+        yield server
+
+
+@pytest.fixture
+def tool(server, tmp_path, monkeypatch):
+    # Downloads land in the working directory
+    monkeypatch.chdir(tmp_path)
+
+    with server.graph() as graph:
+        server.reset_stats()
+        yield DriveTool(graph=graph, cache=False, headless=True)
+
+
+def test_import_does_not_load_rich():
+    # rich is only imported by the code that displays something
+    probe = (
+        "import sys\n"
+        "from vipertools.mstools import DriveTool\n"
+        "print([name for name in sys.modules if name.split('.')[0] == 'rich'])"
+    )
+
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
+
+
+# QuickXorHash
+
+@pytest.mark.parametrize("data, expected", [
+    (b"", "AAAAAAAAAAAAAAAAAAAAAAAAAAA="),
+    (b"J", "SgAAAAAAAAAAAAAAAQAAAAAAAAA="),
+])
+def test_quickxorhash_known_vectors(data, expected):
+    assert QuickXorHash(data).b64digest() == expected
+
+
+@pytest.mark.parametrize("size", [1, 19, 20, 21, 160, 1000, 4099])
+def test_quickxorhash_matches_reference(size):
+    data = _random(size, seed=size)
+
+    assert QuickXorHash(data).digest() == _reference_hash(data)
+
+
+def test_quickxorhash_is_independent_of_chunking(tmp_path):
+    data = _random(100 * KIBIBYTE + 7)
+
+    digest = QuickXorHash()
+    for start in range(0, len(data), 4093):
+        digest.update(data[start:start + 4093])
+
+    filename = tmp_path.joinpath("data.bin")
+    filename.write_bytes(data)
+
+    assert digest.b64digest() == QuickXorHash(data).b64digest()
+    assert quickxorhash(str(filename), chunk_size=1000) == QuickXorHash(data).b64digest()
+
+
+# Resumable transfers
+
+def test_interrupted_upload_resumes(server, tool, tmp_path):
+    data = _random(10 * FRAGMENT + 12345)
+    filename = tmp_path.joinpath("upload.bin")
+    filename.write_bytes(data)
+
+    # The fourth fragment fails, the first three are committed in the session
+    server.fail(r"/upload/.*", status=status_code.FORBIDDEN, method="PUT", after=3)
+
+    response = tool.upload(str(filename), path="data", fragment_size=FRAGMENT)
+
+    assert response.status_code == status_code.FORBIDDEN
+    assert tmp_path.joinpath("upload.bin.upload.json").exists()
+    assert server.drive.resolve("data/upload.bin") is None
+
+    server.reset_stats()
+    response = tool.upload(str(filename), path="data", fragment_size=FRAGMENT)
+
+    assert response.status_code in (status_code.OK, status_code.CREATED)
+    assert server.drive.items[server.drive.resolve("data/upload.bin")]["data"] == data
+    assert not tmp_path.joinpath("upload.bin.upload.json").exists()
+
+    # Only the fragments that were not committed are sent again
+    assert server.stats["endpoints"].get("create_session", 0) == 0
+    assert server.stats["endpoints"]["upload_fragment"] == 8
+
+
+def test_interrupted_download_resumes(server, tool, tmp_path):
+    data = _random(8 * 64 * KIBIBYTE)
+    server.drive.add_file("data/download.bin", data=data)
+
+    server.fail(r"/download/.*", status=status_code.FORBIDDEN, after=2)
+
+    response = tool.download("data", "download.bin", connections=4, segment_size=64 * KIBIBYTE)
+
+    assert response.status_code == status_code.FORBIDDEN
+    assert tmp_path.joinpath("download.bin.download.json").exists()
+
+    server.reset_stats()
+    result = tool.download("data", "download.bin", connections=4, segment_size=64 * KIBIBYTE)
+
+    assert result == status_code.OK
+    assert tmp_path.joinpath("download.bin").read_bytes() == data
+    assert not tmp_path.joinpath("download.bin.download.json").exists()
+
+    # Only the failed segment is fetched again
+    assert server.stats["endpoints"]["download"] == 1
+
+
+@pytest.mark.parametrize("fragment_size", [None, FRAGMENT])
+def test_paths_are_quoted(server, tool, tmp_path, fragment_size):
+    # Names with characters that have a meaning in urls, through simple and session uploads
+    folder, name = "scans #1/50% done", "scan ?a=b&c.bin"
+    data = _random(FRAGMENT + 1)
+
+    filename = tmp_path.joinpath(name)
+    filename.write_bytes(data)
+
+    server.drive.add_folder(folder)
+
+    response = tool.upload(str(filename), path=folder, fragment_size=fragment_size)
+
+    assert response.status_code in (status_code.OK, status_code.CREATED)
+    assert server.drive.resolve(f"{folder}/{name}") is not None
+
+    assert [entry["name"] for entry in tool.iter_path(folder)] == [name]
+    assert tool.resolve(folder, name)["size"] == len(data)
+
+    filename.unlink()
+
+    assert tool.download(folder, name) == status_code.OK
+    assert filename.read_bytes() == data
+
+
+# Download cache
+
+def test_listing_cache_counts_stale_records_as_misses(tmp_path):
+    cache = ListingCache(ttl=60.0, directory=tmp_path)
+    cache.put("/folder", entries=[{"name": "a.bin"}], tag="1")
+
+    assert cache.get("/folder")["fresh"]
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    # Read back from disk, the listing has to be revalidated before it is used
+    cache = ListingCache(ttl=60.0, directory=tmp_path)
+    record = cache.get("/folder")
+
+    assert not record["fresh"] and "a.bin" in record["index"]
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    cache.touch("/folder")
+
+    assert cache.get("/folder")["fresh"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_download_cache(server, tool, tmp_path):
+    data = _random(300 * KIBIBYTE)
+    server.drive.add_file("data/file.bin", data=data)
+
+    cache = DownloadCache(str(tmp_path.joinpath("cache")))
+    tool.download_cache = cache
+    index = tmp_path.joinpath("cache", "index.json")
+
+    assert tool.download("data", "file.bin") == status_code.OK
+    written = index.stat().st_mtime_ns
+
+    # Editing a download in place must not reach the cached copy
+    with open("file.bin", "r+b") as file:
+        file.write(b"edited")
+
+    server.reset_stats()
+
+    assert tool.download("data", "file.bin") == status_code.OK
+    assert tmp_path.joinpath("file.bin").read_bytes() == data
+    assert server.stats["endpoints"].get("download", 0) + server.stats["endpoints"].get("content", 0) == 0
+
+    # A hit doesn't rewrite the index, closing the cache does
+    assert index.stat().st_mtime_ns == written
+    assert cache.stats["hits"] == 1
+
+    cache.close()
+
+    assert DownloadCache(str(tmp_path.joinpath("cache"))).stats["hits"] == 1
+
+
+def test_download_cache_drops_modified_copies(server, tool, tmp_path):
+    data = _random(100 * KIBIBYTE)
+    server.drive.add_file("data/file.bin", data=data)
+
+    with DownloadCache(str(tmp_path.joinpath("cache"))) as cache:
+        tool.download_cache = cache
+
+        assert tool.download("data", "file.bin") == status_code.OK
+
+        for cached in tmp_path.joinpath("cache", "objects").iterdir():
+            with open(cached, "r+b") as file:
+                file.write(b"corrupted")
+
+        assert tool.download("data", "file.bin") == status_code.OK
+        assert tmp_path.joinpath("file.bin").read_bytes() == data
+        assert cache.stats["hits"] == 0
+        assert cache.stats["misses"] == 2
+
+        # The download that replaced it is cached again
+        assert tool.download("data", "file.bin") == status_code.OK
+        assert cache.stats["hits"] == 1
+
+
+# Zip streaming
+
+@pytest.fixture
+def directory(tmp_path):
+    root = tmp_path.joinpath("data.ms")
+
+    files = {
+        "table.dat": _random(300 * KIBIBYTE, seed=1),
+        "table.info": b"",
+        "ANTENNA/table.dat": _random(5000, seed=2),
+        "ANTENNA/table.f0": _random(70 * KIBIBYTE, seed=3),
+        "FIELD/nested/table.f1": b"field",
+    }
+
+    for name, data in files.items():
+        root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(name).write_bytes(data)
+
+    return root, files
+
+
+def _check_archive(content: bytes, files: dict) -> None:
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert archive.testzip() is None
+
+        for name, data in files.items():
+            assert archive.read(f"data.ms/{name}") == data
+
+
+def test_zipstream_opens_with_zipfile(directory):
+    root, files = directory
+
+    with ZipStream(str(root)) as stream:
+        content = stream.read()
+
+        assert len(content) == stream.size
+        assert stream.name == "data.ms.zip"
+
+    _check_archive(content, files)
+
+
+def test_zipstream_seek_and_skip(directory):
+    root, files = directory
+
+    with ZipStream(str(root)) as stream:
+        content = stream.read()
+
+    # Skipping over whole members without reading them, as a resumed upload does
+    with ZipStream(str(root)) as stream:
+        middle = stream.size // 2
+
+        assert stream.seek(middle) == middle
+        tail = stream.read()
+
+        stream.seek(0)
+        head = stream.read(middle)
+
+        assert stream.tell() == middle
+
+    assert head + tail == content
+
+    generator = random.Random(0)
+
+    with ZipStream(str(root)) as stream:
+        # Random reads, backwards and forwards, give the bytes of a sequential read
+        for _ in range(200):
+            offset = generator.randrange(stream.size)
+            size = generator.randrange(1, 70 * KIBIBYTE)
+
+            assert stream.seek(offset) == offset
+            assert stream.read(size) == content[offset:offset + size]
+
+    _check_archive(head + tail, files)
+
+
+def test_upload_directory(server, tool, directory):
+    root, files = directory
+
+    response = tool.upload_directory(str(root), path="archives", fragment_size=FRAGMENT)
+
+    assert response.status_code in (status_code.OK, status_code.CREATED)
+
+    item = server.drive.resolve("archives/data.ms.zip")
+    _check_archive(server.drive.items[item]["data"], files)
+
+
+
+def test_extract_fetches_only_the_selected_member(server, tool, directory, tmp_path):
+    root, files = directory
+
+    tool.upload_directory(str(root), path="archives", fragment_size=FRAGMENT)
+    size = len(server.drive.items[server.drive.resolve("archives/data.ms.zip")]["data"])
+
+    members = tool.list_zip("archives", "data.ms.zip")
+    names = [member["name"] for member in members if not member["name"].endswith("/")]
+    assert sorted(names) == sorted(f"data.ms/{name}" for name in files)
+
+    server.reset_stats()
+
+    extracted = tool.extract("archives", "data.ms.zip", members=["data.ms/ANTENNA/table.dat"],
+                             destination=str(tmp_path.joinpath("extracted")))
+
+    target = tmp_path.joinpath("extracted", "data.ms", "ANTENNA", "table.dat")
+
+    assert extracted == [str(target)]
+    assert target.read_bytes() == files["ANTENNA/table.dat"]
+
+    # Only the blocks holding the central directory and the member were asked for, not the whole archive
+    assert server.stats["ranges"] == server.stats["endpoints"]["download"] > 0
+    assert server.stats["downloaded"] < size / 2
+
+
+# Remote arrays
+
+@pytest.mark.parametrize("array", [
+    np.arange(10 * 140, dtype=np.float64).reshape(10, 140),
+    np.asfortranarray(np.arange(10 * 270, dtype=np.int32).reshape(10, 270)),
+    np.arange(10 * 11 * 12, dtype=np.complex64).reshape(10, 11, 12),
+])
+@pytest.mark.parametrize("key", [
+    5,
+    -1,
+    slice(2, 50, 3),
+    slice(None, None, -2),
+    [7, 1, 7, 3],
+    (slice(None), [0, 3]),
+    (-1, slice(2, None)),
+    (Ellipsis, 1),
+    (slice(1, 4), 2),
+    (np.array([True, False] * 5), slice(None)),
+])
+def test_remote_array_indexing(server, tool, array, key):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    server.drive.add_file("arrays/array.npy", data=buffer.getvalue())
+
+    buffer.seek(0)
+    expected = np.load(buffer)
+
+    remote = tool.load_array("arrays", "array.npy", block_size=4 * KIBIBYTE)
+
+    assert remote.shape == expected.shape
+    np.testing.assert_array_equal(remote[key], expected[key])
+    np.testing.assert_array_equal(np.asarray(remote), expected)
+
+
+# Manifest
+
+def _manifest(destination) -> dict:
+    with open(os.path.join(destination, "file.download.json")) as file:
+        return json.load(file)["metadata"]
+
+
+def test_incremental_manifest(server, tool, tmp_path):
+    destination = str(tmp_path.joinpath("manifest"))
+
+    for name in ("a", "b", "c"):
+        server.drive.add_file(f"manifest/{name}.ms.zip", data=name.encode())
+
+    summary = tool.generate_manifest("manifest", version="test", destination=destination, incremental=True)
+
+    assert sorted(summary["added"]) == ["a.ms", "b.ms", "c.ms"]
+    assert sorted(_manifest(destination)) == ["a.ms", "b.ms", "c.ms"]
+
+    # Nothing changed, no link is created again
+    server.reset_stats()
+    summary = tool.generate_manifest("manifest", destination=destination, incremental=True)
+
+    assert sorted(summary["unchanged"]) == ["a.ms", "b.ms", "c.ms"]
+    assert server.stats["endpoints"].get("create_link", 0) == 0
+
+    links = _manifest(destination)
+
+    server.drive.add_file("manifest/d.ms.zip", data=b"d")
+    server.drive.write(server.drive.resolve("manifest/b.ms.zip"), data=b"changed")
+    server.drive.remove(server.drive.resolve("manifest/c.ms.zip"))
+
+    server.reset_stats()
+    summary = tool.generate_manifest("manifest", destination=destination, incremental=True)
+
+    assert summary["added"] == ["d.ms"]
+    assert summary["changed"] == ["b.ms"]
+    assert summary["removed"] == ["c.ms"]
+    assert summary["unchanged"] == ["a.ms"]
+    assert server.stats["endpoints"]["create_link"] == 2
+
+    manifest = _manifest(destination)
+
+    assert sorted(manifest) == ["a.ms", "b.ms", "d.ms"]
+    assert manifest["a.ms"]["id"] == links["a.ms"]["id"]
+    assert manifest["b.ms"]["size"] == len(b"changed")
+
+    # A link that can't be created is reported as failed rather than added, and the key is left for the next run
+    server.drive.add_file("manifest/e.ms.zip", data=b"e")
+    server.fail(r"/me/drive/items/.*/createLink", status=status_code.INTERNAL_SERVER_ERROR)
+
+    summary = tool.generate_manifest("manifest", destination=destination, incremental=True)
+
+    assert summary["added"] == []
+    assert summary["failed"] == ["e.ms"]
+    assert "e.ms" not in _manifest(destination)
+
+    summary = tool.generate_manifest("manifest", destination=destination, incremental=True)
+
+    assert summary["added"] == ["e.ms"]
+    assert summary["failed"] == []
+
+
+def test_download_many_closes_failed_responses(server, tool, tmp_path, monkeypatch):
+    destination = str(tmp_path.joinpath("manifest"))
+
+    for name in ("a", "b", "c"):
+        server.drive.add_file(f"manifest/{name}.ms.zip", data=name.encode())
+
+    tool.generate_manifest("manifest", version="test", destination=destination)
+
+    closed = []
+    close = requests.Response.close
+
+    def record(response):
+        closed.append(response.status_code)
+        close(response)
+
+    monkeypatch.setattr(requests.Response, "close", record)
+
+    server.fail(r"/download/.*", status=status_code.FORBIDDEN, count=3)
+    reports = tool.download_many(
+        manifest=os.path.join(destination, "file.download.json"),
+        destination=str(tmp_path.joinpath("data"))
+    )
+
+    assert [report["status"] for report in reports] == ["failed"] * 3
+    assert closed.count(status_code.FORBIDDEN) == 3
+
+
+def test_partial_recursive_manifest_is_not_written(server, tool, tmp_path):
+    destination = str(tmp_path.joinpath("manifest"))
+
+    for folder in ("one", "two", "three"):
+        for i in range(2):
+            server.drive.add_file(f"tree/{folder}/{folder}{i}.ms.zip", data=b"x")
+
+    summary = tool.generate_manifest("tree", version="test", destination=destination, recursive=True)
+
+    assert len(summary["added"]) == 6
+
+    before = _manifest(destination)
+
+    # A folder that can't be listed must not have its entries taken as removed
+    server.fail(r"/me/drive/root:/tree/two:/children", status=status_code.FORBIDDEN)
+
+    summary = tool.generate_manifest("tree", destination=destination, recursive=True)
+
+    assert summary == {}
+    assert _manifest(destination) == before
+
+
+# Manifest store
+
+MANIFEST_ENTRIES = {
+    "alma_small.ms": {"file": "alma_small.ms.zip", "id": "a", "telescope": "ALMA", "mode": "Holography",
+                      "dtype": "ms", "size": 500_000_000},
+    "alma_large.ms": {"file": "alma_large.ms.zip", "id": "b", "telescope": "alma", "mode": "holography",
+                      "dtype": "ms", "size": 3_000_000_000},
+    "vla_old.ms": {"file": "vla_old.ms.zip", "id": "c", "telescope": "VLA", "mode": "Interferometry",
+                   "dtype": "ms", "size": "0.25"},
+    "vla_image.img": {"file": "vla_image.img.zip", "id": "d", "telescope": "VLA", "mode": "Interferometry",
+                      "dtype": "image", "size": "2.0"},
+}
+
+
+@pytest.fixture
+def manifest_json(tmp_path):
+    filename = tmp_path.joinpath("file.download.json")
+    filename.write_text(json.dumps({"version": "v1", "metadata": MANIFEST_ENTRIES}))
+
+    return filename
+
+
+@pytest.fixture
+def store(tmp_path, manifest_json):
+    with ManifestStore.from_json(str(manifest_json), database=str(tmp_path.joinpath("manifest.db"))) as store:
+        yield store
+
+
+def test_manifest_store_round_trips_json(store, tmp_path, manifest_json):
+    assert store.version == "v1"
+    assert len(store) == 4
+    assert store.metadata() == MANIFEST_ENTRIES
+
+    exported = store.export_json(str(tmp_path.joinpath("exported.json")))
+
+    with open(exported) as file:
+        assert json.load(file) == json.loads(manifest_json.read_text())
+
+    # The database is reopened with the same content
+    store.close()
+    with ManifestStore(str(tmp_path.joinpath("manifest.db"))) as reopened:
+        assert reopened.version == "v1"
+        assert reopened.get("vla_old.ms") == MANIFEST_ENTRIES["vla_old.ms"]
+
+
+def test_manifest_store_query(store):
+    # Attributes are matched ignoring case
+    assert sorted(store.query(telescope="ALMA", mode="HOLOGRAPHY")) == ["alma_large.ms", "alma_small.ms"]
+    assert sorted(store.query(dtype="image")) == ["vla_image.img"]
+
+    # Sizes recorded as GB strings are compared in bytes too
+    assert sorted(store.query(max_size=1_000_000_000)) == ["alma_small.ms", "vla_old.ms"]
+    assert sorted(store.query(min_size=1_000_000_000)) == ["alma_large.ms", "vla_image.img"]
+    assert sorted(store.query(min_size=250_000_000, max_size=500_000_000)) == ["alma_small.ms", "vla_old.ms"]
+    assert store.query(telescope="VLA", min_size=3_000_000_000) == {}
+
+    # Keys keep the order they are given in, unknown ones are left out
+    assert list(store.query(keys=["vla_old.ms", "missing.ms", "alma_small.ms"])) == ["vla_old.ms", "alma_small.ms"]
+
+
+def test_manifest_store_transactions(store, manifest_json):
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.remove(["alma_small.ms"])
+            store.update({"new.ms": {"file": "new.ms.zip", "size": 1}})
+            store.version = "v2"
+
+            raise RuntimeError("interrupted")
+
+    # Nothing of an interrupted transaction is applied, nested ones included
+    assert store.version == "v1"
+    assert store.metadata() == MANIFEST_ENTRIES
+
+    with store.transaction():
+        store.remove(["alma_small.ms", "unknown.ms"])
+        store.update({"new.ms": {"file": "new.ms.zip", "size": 1}})
+
+    assert "alma_small.ms" not in store
+    assert store.get("new.ms") == {"file": "new.ms.zip", "size": 1}
+
+    # Importing without replace keeps the entries the json manifest doesn't have
+    assert store.import_json(str(manifest_json), replace=False) == 4
+    assert sorted(store) == sorted([*MANIFEST_ENTRIES, "new.ms"])
+
+    store.import_json(str(manifest_json))
+    assert sorted(store) == sorted(MANIFEST_ENTRIES)
+
+
+def test_generate_manifest_into_a_store(server, tool, tmp_path):
+    for name in ("a", "b"):
+        server.drive.add_file(f"manifest/{name}.ms.zip", data=name.encode())
+
+    with ManifestStore(str(tmp_path.joinpath("manifest.db"))) as store:
+        summary = tool.generate_manifest("manifest", version="test", incremental=True, store=store)
+
+        assert summary["added"] == ["a.ms", "b.ms"]
+        assert store.version == "test"
+        assert sorted(store) == ["a.ms", "b.ms"]
+
+        server.drive.remove(server.drive.resolve("manifest/a.ms.zip"))
+        summary = tool.generate_manifest("manifest", incremental=True, store=store)
+
+        assert summary["removed"] == ["a.ms"]
+        assert summary["unchanged"] == ["b.ms"]
+        assert sorted(store) == ["b.ms"]
+
+
+# Delta sync
+
+def test_delta(server, tool, tmp_path):
+    destination = str(tmp_path.joinpath("state"))
+
+    for name in ("data/a.bin", "data/sub/b.bin", "data/sub/deep/c.bin", "other/d.bin"):
+        server.drive.add_file(name, data=name.encode())
+
+    summary = tool.delta("data", destination=destination)
+
+    assert sorted(summary["added"]) == [
+        "/data", "/data/a.bin", "/data/sub", "/data/sub/b.bin", "/data/sub/deep", "/data/sub/deep/c.bin"
+    ]
+
+    server.drive.write(server.drive.resolve("data/a.bin"), data=b"changed")
+    server.drive.remove(server.drive.resolve("data/sub"))
+    server.drive.add_file("data/e.bin", data=b"e")
+    server.drive.add_file("other/f.bin", data=b"f")
+
+    summary = tool.delta("data", destination=destination)
+
+    assert summary["added"] == ["/data/e.bin"]
+    assert summary["modified"] == ["/data/a.bin"]
+    assert sorted(summary["removed"]) == ["/data/sub", "/data/sub/b.bin", "/data/sub/deep", "/data/sub/deep/c.bin"]
+
+    state = DeltaState(os.path.join(destination, "file.delta.json")).load()
+    paths = sorted(path for path, _ in state.tree("/"))
+
+    assert paths == ["/data", "/data/a.bin", "/data/e.bin", "/other", "/other/d.bin", "/other/f.bin"]
+
+
+def test_delta_state_defaults_to_the_manifest_directory(server, tool, tmp_path, monkeypatch):
+    monkeypatch.setattr(drive, "MANIFEST", str(tmp_path.joinpath("manifest", "file.download.json")))
+
+    server.drive.add_file("data/a.bin", data=b"a")
+    tool.delta()
+
+    assert tmp_path.joinpath("manifest", "file.delta.json").exists()
+    assert not tmp_path.joinpath("file.delta.json").exists()
+
+
+def test_delta_state_follows_moves(tmp_path):
+    state = DeltaState(str(tmp_path.joinpath("file.delta.json")))
+
+    def item(item_id: str, name: str, parent: str, folder: bool = False) -> dict:
+        entry = {"id": item_id, "name": name, "parentReference": {"id": parent}, "cTag": "c", "size": 1}
+
+        if folder:
+            entry["folder"] = {}
+
+        return entry
+
+    state.apply([
+        {"id": "root", "root": {}},
+        item("f", "folder", "root", folder=True),
+        item("x", "x.bin", "f"),
+        item("y", "y.bin", "f")
+    ])
+
+    summary = state.apply([item("x", "x.bin", "root")])
+
+    assert summary["renamed"] == [("/folder/x.bin", "/x.bin")]
+
+    # The moved file is no longer below the folder
+    summary = state.apply([{"id": "f", "deleted": {}}])
+
+    assert sorted(summary["removed"]) == ["/folder", "/folder/y.bin"]
+    assert sorted(path for path, _ in state.tree("/")) == ["/x.bin"]
+
+    state.save()
+    loaded = DeltaState(str(tmp_path.joinpath("file.delta.json"))).load()
+
+    assert loaded.apply([{"id": "x", "deleted": {}}])["removed"] == ["/x.bin"]
+    assert len(loaded) == 0
+
+
+# Directory sync
+
+def _local_files(root) -> dict:
+    return {
+        path.relative_to(root).as_posix(): path.read_bytes()
+        for path in sorted(root.rglob("*")) if path.is_file()
+    }
+
+
+def _remote_file(server, path: str):
+    item = server.drive.resolve(path)
+
+    return None if item is None else server.drive.items[item]["data"]
+
+
+def _set_mtime(filename, timestamp: str) -> None:
+    seconds = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    os.utime(filename, (seconds, seconds))
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path.joinpath("source")
+
+    for name, data in {"a.bin": b"local a", "sub/b.bin": b"local b", "sub/deep/c.bin": b"local c"}.items():
+        root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(name).write_bytes(data)
+
+    return root
+
+
+def test_sync_upload_deletes_only_missing_files(server, tool, source):
+    server.drive.add_file("backup/a.bin", data=b"remote a, older")
+    server.drive.add_file("backup/stale.bin", data=b"stale")
+    server.drive.add_file("backup/sub/old.bin", data=b"old")
+
+    plan = tool.sync(str(source), "backup", delete=True)
+
+    assert plan["upload"] == ["a.bin", "sub/b.bin", "sub/deep/c.bin"]
+    assert plan["delete"] == ["stale.bin", "sub/old.bin"]
+    assert plan["failed"] == []
+
+    for name, data in _local_files(source).items():
+        assert _remote_file(server, f"backup/{name}") == data
+
+    assert _remote_file(server, "backup/stale.bin") is None
+    assert _remote_file(server, "backup/sub/old.bin") is None
+
+    # Without delete the files missing from the source are kept
+    server.drive.add_file("backup/kept.bin", data=b"kept")
+    plan = tool.sync(str(source), "backup")
+
+    assert plan["delete"] == []
+    assert _remote_file(server, "backup/kept.bin") == b"kept"
+
+
+def test_sync_dry_run_changes_nothing(server, tool, source):
+    server.drive.add_file("backup/a.bin", data=b"remote a, older")
+    server.drive.add_file("backup/stale.bin", data=b"stale")
+    server.drive.add_file("mirror/remote.bin", data=b"remote")
+
+    before = {item: dict(record) for item, record in server.drive.items.items()}
+    server.reset_stats()
+
+    plan = tool.sync(str(source), "backup", delete=True, dry_run=True)
+
+    assert plan["upload"] == ["a.bin", "sub/b.bin", "sub/deep/c.bin"]
+    assert plan["delete"] == ["stale.bin"]
+
+    plan = tool.sync(str(source), "mirror", direction="download", delete=True, dry_run=True)
+
+    assert plan["download"] == ["remote.bin"]
+    assert plan["delete"] == ["a.bin", "sub/b.bin", "sub/deep/c.bin"]
+
+    # Only listings were sent, and neither side changed
+    assert set(server.stats["endpoints"]) <= {"item", "children"}
+    assert server.drive.items == before
+    assert _local_files(source) == {"a.bin": b"local a", "sub/b.bin": b"local b", "sub/deep/c.bin": b"local c"}
+
+
+def test_sync_both_ways_keeps_the_newer_copy(server, tool, source):
+    _set_mtime(source.joinpath("a.bin"), "2024-06-01T00:00:00Z")
+    _set_mtime(source.joinpath("sub/b.bin"), "2024-01-01T00:00:00Z")
+
+    # Same size as the local copies, only the modification times and content hashes tell them apart
+    for name, data, mtime in (
+        ("a.bin", b"remote a", "2024-01-01T00:00:00Z"),
+        ("sub/b.bin", b"remote b", "2024-06-01T00:00:00Z")
+    ):
+        server.drive.write(server.drive.add_file(f"shared/{name}", data=data), data, mtime=mtime)
+
+    server.drive.add_file("shared/only/remote.bin", data=b"remote only")
+
+    plan = tool.sync(str(source), "shared", direction="both")
+
+    assert plan["upload"] == ["a.bin", "sub/deep/c.bin"]
+    assert plan["download"] == ["only/remote.bin", "sub/b.bin"]
+    assert plan["failed"] == []
+
+    assert _remote_file(server, "shared/a.bin") == b"local a"
+    assert source.joinpath("sub/b.bin").read_bytes() == b"remote b"
+    assert source.joinpath("only/remote.bin").read_bytes() == b"remote only"
+    assert _remote_file(server, "shared/sub/deep/c.bin") == b"local c"
+
+
+@pytest.mark.parametrize("direction", ["upload", "download", "both"])
+def test_sync_again_is_unchanged(server, tool, source, tmp_path, direction):
+    server.drive.add_file("remote/x.bin", data=b"remote x")
+    server.drive.add_file("remote/sub/y.bin", data=b"remote y")
+
+    local = source if direction != "download" else tmp_path.joinpath("copy")
+    delete = direction != "both"
+
+    tool.sync(str(local), "remote", direction=direction, delete=delete)
+
+    server.reset_stats()
+    plan = tool.sync(str(local), "remote", direction=direction, delete=delete)
+
+    assert plan["upload"] == plan["download"] == plan["delete"] == plan["failed"] == []
+    assert plan["unchanged"] == sorted(_local_files(local))
+
+    # Nothing is transferred and, with the modification times carried over, nothing is hashed either
+    assert set(server.stats["endpoints"]) <= {"item", "children"}
+
+
+# Asynchronous tool
+
+def _run(server, operation):
+    # Run operation(tool) on a fresh event loop with an AsyncDriveTool of its own
+    async def main():
+        # The token is checked from the event loop, as in a service creating its tools there
+        with server.graph(connect=False) as graph:
+            async with AsyncDriveTool(graph=graph) as tool:
+                server.reset_stats()
+                return await operation(tool)
+
+    return asyncio.run(main())
+
+
+def test_async_tool_checks_the_token_without_blocking(server, monkeypatch):
+    def blocking(*args, **kwargs):
+        raise AssertionError("Blocking request sent from the event loop")
+
+    monkeypatch.setattr(GraphQuery, "request", blocking)
+
+    async def main():
+        with server.graph(connect=False) as graph:
+            server.reset_stats()
+
+            tool = AsyncDriveTool(graph=graph)
+            responses = await asyncio.gather(*(tool.get_path("/") for _ in range(5)))
+            await tool.aclose()
+
+            return graph, responses
+
+    graph, responses = asyncio.run(main())
+
+    assert graph.connected
+    assert all(response.status_code == status_code.OK for response in responses)
+
+    # Concurrent first requests share a single check of the token
+    assert server.stats["endpoints"]["me"] == 1
+
+
+def test_async_tool_signs_in_from_the_event_loop(server, monkeypatch):
+    monkeypatch.setattr(GraphQuery, "_sign_in", lambda self, write=False: "signed-in-token")
+
+    async def main():
+        with server.graph(connect=False) as graph:
+            graph.app_token = "None"
+
+            async with AsyncDriveTool(graph=graph) as tool:
+                response = await tool.get_path("/")
+
+            return graph, response
+
+    graph, response = asyncio.run(main())
+
+    assert response.status_code == status_code.OK
+    assert graph.header["Authorization"] == "Bearer signed-in-token"
+
+
+def test_async_download(server, tmp_path):
+    data = _random(3 * 1024 * KIBIBYTE + 5)
+    server.drive.add_file("data/file.bin", data=data)
+
+    result = _run(server, lambda tool: tool.download("data", "file.bin", destination=str(tmp_path)))
+
+    assert result == status_code.OK
+    assert tmp_path.joinpath("file.bin").read_bytes() == data
+
+    # A missing file is a failed response, like any other failure
+    response = _run(server, lambda tool: tool.download("data", "missing.bin", destination=str(tmp_path)))
+
+    assert response.status_code == status_code.NOT_FOUND
+
+
+def test_async_interrupted_upload_resumes(server, tmp_path):
+    data = _random(6 * FRAGMENT + 99)
+    filename = tmp_path.joinpath("upload.bin")
+    filename.write_bytes(data)
+
+    server.fail(r"/upload/.*", status=status_code.FORBIDDEN, method="PUT", after=2)
+
+    response = _run(server, lambda tool: tool.upload(str(filename), path="data", fragment_size=FRAGMENT))
+
+    assert response.status_code == status_code.FORBIDDEN
+
+    response = _run(server, lambda tool: tool.upload(str(filename), path="data", fragment_size=FRAGMENT))
+
+    assert response.status_code in (status_code.OK, status_code.CREATED)
+    assert server.drive.items[server.drive.resolve("data/upload.bin")]["data"] == data
+    assert server.stats["endpoints"]["upload_fragment"] == 5
+
+
+def test_async_batch_is_bounded(server):
+    sub_requests = [{"method": "GET", "url": "/me"} for _ in range(200)]
+
+    responses = _run(server, lambda tool: tool.batch(sub_requests, max_workers=2))
+
+    assert len(responses) == 200
+    assert all(response["status"] == status_code.OK for response in responses.values())
+    assert server.stats["endpoints"]["batch"] == 10
+    assert server.stats["peak"] <= 2
+
+
+def test_async_incremental_manifest(server, tmp_path):
+    destination = str(tmp_path.joinpath("manifest"))
+
+    for name in ("a", "b"):
+        server.drive.add_file(f"manifest/{name}.ms.zip", data=name.encode())
+
+    summary = _run(server, lambda tool: tool.generate_manifest("manifest", version="test", destination=destination))
+
+    assert sorted(summary["added"]) == ["a.ms", "b.ms"]
+
+    server.drive.write(server.drive.resolve("manifest/b.ms.zip"), data=b"changed")
+
+    summary = _run(server, lambda tool: tool.generate_manifest("manifest", destination=destination, incremental=True))
+
+    assert summary["changed"] == ["b.ms"]
+    assert summary["unchanged"] == ["a.ms"]
+    assert server.stats["endpoints"]["create_link"] == 1
+    assert sorted(_manifest(destination)) == ["a.ms", "b.ms"]
@@ -0,0 +1,281 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from vipertools.graph import codes as status_code
+from vipertools.graph.graph import GraphQuery
+from vipertools.graph.metrics import Metrics, endpoint
+from vipertools.graph.scheduler import Scheduler
+from vipertools.graph.token import TokenCache
+from vipertools.tests.mock_graph import MockGraph
+
+
+class Response:
+    # Minimal stand-in for the responses the scheduler looks at
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.headers = {} if headers is None else headers
+
+
+class Credential:
+    # Stand-in for an azure credential, get_token raises the given errors before issuing a token
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def get_token(self, *scopes):
+        from azure.core.credentials import AccessToken
+
+        self.calls += 1
+
+        if self.errors:
+            raise self.errors.pop(0)
+
+        return AccessToken("refreshed-token", int(time.time()) + 3600)
+
+
+@pytest.fixture
+def server():
+    with MockGraph() as server:
+        yield server
+
+
+@pytest.fixture
+def graph(server):
+    with server.graph() as graph:
+        # Creating the graph checks the app-token against /me
+        server.reset_stats()
+        yield graph
+
+
+def test_request_retries_after_429_with_retry_after(server, graph):
+    server.fail(r"/me", status=status_code.TOO_MANY_REQUESTS, count=2, retry_after=0.2)
+
+    started = time.monotonic()
+    response = graph.request("GET", url=f"{graph.base_url}/me", headers=graph.header)
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == status_code.OK
+    assert elapsed >= 0.4
+
+    assert server.stats["requests"] == 3
+    assert graph.scheduler.stats["throttled"] == 2
+    assert graph.scheduler.stats["retries"] == 2
+
+
+def test_throttled_request_halves_the_limit(server, graph):
+    limit = graph.scheduler.stats["limit"]
+
+    server.fail(r"/me", status=status_code.TOO_MANY_REQUESTS, retry_after=0)
+    graph.request("GET", url=f"{graph.base_url}/me", headers=graph.header)
+
+    assert graph.scheduler.stats["limit"] < limit
+
+
+def test_request_gives_up_after_max_retries(server, graph):
+    graph.scheduler.max_retries = 2
+
+    server.fail(r"/me", status=status_code.TOO_MANY_REQUESTS, count=10, retry_after=0)
+    response = graph.request("GET", url=f"{graph.base_url}/me", headers=graph.header)
+
+    assert response.status_code == status_code.TOO_MANY_REQUESTS
+    assert server.stats["requests"] == 3
+
+
+def test_request_does_not_retry_client_errors(server, graph):
+    server.fail(r"/me", status=status_code.FORBIDDEN)
+    response = graph.request("GET", url=f"{graph.base_url}/me", headers=graph.header)
+
+    assert response.status_code == status_code.FORBIDDEN
+    assert server.stats["requests"] == 1
+
+
+def test_request_retries_gateway_timeouts_of_idempotent_methods(server, graph):
+    server.fail(r"/me", status=status_code.GATEWAY_TIMEOUT, retry_after=0)
+    response = graph.request("GET", url=f"{graph.base_url}/me", headers=graph.header)
+
+    assert response.status_code == status_code.OK
+    assert server.stats["requests"] == 2
+
+
+def test_post_is_not_retried_after_a_gateway_timeout(server, graph):
+    item = server.drive.add_file("data/file.bin", data=b"data")
+    url, body, header = graph.build_link_request(item_id=item)
+
+    # The server may have created the link before timing out, sending it again could create another one
+    server.fail(r"/me/drive/items/.*/createLink", status=status_code.GATEWAY_TIMEOUT, retry_after=0)
+    response = graph.request("POST", url=url, json=body, headers=header)
+
+    assert response.status_code == status_code.GATEWAY_TIMEOUT
+    assert server.stats["requests"] == 1
+
+    # A throttled POST was not processed, it is still sent again
+    server.fail(r"/me/drive/items/.*/createLink", status=status_code.TOO_MANY_REQUESTS, retry_after=0)
+    response = graph.request("POST", url=url, json=body, headers=header)
+
+    assert response.status_code == status_code.CREATED
+    assert server.stats["requests"] == 3
+
+
+def test_batch_does_not_retry_post_sub_requests_after_a_gateway_timeout(server, graph):
+    item = server.drive.add_file("data/file.bin", data=b"data")
+    url, body, _ = graph.build_link_request(item_id=item)
+
+    server.fail(r"/me/drive/items/.*/createLink", status=status_code.GATEWAY_TIMEOUT)
+    server.fail(r"/me", status=status_code.GATEWAY_TIMEOUT)
+
+    responses = graph.batch([
+        {"id": "link", "method": "POST", "url": url, "body": body},
+        {"id": "me", "method": "GET", "url": "/me"}
+    ])
+
+    assert responses["link"]["status"] == status_code.GATEWAY_TIMEOUT
+    assert responses["me"]["status"] == status_code.OK
+    assert server.stats["endpoints"].get("create_link", 0) == 0
+
+
+def test_batch_retries_throttled_sub_requests(server, graph):
+    # Two $batch calls, three of the sub-requests are throttled once each
+    server.fail(r"/me", status=status_code.TOO_MANY_REQUESTS, count=3, retry_after=0.1)
+
+    sub_requests = [{"method": "GET", "url": "/me"} for _ in range(25)]
+    responses = graph.batch(sub_requests, max_workers=2)
+
+    assert sorted(responses, key=int) == [str(i) for i in range(25)]
+    assert all(response["status"] == status_code.OK for response in responses.values())
+    assert server.stats["endpoints"]["me"] == 25
+    assert server.stats["endpoints"]["batch"] == 3
+
+
+def test_scheduler_honors_retry_after_async():
+    scheduler = Scheduler(initial=4, base=0.01)
+    responses = [
+        Response(status_code.TOO_MANY_REQUESTS, headers={"Retry-After": "0.2"}),
+        Response(status_code.OK)
+    ]
+
+    async def send():
+        return responses.pop(0)
+
+    started = time.monotonic()
+    response = asyncio.run(scheduler.call_async(send, "GET"))
+
+    assert response.status_code == status_code.OK
+    assert time.monotonic() - started >= 0.2
+    assert scheduler.stats["throttled"] == 1
+    assert scheduler.limit < 4
+
+
+def test_endpoint_collapses_item_ids_and_paths():
+    base_url = "https://graph.example/v1.0"
+
+    assert endpoint(f"{base_url}/me/drive/root:/data/sub/file.bin", base_url) == "/me/drive/root:{path}"
+    assert endpoint(f"{base_url}/me/drive/root:/data/file.bin:/content", base_url) == "/me/drive/root:{path}:/content"
+    assert endpoint(f"{base_url}/me/drive/items/01ABC/createLink", base_url) == "/me/drive/items/{id}/createLink"
+    assert endpoint(f"{base_url}/me/drive/items/01ABC?$select=id", base_url) == "/me/drive/items/{id}"
+    assert endpoint(f"{base_url}/shares/u!aHR0cHM/driveItem", base_url) == "/shares/{id}/driveItem"
+
+    # Pre-authenticated urls are reported by host
+    assert endpoint("https://download.example/files/01ABC?token=secret", base_url) == "download.example"
+
+
+def test_metrics_to_prometheus(server, graph):
+    items = [server.drive.add_file(path, data=b"data") for path in ("data/a.bin", "data/sub/b.bin")]
+    graph.metrics.reset()
+
+    with graph.metrics.operation("links"):
+        for path in ("data/a.bin", "data/sub/b.bin"):
+            graph.request("GET", url=f"{graph.base_url}/me/drive/root:/{path}", headers=graph.header)
+
+        server.fail(r"/me/drive/items/.*/createLink", status=status_code.TOO_MANY_REQUESTS, retry_after=0)
+        for item in items:
+            url, body, header = graph.build_link_request(item_id=item)
+            graph.request("POST", url=url, json=body, headers=header)
+
+        graph.metrics.cache("listing", hit=True)
+
+    lines = graph.metrics.to_prometheus().splitlines()
+
+    get = 'operation="links",endpoint="/me/drive/root:{path}",method="GET"'
+    post = 'operation="links",endpoint="/me/drive/items/{id}/createLink",method="POST"'
+
+    assert "# TYPE vipertools_requests_total counter" in lines
+    assert f'vipertools_requests_total{{{get},status="200"}} 2' in lines
+    assert f'vipertools_requests_total{{{post},status="429"}} 1' in lines
+    assert f'vipertools_requests_total{{{post},status="201"}} 2' in lines
+    assert f"vipertools_request_retries_total{{{post}}} 1" in lines
+    assert f"vipertools_request_throttled_total{{{post}}} 1" in lines
+    assert f"vipertools_request_throttled_total{{{get}}} 0" in lines
+    assert f'vipertools_request_duration_seconds_bucket{{{get},le="+Inf"}} 2' in lines
+    assert f"vipertools_request_duration_seconds_count{{{post}}} 3" in lines
+    assert 'vipertools_operation_duration_seconds_count{operation="links"} 1' in lines
+    assert 'vipertools_operation_errors_total{operation="links"} 0' in lines
+    assert 'vipertools_cache_lookups_total{operation="links",cache="listing",result="hit"} 1' in lines
+    assert 'vipertools_cache_lookups_total{operation="links",cache="listing",result="miss"} 0' in lines
+
+    # Every item shares a series, none of the ids or paths end up in a label
+    assert not any(item in line or "a.bin" in line for line in lines for item in items)
+
+
+def test_metrics_escape_label_values():
+    metrics = Metrics()
+
+    with metrics.operation('say "hi"\\now'):
+        pass
+
+    lines = metrics.to_prometheus(prefix="test").splitlines()
+
+    assert 'test_operation_errors_total{operation="say \\"hi\\"\\\\now"} 0' in lines
+
+
+def _silent_refresh(graph, tmp_path, monkeypatch, credential: Credential, expires_in: float) -> None:
+    # Give graph a cached token it can refresh silently with credential, without touching the real token cache
+    from azure.identity import AuthenticationRecord
+
+    record = AuthenticationRecord("tenant", "client", "https://login.example", "home", "user").serialize()
+
+    graph.token_cache = TokenCache(str(tmp_path.joinpath("token.json")), retry=0.05)
+    graph.token_cache.save(token="cached-token", expires_on=time.time() + expires_in, record=record)
+    graph.app_token = "cached-token"
+
+    monkeypatch.setattr(GraphQuery, "_credential", lambda self, record=None, interactive=True: credential)
+
+
+def test_failed_refresh_is_retried_in_the_background(server, graph, tmp_path, monkeypatch):
+    from azure.core.exceptions import ClientAuthenticationError, ServiceRequestError
+
+    credential = Credential(ServiceRequestError("Connection refused"), ClientAuthenticationError("Sign-in required"))
+    _silent_refresh(graph, tmp_path, monkeypatch, credential, expires_in=600)
+
+    # Exceptions escaping the timer thread end up here instead of stopping the refreshes silently
+    unhandled = []
+    monkeypatch.setattr(threading, "excepthook", unhandled.append)
+
+    graph._schedule_refresh(delay=0)
+
+    # The header is updated last, once the refreshed token has been saved
+    deadline = time.monotonic() + 5
+    while graph.header["Authorization"] != "Bearer refreshed-token" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert unhandled == []
+    assert credential.calls == 3
+    assert graph.app_token == "refreshed-token"
+    assert graph.header["Authorization"] == "Bearer refreshed-token"
+    assert TokenCache(str(tmp_path.joinpath("token.json"))).load().token == "refreshed-token"
+
+
+def test_refresh_is_not_retried_once_the_token_expired(server, graph, tmp_path, monkeypatch):
+    from azure.core.exceptions import ServiceRequestError
+
+    credential = Credential(ServiceRequestError("Connection refused"))
+    _silent_refresh(graph, tmp_path, monkeypatch, credential, expires_in=-1)
+
+    assert graph.refresh() is None
+    assert graph.app_token == "cached-token"
+
+    time.sleep(0.2)
+
+    assert credential.calls == 1